@@ -0,0 +1,297 @@
+import asyncio
+
+from app.common.consts import CARD_NUMBER_DIGITS, PIN_NUMBER_DIGITS
+from app.bank.bank import AsyncBank
+from app.bank.models import Account
+from app.atm.statemachine import STATE_MACHINE, ATMEvent, ATMStatus
+from app.atm.hardware.cardreader import AsyncCardReaderInterface
+from app.atm.hardware.cashbin import AsyncCashBinInterface
+from app.atm.hardware.printer import AsyncPrinterInterface
+from app.atm.receipt import ReceiptRenderer
+from app.errors.exceptions import *
+from app.utils.logger import logger
+
+
+class AsyncATMController:
+    """
+    ATM Controller Class for asyncio
+
+    Works like ATMController, but every call to the bank and the hardwares is awaitable.
+    So one event loop can drive many terminals, and independent steps of a terminal
+    (printing a receipt, ejecting the card, ...) are running at the same time.
+    """
+    bank: AsyncBank
+    """Interface to the bank"""
+    card_reader: AsyncCardReaderInterface
+    """Interface to card reader hardware"""
+    cash_bin: AsyncCashBinInterface
+    """Interface to cash bin hardware"""
+    printer: AsyncPrinterInterface
+    """Interface to receipt printer hardware"""
+    receipts: ReceiptRenderer
+    """Precompiled receipt templates"""
+    status: int
+    """Status of ATM Controller"""
+
+    def __init__(self,
+                 bank: AsyncBank,
+                 reader: AsyncCardReaderInterface,
+                 cashbin: AsyncCashBinInterface,
+                 printer: AsyncPrinterInterface):
+        self.bank = bank
+        self.card_reader = reader
+        self.cash_bin = cashbin
+        self.printer = printer
+        self.receipts = ReceiptRenderer()
+        self.status = ATMStatus.ATM_NO_CARD
+
+    async def insert_card(self, card_number: str):
+        """
+        Virtually, insert card for test
+        """
+        self._require(ATMEvent.CARD_INSERTED, "insert_card")
+        await self.card_reader.insert_card(card_number)
+        self._fire(ATMEvent.CARD_INSERTED)
+        logger.info("INSERTED_CARD:%s", card_number)
+
+    async def read_card_number(self) -> str:
+        """
+        Read the number of the card in card reader hardware
+
+        :return: the string of numbers of inserted card
+        """
+        # Check: ATM Status
+        self._require(ATMEvent.CARD_REGISTERED, "read_card_number")
+        card_number = await self.card_reader.read()
+        if card_number.isdecimal() and len(card_number) == CARD_NUMBER_DIGITS:
+            # Check: is it registered?
+            if await self.bank.is_registered(card_number):
+                self._fire(ATMEvent.CARD_REGISTERED)
+                logger.info("REGISTERED_CARD:%s", card_number)
+                return card_number
+            else:
+                logger.info("UNREGISTERED_CARD:%s", card_number)
+                await self.reset()
+                raise UnregisteredCardNumberException("Unregistered Card")
+
+        else:
+            logger.error("INVALID_CARD_FORMAT:%s", card_number)
+            raise InvalidCardNumberException(card_number)
+
+    async def validate_pin_number(self, entered_pin: str):
+        """
+        Ask entered-PIN's validity to the bank
+
+        :param entered_pin: PIN entered from UI
+        :return: PIN is correct(True) or not(False)
+        """
+        # Check ATM Status
+        self._require(ATMEvent.PIN_CORRECT, "validate_pin_number")
+        # Check PIN number format
+        if entered_pin.isdecimal() and len(entered_pin) == PIN_NUMBER_DIGITS:
+            if await self.bank.validate(entered_pin=entered_pin):
+                self._fire(ATMEvent.PIN_CORRECT)
+                logger.info("PIN_IS_CORRECT")
+                return True
+            else:
+                logger.info("PIN_IS_INCORRECT")
+                await self.reset()
+                raise IncorrectPinNumberException(entered_pin)
+        else:
+            logger.error("INVALID_PIN_FORMAT:%s", entered_pin)
+            raise InvalidPinNumberException(entered_pin)
+
+    async def get_accounts(self) -> list:
+        """
+        Get a list of accounts from the bank
+
+        :return: List of accounts
+        """
+        # Check ATM Status
+        self._require(ATMEvent.ACCOUNTS_READY, "get_accounts")
+        res, accounts = await self.bank.account_list()
+        if len(accounts) > 0:
+            self._fire(ATMEvent.ACCOUNTS_READY)
+            logger.info("ACCOUNTS_DATA: %s", accounts)
+            return accounts
+        else:
+            # If there is no account, ATM ejects card and reset itself.
+            logger.info("NO_ACCOUNTS")
+            card_number = self.bank.card_number
+            await self.reset()
+            raise NoAccountException(card_number)
+
+    async def select_account(self, acc_idx: int) -> Account:
+        """
+        Select an account to GetBalance, Deposit or Withdraw
+
+        :param acc_idx: selected index of accounts list
+        :return: Account: selected account info
+        """
+        # Check ATM Status
+        self._require(ATMEvent.ACCOUNT_SELECTED, "select_account")
+        account = self.bank.select_account(acc_idx)
+        self._fire(ATMEvent.ACCOUNT_SELECTED)
+        logger.info("ACCOUNT_SELECTED: %s", acc_idx)
+        return account
+
+    async def get_balance(self) -> int:
+        """
+        Get the balance of the selected account
+
+        :return: int: current balance of the account
+        """
+        # Check ATM Status
+        self._require(ATMEvent.TRANSACTION, "get_balance")
+        logger.info("BANK_BALANCE_START")
+        account = Account.coerce(self.bank.get_account())
+        if "balance" in account:
+            logger.info("BANK_BALANCE_OK")
+            # At the end of workflow, print a receipt and eject the card at the same time.
+            await self._finish(self._print_receipt(self.receipts.balance(account)))
+            return account["balance"]
+        else:
+            logger.error("INVALID_ACCOUNT_INFO")
+            raise InvalidAccountInfoException(account)
+
+    async def deposit(self, amount: int) -> Account:
+        """
+        Update the bank account for deposit
+
+        :param amount: the amount of money in the money counter
+        :return: updated account info.
+        """
+        # Check ATM Status
+        self._require(ATMEvent.TRANSACTION, "deposit")
+        # Check the value of amount
+        if amount <= 0:
+            logger.error("INVALID_DEPOSIT_VALUE:%s", amount)
+            raise InvalidAmountValueException(amount)
+        logger.info("BANK_DEPOSIT_START:%s", amount)
+        # Update account of the bank
+        res, account = await self.bank.update_account(acc_idx=self.bank.selected, amount=amount)
+        if res:
+            logger.info("BANK_DEPOSIT_OK")
+            await self._finish(self._push_money(), self._print_receipt(self.receipts.deposit(account, amount)))
+            return account
+        else:
+            logger.error("BANK_DEPOSIT_FAIL")
+            await self._finish(self.open_door())
+            raise UpdateAccountFailedException()
+
+    async def withdraw(self, amount: int) -> Account:
+        """
+        Update the bank account for withdraw
+
+        :param amount: the amount of money to withdraw
+        :return: updated account info.
+        """
+        # Check ATM Status
+        self._require(ATMEvent.TRANSACTION, "withdraw")
+        # Check the value of amount
+        if amount <= 0:
+            logger.error("INVALID_WITHDRAW_VALUE:%s", amount)
+            raise InvalidAmountValueException(amount)
+        # Check the balance of the selected account
+        current_balance = self.bank.get_account().balance
+        if amount > current_balance:
+            logger.info("NOT_ENOUGH_MONEY_IN_ACCOUNT:%s > %s", amount, current_balance)
+            await self.reset()
+            raise NotEnoughMoneyInAccountException(current_balance)
+        # Check available money in the cash bin
+        available_money = await self.cash_bin.get_available_money()
+        if amount > available_money:
+            logger.info("NOT_ENOUGH_MONEY_IN_CASH_BIN:%s > %s", amount, available_money)
+            await self.reset()
+            raise NotEnoughMoneyInCashBinException(available_money)
+        # Check the notes in the cash bin can make the amount, before the bank is charged
+        if not await self.cash_bin.can_dispense(amount):
+            logger.info("UNDISPENSABLE_AMOUNT:%s", amount)
+            await self.reset()
+            raise UndispensableAmountException(amount)
+        logger.info("BANK_WITHDRAW_START:%s", amount)
+        # Update account of the bank (amount = -amount)
+        res, account = await self.bank.update_account(acc_idx=self.bank.selected, amount=-amount)
+        if res:
+            logger.info("BANK_WITHDRAW_OK")
+            await self._finish(self._pop_money(amount), self._print_receipt(self.receipts.withdraw(account, amount)))
+            return account
+        else:
+            logger.info("BANK_WITHDRAW_FAIL")
+            await self.reset()
+            raise UpdateAccountFailedException()
+
+    async def reset(self):
+        """
+        Ejects card & Return to initial state
+        """
+        await self._eject()
+        self._clear()
+
+    async def open_door(self):
+        """Open money counter"""
+        await self.cash_bin.open()
+        logger.info("DOOR_OPENED")
+
+    async def close_door(self):
+        """Close money counter"""
+        await self.cash_bin.close()
+        logger.info("DOOR_CLOSED")
+
+    async def count_money(self) -> int:
+        """Count money in money counter"""
+        count = await self.cash_bin.count_money()
+        logger.info("MONEY_COUNTED: %s", count)
+        return count
+
+    async def send_diagnosis(self):
+        """Send diagnosis data for remote monitoring"""
+        logger.info("SENT_DIAGNOSIS_DATA")
+
+    async def _finish(self, *actions):
+        """
+        Run the physical actions at the end of a transaction with ejecting the card, and reset.
+
+        Waits for all of them, so it takes as long as the slowest device.
+        Every failure is collected and raised together after the controller is reset.
+        """
+        results = await asyncio.gather(*actions, self._eject(), return_exceptions=True)
+        self._clear()
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            logger.error("DEVICE_ACTIONS_FAILED: %s", errors)
+            raise DeviceActionsFailedException(errors)
+
+    async def _eject(self):
+        await self.card_reader.eject()
+        logger.info("EJECTED_CARD")
+
+    def _require(self, event: int, where: str):
+        """Check the guard of the event in the transition table"""
+        if not STATE_MACHINE.allowed(self.status, event):
+            logger.error("INVALID_STATUS:%s at %s", self.status, where)
+            raise InvalidATMStatusException(self.status)
+
+    def _fire(self, event: int):
+        """Change the status as the transition table says"""
+        self.status = STATE_MACHINE.next_status(self.status, event)
+
+    def _clear(self):
+        self.bank.reset()
+        if STATE_MACHINE.allowed(self.status, ATMEvent.RESET):
+            self._fire(ATMEvent.RESET)
+        logger.info("RESET\n")
+
+    async def _print_receipt(self, data: bytes):
+        await self.printer.print_receipt(data)
+        logger.info("PRINT_RECEIPT")
+
+    async def _push_money(self):
+        await self.cash_bin.push_money()
+        logger.info("PUSH_MONEY")
+
+    async def _pop_money(self, amount: int):
+        # The door can be opened only after the money is in the money counter.
+        await self.cash_bin.pop_money(amount=amount)
+        logger.info("POP_MONEY")
+        await self.open_door()
@@ -1,63 +1,108 @@
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Container, Optional
+
 from app.common.consts import CARD_NUMBER_DIGITS, PIN_NUMBER_DIGITS
-from app.bank.bank import Bank
+from app.bank.bank import Bank, BankSession
+from app.bank.models import Account
 from app.atm.hardware.cardreader import CardReaderInterface
 from app.atm.hardware.cashbin import CashBinInterface
 from app.atm.hardware.printer import PrinterInterface
+from app.atm.receipt import ReceiptRenderer
+from app.atm.statemachine import STATE_MACHINE, ATMEvent, ATMStatus
 from app.errors.exceptions import *
 from app.utils.logger import logger
+from app.utils.metrics import Metrics
+from app.utils.telemetry import TelemetrySpool
 
 
-class ATMStatus:
-    ATM_NEED_MAINTENANCE = -1   # "NEED_MAINTENANCE"
-    """ATM need to be checked for maintenance"""
-    ATM_INIT = 0                # "INITIALIZING"
-    """In initializing process after booting ATM"""
-    ATM_NO_CARD = 10            # "NO_CARD_INSERTED"
-    """Initial state when ATM is ready"""
-    ATM_CARD_IN = 20            # "CARD_INSERTED"
-    """A user inserted a card into the card reader of this ATM"""
-    ATM_REGISTERED_CARD = 21    # "REGISTERED_CARD"
-    """User inserted a registered card."""
-    ATM_VALID_PIN = 30          # "VALID_PIN"
-    """User entered correct PIN number"""
-    ATM_ACCOUNTS_READY = 40     # "ACCOUNTS_READY"
-    """ATM got some informations of accounts of user's."""
-    ATM_ACCOUNT_SELECTED = 41   # "ACCOUNT_SELECTED"
-    """User selected one of accounts to work with"""
+def _locked(method: Callable) -> Callable:
+    """Run a step of the controller holding its lock"""
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return locked
 
 
 class ATMController:
     """Basic ATM Controller Class"""
     bank: Bank
-    """Interface to the bank"""
+    """Interface to the bank, can be shared by many controllers"""
+    session: BankSession
+    """Bank session of the current customer, opened when a card is inserted"""
     card_reader: CardReaderInterface
     """Interface to card reader hardware"""
     cash_bin: CashBinInterface
     """Interface to cash bin hardware"""
     printer: PrinterInterface
     """Interface to receipt printer hardware"""
+    receipts: ReceiptRenderer
+    """Precompiled receipt templates"""
     status: int
     """Status of ATM Controller"""
+    parallel_devices: bool
+    """Run physical actions (dispense, print, eject) at the same time after the bank confirms"""
+    card_filter: Optional[Container[str]]
+    """Local filter of registered cards (e.g. RefreshingCardFilter), checked before the bank"""
+    metrics: Metrics
+    """Latency of state transitions and of bank/hardware calls, sent by send_diagnosis()"""
+    telemetry: Optional[TelemetrySpool]
+    """Spool to send diagnosis data off the device"""
+    lock: threading.RLock
+    """
+    Serializes the steps which change the session or the status, e.g. the customer flow and
+    the CardReaderHub callbacks on the hub thread. The door and counter steps are not locked,
+    the device threads of parallel_devices call them.
+    """
 
     def __init__(self,
                  bank: Bank,
                  reader: CardReaderInterface,
                  cashbin: CashBinInterface,
-                 printer: PrinterInterface):
+                 printer: PrinterInterface,
+                 parallel_devices: bool = False,
+                 card_filter: Optional[Container[str]] = None,
+                 metrics: Optional[Metrics] = None,
+                 telemetry: Optional[TelemetrySpool] = None):
         self.bank = bank
+        self.session = bank.open_session()
         self.card_reader = reader
         self.cash_bin = cashbin
         self.printer = printer
+        self.receipts = ReceiptRenderer()
         self.status = ATMStatus.ATM_NO_CARD
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._status_since = self.metrics.clock()
+        self.telemetry = telemetry
+        self.parallel_devices = parallel_devices
+        self.card_filter = card_filter
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.lock = threading.RLock()
 
+    @_locked
     def insert_card(self, card_number: str):
         """
         Virtually, insert card for test
         """
+        self._require(ATMEvent.CARD_INSERTED, "insert_card")
         self.card_reader.insert_card(card_number)
-        self.status = ATMStatus.ATM_CARD_IN
-        logger.info(f"INSERTED_CARD:{card_number}")
+        self.session = self.bank.open_session()
+        self._fire(ATMEvent.CARD_INSERTED)
+        logger.info("INSERTED_CARD:%s", card_number)
 
+    @_locked
+    def card_removed(self):
+        """
+        The card was taken out of the card reader, e.g. an event of PipeCardReader
+        """
+        if self.status <= ATMStatus.ATM_NO_CARD:
+            return
+        logger.info("REMOVED_CARD")
+        self._clear()
+
+    @_locked
     def read_card_number(self) -> str:
         """
         Read the number of the card in card reader hardware
@@ -65,25 +110,25 @@ class ATMController:
         :return: the string of numbers of inserted card
         """
         # Check: ATM Status
-        if self.status < ATMStatus.ATM_CARD_IN:
-            logger.error(f"INVALID_STATUS:{self.status} at read_card_number")
-            raise InvalidATMStatusException(self.status)
-        card_number = self.card_reader.read()
+        self._require(ATMEvent.CARD_REGISTERED, "read_card_number")
+        card_number = self.metrics.timed("card_reader.read", self.card_reader.read)
         if card_number.isdecimal() and len(card_number) == CARD_NUMBER_DIGITS:
-            # Check: is it registered?
-            if self.bank.is_registered(card_number):
-                self.status = ATMStatus.ATM_REGISTERED_CARD
-                logger.info(f"REGISTERED_CARD:{card_number}")
+            # Check: is it registered? (cards not in the filter are not registered for sure)
+            if ((self.card_filter is None or card_number in self.card_filter)
+                    and self.metrics.timed("bank.is_registered", self.session.is_registered, card_number)):
+                self._fire(ATMEvent.CARD_REGISTERED)
+                logger.info("REGISTERED_CARD:%s", card_number)
                 return card_number
             else:
-                logger.info(f"UNREGISTERED_CARD:{card_number}")
+                logger.info("UNREGISTERED_CARD:%s", card_number)
                 self.reset()
                 raise UnregisteredCardNumberException("Unregistered Card")
 
         else:
-            logger.error(f"INVALID_CARD_FORMAT:{card_number}")
+            logger.error("INVALID_CARD_FORMAT:%s", card_number)
             raise InvalidCardNumberException(card_number)
 
+    @_locked
     def validate_pin_number(self, entered_pin: str):
         """
         Ask entered-PIN's validity to the bank
@@ -92,24 +137,23 @@ class ATMController:
         :return: PIN is correct(True) or not(False)
         """
         # Check ATM Status
-        if self.status < ATMStatus.ATM_REGISTERED_CARD:
-            logger.error(f"INVALID_STATUS:{self.status} at validate_pin_number")
-            raise InvalidATMStatusException(self.status)
+        self._require(ATMEvent.PIN_CORRECT, "validate_pin_number")
         # Check PIN number format
         if entered_pin.isdecimal() and len(entered_pin) == PIN_NUMBER_DIGITS:
-            if self.bank.validate(entered_pin=entered_pin):
-                self.status = ATMStatus.ATM_VALID_PIN
-                logger.info(f"PIN_IS_CORRECT")
+            if self.metrics.timed("bank.validate", self.session.validate, entered_pin=entered_pin):
+                self._fire(ATMEvent.PIN_CORRECT)
+                logger.info("PIN_IS_CORRECT")
                 return True
             else:
-                logger.info(f"PIN_IS_INCORRECT")
+                logger.info("PIN_IS_INCORRECT")
                 self.reset()
                 raise IncorrectPinNumberException(entered_pin)
                 # return False
         else:
-            logger.error(f"INVALID_PIN_FORMAT:{entered_pin}")
+            logger.error("INVALID_PIN_FORMAT:%s", entered_pin)
             raise InvalidPinNumberException(entered_pin)
 
+    @_locked
     def get_accounts(self) -> list:
         """
         Get a list of accounts from the bank
@@ -117,36 +161,34 @@ class ATMController:
         :return: List of accounts
         """
         # Check ATM Status
-        if self.status < ATMStatus.ATM_VALID_PIN:
-            logger.error(f"INVALID_STATUS:{self.status} at get_accounts")
-            raise InvalidATMStatusException(self.status)
-        res, accounts = self.bank.account_list()
+        self._require(ATMEvent.ACCOUNTS_READY, "get_accounts")
+        res, accounts = self.metrics.timed("bank.account_list", self.session.account_list)
         if len(accounts) > 0:
-            self.status = ATMStatus.ATM_ACCOUNTS_READY
-            logger.info(f"ACCOUNTS_DATA: {accounts}")
+            self._fire(ATMEvent.ACCOUNTS_READY)
+            logger.info("ACCOUNTS_DATA: %s", accounts)
             return accounts
         else:
             # If there is no account, ATM ejects card and reset itself.
-            logger.info(f"NO_ACCOUNTS")
+            logger.info("NO_ACCOUNTS")
             self.reset()
-            raise NoAccountException(self.bank.card_number)
+            raise NoAccountException(self.session.card_number)
 
-    def select_account(self, acc_idx: int) -> dict:
+    @_locked
+    def select_account(self, acc_idx: int) -> Account:
         """
         Select an account to GetBalance, Deposit or Withdraw
 
         :param acc_idx: selected index of accounts list
-        :return: dict: selected account info
+        :return: Account: selected account info
         """
         # Check ATM Status
-        if self.status < ATMStatus.ATM_ACCOUNTS_READY:
-            logger.error(f"INVALID_STATUS:{self.status} at select_account")
-            raise InvalidATMStatusException(self.status)
-        account = self.bank.select_account(acc_idx)
-        self.status = ATMStatus.ATM_ACCOUNT_SELECTED
-        logger.info(f"ACCOUNT_SELECTED: {acc_idx}")
+        self._require(ATMEvent.ACCOUNT_SELECTED, "select_account")
+        account = self.session.select_account(acc_idx)
+        self._fire(ATMEvent.ACCOUNT_SELECTED)
+        logger.info("ACCOUNT_SELECTED: %s", acc_idx)
         return account
 
+    @_locked
     def get_balance(self) -> int:
         """
         Get the balance of the selected account
@@ -154,23 +196,21 @@ class ATMController:
         :return: int: current balance of the account
         """
         # Check ATM Status
-        if self.status < ATMStatus.ATM_ACCOUNT_SELECTED:
-            logger.error(f"INVALID_STATUS:{self.status} at get_balance")
-            raise InvalidATMStatusException(self.status)
-        logger.info(f"BANK_BALANCE_START")
-        account = self.bank.get_account()
+        self._require(ATMEvent.TRANSACTION, "get_balance")
+        logger.info("BANK_BALANCE_START")
+        account = Account.coerce(self.session.get_account())
         if "balance" in account:
-            logger.info(f"BANK_BALANCE_OK")
+            logger.info("BANK_BALANCE_OK")
             # At the end of workflow, print a receipt and reset itself.
-            self.printer.print_receipt(str(account["balance"]))
-            logger.info(f"PRINT_RECEIPT")
+            self._print_receipt(self.receipts.balance(account))
             self.reset()
             return account["balance"]
         else:
-            logger.error(f"INVALID_ACCOUNT_INFO")
+            logger.error("INVALID_ACCOUNT_INFO")
             raise InvalidAccountInfoException(account)
 
-    def deposit(self, amount: int) -> dict:
+    @_locked
+    def deposit(self, amount: int) -> Account:
         """
         Update the bank account for deposit
 
@@ -178,32 +218,28 @@ class ATMController:
         :return: updated account info.
         """
         # Check ATM Status
-        if self.status < ATMStatus.ATM_ACCOUNT_SELECTED:
-            logger.error(f"INVALID_STATUS:{self.status} at deposit")
-            raise InvalidATMStatusException(self.status)
+        self._require(ATMEvent.TRANSACTION, "deposit")
         # Check the value of amount
         if amount <= 0:
-            logger.error(f"INVALID_DEPOSIT_VALUE:{amount}")
+            logger.error("INVALID_DEPOSIT_VALUE:%s", amount)
             raise InvalidAmountValueException(amount)
-        logger.info(f"BANK_DEPOSIT_START")
+        logger.info("BANK_DEPOSIT_START:%s", amount)
         # Update account of the bank
-        res, account = self.bank.update_account(acc_idx=self.bank.selected, amount=amount)
+        res, account = self.metrics.timed("bank.update_account", self.session.update_account,
+                                          acc_idx=self.session.selected, amount=amount)
         if res:
-            logger.info(f"BANK_DEPOSIT_OK")
-            self.cash_bin.push_money()
-            logger.info(f"PUSH_MONEY")
-            self.printer.print_receipt(str(account))
-            logger.info(f"PRINT_RECEIPT")
-            self.reset()
+            logger.info("BANK_DEPOSIT_OK")
+            receipt = self.receipts.deposit(account, amount)
+            self._finish(self._push_money, lambda: self._print_receipt(receipt))
             return account
         else:
-            logger.error(f"BANK_DEPOSIT_FAIL")
-            self.cash_bin.open()
-            logger.info(f"DOOR_OPENED")
+            logger.error("BANK_DEPOSIT_FAIL")
+            self.open_door()
             self.reset()
             raise UpdateAccountFailedException()
 
-    def withdraw(self, amount: int) -> dict:
+    @_locked
+    def withdraw(self, amount: int) -> Account:
         """
         Update the bank account for withdraw
 
@@ -211,68 +247,165 @@ class ATMController:
         :return: updated account info.
         """
         # Check ATM Status
-        if self.status < ATMStatus.ATM_ACCOUNT_SELECTED:
-            logger.error(f"INVALID_STATUS:{self.status} at withdraw")
-            raise InvalidATMStatusException(self.status)
+        self._require(ATMEvent.TRANSACTION, "withdraw")
         # Check the value of amount
         if amount <= 0:
-            logger.error(f"INVALID_WITHDRAW_VALUE:{amount}")
+            logger.error("INVALID_WITHDRAW_VALUE:%s", amount)
             raise InvalidAmountValueException(amount)
         # Check the balance of the selected account
-        current_balance = self.bank.get_account()["balance"]
+        current_balance = self.session.get_account().balance
         if amount > current_balance:
-            logger.info(f"NOT_ENOUGH_MONEY_IN_ACCOUNT:{amount} > {current_balance}")
+            logger.info("NOT_ENOUGH_MONEY_IN_ACCOUNT:%s > %s", amount, current_balance)
             self.reset()
             raise NotEnoughMoneyInAccountException(current_balance)
         # Check available money in the cash bin
         if amount > self.cash_bin.available_money:
-            logger.info(f"NOT_ENOUGH_MONEY_IN_CASH_BIN:{amount} > {self.cash_bin.available_money}")
+            logger.info("NOT_ENOUGH_MONEY_IN_CASH_BIN:%s > %s", amount, self.cash_bin.available_money)
             self.reset()
             raise NotEnoughMoneyInCashBinException(self.cash_bin.available_money)
-        logger.info(f"BANK_WITHDRAW_START")
+        # Check the notes in the cash bin can make the amount, before the bank is charged
+        if not self.metrics.timed("cash_bin.can_dispense", self.cash_bin.can_dispense, amount):
+            logger.info("UNDISPENSABLE_AMOUNT:%s", amount)
+            self.reset()
+            raise UndispensableAmountException(amount)
+        logger.info("BANK_WITHDRAW_START:%s", amount)
         # Update account of the bank (amount = -amount)
-        res, account = self.bank.update_account(acc_idx=self.bank.selected, amount=-amount)
+        res, account = self.metrics.timed("bank.update_account", self.session.update_account,
+                                          acc_idx=self.session.selected, amount=-amount)
         if res:
-            logger.info(f"BANK_WITHDRAW_OK")
-            self.cash_bin.pop_money(amount=amount)
-            logger.info(f"POP_MONEY")
-            self.cash_bin.open()
-            logger.info(f"DOOR_OPENED")
-            self.printer.print_receipt(str(account))
-            logger.info(f"PRINT_RECEIPT")
-            self.reset()
+            logger.info("BANK_WITHDRAW_OK")
+            receipt = self.receipts.withdraw(account, amount)
+            self._finish(lambda: self._pop_money(amount), lambda: self._print_receipt(receipt))
             return account
         else:
-            logger.info(f"BANK_WITHDRAW_FAIL")
+            logger.info("BANK_WITHDRAW_FAIL")
             self.reset()
             raise UpdateAccountFailedException()
 
+    @_locked
     def reset(self):
         """
         Ejects card & Return to initial state
         """
-        self.card_reader.eject()
-        logger.info(f"EJECTED_CARD")
-        self.bank.reset()
-        self.status = ATMStatus.ATM_NO_CARD
-        logger.info(f"RESET\n")
+        self._eject()
+        self._clear()
+
+    @_locked
+    def need_maintenance(self):
+        """
+        A device failed: eject a card if there is one, and refuse customers until boot()
+        """
+        if self.status > ATMStatus.ATM_NO_CARD:
+            self.reset()
+        self._fire(ATMEvent.FAULT)
+        logger.error("NEED_MAINTENANCE")
+
+    @_locked
+    def boot(self):
+        """
+        Initialize again after maintenance
+        """
+        self._fire(ATMEvent.REPAIRED)
+        logger.info("INITIALIZING")
+        self._fire(ATMEvent.BOOTED)
+        logger.info("READY")
 
     def open_door(self):
         """Open money counter"""
-        self.cash_bin.open()
-        logger.info(f"DOOR_OPENED")
+        self.metrics.timed("cash_bin.open", self.cash_bin.open)
+        logger.info("DOOR_OPENED")
 
     def close_door(self):
         """Close money counter"""
-        self.cash_bin.close()
-        logger.info(f"DOOR_CLOSED")
+        self.metrics.timed("cash_bin.close", self.cash_bin.close)
+        logger.info("DOOR_CLOSED")
 
     def count_money(self) -> int:
         """Count money in money counter"""
-        count = self.cash_bin.count_money()
-        logger.info(f"MONEY_COUNTED: {count}")
+        count = self.metrics.timed("cash_bin.count_money", self.cash_bin.count_money)
+        logger.info("MONEY_COUNTED: %s", count)
         return count
 
-    def send_diagnosis(self):
-        """Send diagnosis data for remote monitoring"""
-        logger.info(f"SENT_DIAGNOSIS_DATA")
+    def close(self):
+        """Stop the threads of parallel_devices, e.g. when the simulation or the terminal shuts down"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def send_diagnosis(self) -> dict:
+        """
+        Send diagnosis data for remote monitoring
+
+        :return: snapshot of the metrics, see Metrics.snapshot()
+        """
+        snapshot = self.metrics.snapshot()
+        snapshot["status"] = ATMStatus.name(self.status)
+        if self.telemetry is not None:
+            self.telemetry.emit("diagnosis", snapshot)
+        logger.info("SENT_DIAGNOSIS_DATA")
+        return snapshot
+
+    def _require(self, event: int, where: str):
+        """Check the guard of the event in the transition table"""
+        if not STATE_MACHINE.allowed(self.status, event):
+            logger.error("INVALID_STATUS:%s at %s", self.status, where)
+            raise InvalidATMStatusException(self.status)
+
+    def _fire(self, event: int):
+        """Change the status as the transition table says"""
+        self._transition(STATE_MACHINE.next_status(self.status, event))
+
+    def _transition(self, status: int):
+        """Change the status, and record the time spent in the previous status"""
+        now = self.metrics.clock()
+        name = f"state.{ATMStatus.name(self.status)}->{ATMStatus.name(status)}"
+        self.metrics.record_us(name, (now - self._status_since) // 1000)
+        self.status = status
+        self._status_since = now
+
+    def _finish(self, *actions: Callable):
+        """
+        Run the physical actions at the end of a transaction, eject the card and reset.
+
+        With parallel_devices, all actions run at the same time and this waits for all of them,
+        so it takes as long as the slowest device. Every failure is collected and raised
+        together after the controller is reset.
+        """
+        if not self.parallel_devices:
+            for action in actions:
+                action()
+            self.reset()
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(actions) + 1, thread_name_prefix="atm-devices")
+        futures = [self._executor.submit(action) for action in actions + (self._eject,)]
+        wait(futures)
+        self._clear()
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            logger.error("DEVICE_ACTIONS_FAILED: %s", errors)
+            raise DeviceActionsFailedException(errors)
+
+    def _eject(self):
+        self.metrics.timed("card_reader.eject", self.card_reader.eject)
+        logger.info("EJECTED_CARD")
+
+    def _clear(self):
+        self.session.reset()
+        if STATE_MACHINE.allowed(self.status, ATMEvent.RESET):
+            self._fire(ATMEvent.RESET)
+        logger.info("RESET\n")
+
+    def _print_receipt(self, data: bytes):
+        self.metrics.timed("printer.print_receipt", self.printer.print_receipt, data)
+        logger.info("PRINT_RECEIPT")
+
+    def _push_money(self):
+        self.metrics.timed("cash_bin.push_money", self.cash_bin.push_money)
+        logger.info("PUSH_MONEY")
+
+    def _pop_money(self, amount: int):
+        # The door can be opened only after the money is in the money counter.
+        self.metrics.timed("cash_bin.pop_money", self.cash_bin.pop_money, amount=amount)
+        logger.info("POP_MONEY")
+        self.open_door()
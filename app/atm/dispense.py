@@ -0,0 +1,104 @@
+"""
+Dispense planner of a multi-cassette cash bin
+
+Finds the combination of notes for an amount with the fewest notes. Among combinations
+with the same number of notes, it takes the one which empties no cassette faster than
+the others (the smallest max. fraction taken from one cassette).
+
+First, the amounts each suffix of the cassettes can make are computed as bitsets (a bit
+per multiple of the gcd of the denominations, bounded by the notes in the cassettes).
+An amount which cannot be made is refused without searching. Then a depth-first search
+from the largest denomination only enters branches whose rest can still be made, so the
+first combination found is the greedy one, and branches which cannot beat the best
+combination so far are cut.
+"""
+from functools import reduce
+from math import gcd
+from typing import Dict, List, Optional
+
+
+def plan_dispense(amount: int, cassettes: Dict[int, int]) -> Optional[Dict[int, int]]:
+    """
+    :param amount: money to dispense
+    :param cassettes: {denomination: number of notes}
+    :return: {denomination: number of notes to take}, or None if the amount cannot be made
+    """
+    denominations = sorted((d for d, n in cassettes.items() if n > 0), reverse=True)
+    if amount <= 0 or not denominations:
+        return {} if amount == 0 else None
+    unit = reduce(gcd, denominations)
+    if amount % unit or amount > sum(d * cassettes[d] for d in denominations):
+        return None
+    counts = [cassettes[d] for d in denominations]
+    last = len(denominations) - 1
+    reachable = _reachable(amount // unit, [d // unit for d in denominations], counts)
+    if not reachable[0] >> (amount // unit) & 1:
+        return None
+    used = [0] * len(denominations)
+    best: List = [None, None, None]     # notes, max. fraction, used
+
+    def consider(notes: int):
+        fraction = max(n / c for n, c in zip(used, counts))
+        if best[0] is None or (notes, fraction) < (best[0], best[1]):
+            best[0], best[1], best[2] = notes, fraction, list(used)
+
+    def min_notes(i: int, rest: int) -> float:
+        """Lower bound of the notes for rest from cassettes i.., filling the largest first"""
+        notes = 0
+        for j in range(i, last + 1):
+            d = denominations[j]
+            if rest <= counts[j] * d:
+                return notes + -(-rest // d)
+            notes += counts[j]
+            rest -= counts[j] * d
+        return float("inf")
+
+    def search(i: int, rest: int, notes: int):
+        d = denominations[i]
+        if i == last:
+            if rest % d == 0 and rest // d <= counts[i]:
+                used[i] = rest // d
+                consider(notes + used[i])
+                used[i] = 0
+            return
+        for n in range(min(counts[i], rest // d), -1, -1):
+            used[i] = n
+            left = rest - n * d
+            if left == 0:
+                consider(notes + n)
+                continue
+            if not reachable[i + 1] >> (left // unit) & 1:
+                continue
+            # fewer notes of d never need fewer notes in total, so no smaller n can do better
+            if best[0] is not None and notes + n + min_notes(i + 1, left) > best[0]:
+                break
+            search(i + 1, left, notes + n)
+        used[i] = 0
+
+    search(0, amount, 0)
+    if best[2] is None:
+        return None
+    return {d: n for d, n in zip(denominations, best[2]) if n > 0}
+
+
+def _reachable(units: int, sizes: List[int], counts: List[int]) -> List[int]:
+    """
+    Bitsets of the amounts (in units) which the cassettes i.. can make, for every i
+
+    Bounded knapsack over Python ints: the notes of a cassette are split into
+    groups of 1, 2, 4, ... notes, one shift per group.
+    """
+    full = (1 << (units + 1)) - 1
+    reachable = [0] * (len(sizes) + 1)
+    bits = 1    # 0 can always be made
+    reachable[-1] = bits
+    for i in range(len(sizes) - 1, -1, -1):
+        left = counts[i]
+        group = 1
+        while left > 0:
+            take = min(group, left)
+            bits = (bits | bits << (take * sizes[i])) & full
+            left -= take
+            group *= 2
+        reachable[i] = bits
+    return reachable
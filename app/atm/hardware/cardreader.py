@@ -1,3 +1,12 @@
+import asyncio
+import os
+import selectors
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from app.utils.logger import logger
+
+
 class CardReaderStatus:
     NO_CARD = "NO_CARD"
     CARD_IN = "CARD_IN"
@@ -40,3 +49,232 @@ class TestCardReader(CardReaderInterface):
         self.card_number = card_number
         self.status = CardReaderStatus.CARD_IN
 
+
+class PipeCardReader(CardReaderInterface):
+    """
+    Event-driven card reader on a file descriptor (POSIX only)
+
+    The device (or a pipe/pty standing in for it) writes one event per line:
+    - "IN <card_number>" : a card was inserted
+    - "OUT"              : the card was removed
+
+    Nothing is read until the fd is readable, see CardReaderHub. Events are pushed to
+    on_inserted(card_number) and on_removed().
+    """
+    fd: int
+    on_inserted: Optional[Callable[[str], None]]
+    on_removed: Optional[Callable[[], None]]
+    closed: bool
+    """The device closed its end of the fd"""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        os.set_blocking(fd, False)
+        self.card_number = ""
+        self.status = CardReaderStatus.NO_CARD
+        self.on_inserted = None
+        self.on_removed = None
+        self.closed = False
+        self._buffer = b""
+
+    @classmethod
+    def open_pipe(cls) -> Tuple["PipeCardReader", int]:
+        """
+        Reader on a new pipe, for simulation and testing
+
+        :return: (reader, fd to write the events of the device)
+        """
+        read_fd, write_fd = os.pipe()
+        return cls(read_fd), write_fd
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def read(self) -> str:
+        return self.card_number
+
+    def eject(self):
+        self.card_number = ""
+        self.status = CardReaderStatus.NO_CARD
+
+    def insert_card(self, card_number):
+        self.card_number = card_number
+        self.status = CardReaderStatus.CARD_IN
+
+    def handle_readable(self) -> int:
+        """
+        Read all available events from the fd and push them
+
+        :return: number of events
+        """
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return 0
+        if not data:
+            self.closed = True
+            if self.status == CardReaderStatus.CARD_IN:
+                self._removed()
+            return 0
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        count = 0
+        for line in lines:
+            event, _, card_number = line.decode(errors="replace").strip().partition(" ")
+            if event == "IN":
+                self.insert_card(card_number.strip())
+                if self.on_inserted is not None:
+                    _notify("on_inserted", self.on_inserted, self.card_number)
+                count += 1
+            elif event == "OUT":
+                self._removed()
+                count += 1
+        return count
+
+    def _removed(self):
+        self.eject()
+        if self.on_removed is not None:
+            _notify("on_removed", self.on_removed)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _notify(name: str, callback: Callable, *args):
+    """Run a callback of a reader, a failing callback must not stop the events of other readers"""
+    try:
+        callback(*args)
+    except Exception as e:
+        logger.error("CARD_READER_CALLBACK_FAILED:%s %r", name, e)
+
+
+class CardReaderHub:
+    """
+    Watches many PipeCardReaders from one thread with selectors (epoll on Linux)
+
+    The callbacks of the readers run on the thread calling poll(), e.g. the thread of start().
+    """
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._readers: Dict[int, PipeCardReader] = {}
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ)
+        self._running = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._readers)
+
+    def add(self, reader: PipeCardReader,
+            on_inserted: Optional[Callable[[str], None]] = None,
+            on_removed: Optional[Callable[[], None]] = None):
+        """Start watching the reader"""
+        if on_inserted is not None:
+            reader.on_inserted = on_inserted
+        if on_removed is not None:
+            reader.on_removed = on_removed
+        self._readers[reader.fd] = reader
+        self._selector.register(reader.fd, selectors.EVENT_READ, reader)
+
+    def attach(self, controller):
+        """Push the events of the controller's card reader into the controller (serialized by ATMController.lock)"""
+        self.add(controller.card_reader, controller.insert_card, controller.card_removed)
+
+    def remove(self, reader: PipeCardReader):
+        """Stop watching the reader"""
+        if self._readers.pop(reader.fd, None) is not None:
+            self._selector.unregister(reader.fd)
+
+    def poll(self, timeout: Optional[float] = None) -> int:
+        """
+        Wait until some readers are readable and handle their events
+
+        :param timeout: seconds to wait, None to wait forever
+        :return: number of events
+        """
+        count = 0
+        for key, _ in self._selector.select(timeout):
+            if key.fd == self._wakeup_read:
+                try:
+                    os.read(self._wakeup_read, 4096)
+                except BlockingIOError:
+                    pass
+                continue
+            reader = key.data
+            count += reader.handle_readable()
+            if reader.closed:
+                self.remove(reader)
+        return count
+
+    def start(self):
+        """Handle events in a background thread"""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="card-reader-hub", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            try:
+                self.poll()
+            except Exception as e:
+                if self._running:
+                    logger.error("CARD_READER_HUB_POLL_FAILED:%r", e)
+
+    def stop(self):
+        """Stop the background thread and release the selector"""
+        self._running = False
+        os.write(self._wakeup_write, b"\0")
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._selector.close()
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
+
+
+class AsyncCardReaderInterface:
+    """For implementing REAL card reader with asyncio"""
+    card_number: str
+    status: str
+
+    def __init__(self):
+        pass
+
+    async def read(self):
+        """Read the number of the card in the card reader"""
+        pass
+
+    async def eject(self):
+        """Eject the card from the card reader"""
+        pass
+
+    async def insert_card(self, card_number):
+        """Simulate card insertion event for testing ONLY"""
+        pass
+
+
+class AsyncTestCardReader(AsyncCardReaderInterface):
+    """Wraps TestCardReader and simulates the latency of the device"""
+    def __init__(self, card_number: str = "", latency: float = 0.0):
+        self.reader = TestCardReader(card_number)
+        self.latency = latency
+
+    @property
+    def card_number(self) -> str:
+        return self.reader.card_number
+
+    @property
+    def status(self) -> str:
+        return self.reader.status
+
+    async def read(self) -> str:
+        await asyncio.sleep(self.latency)
+        return self.reader.read()
+
+    async def eject(self):
+        await asyncio.sleep(self.latency)
+        self.reader.eject()
+
+    async def insert_card(self, card_number):
+        self.reader.insert_card(card_number)
@@ -1,3 +1,9 @@
+import asyncio
+from typing import Dict, Optional
+
+from app.atm.dispense import plan_dispense
+
+
 class CashBinState:
     OPENED = "OPENED"
     CLOSED = "CLOSED"
@@ -28,6 +34,10 @@ class CashBinInterface:
         """Get available money to withdraw in the cash bin"""
         pass
 
+    def can_dispense(self, amount: int) -> bool:
+        """Check if the cash bin can pay out exactly the amount"""
+        return amount <= self.available_money
+
     def pop_money(self, amount: int) -> bool:
         """Take out some money from the cash bin"""
         pass
@@ -76,3 +86,175 @@ class TestCashBin(CashBinInterface):
         self._counting_money = amount
 
 
+class CassetteCashBin(CashBinInterface):
+    """
+    Cash bin with a cassette of notes per denomination
+
+    Withdrawals are paid out as planned by plan_dispense(). Deposited money goes to
+    the cassettes only if its notes are known (set_counting_money(amount, notes)),
+    otherwise it is kept apart in the deposit box and cannot be paid out.
+    """
+    cassettes: Dict[int, int]
+    """{denomination: number of notes}"""
+    deposited: int
+    """Money in the deposit box"""
+    last_dispensed: Dict[int, int]
+    """Notes of the last pop_money()"""
+
+    def __init__(self, cassettes: Dict[int, int]):
+        self.cassettes = dict(cassettes)
+        self.deposited = 0
+        self.last_dispensed = {}
+        self._counting_money = 0
+        self._counting_notes: Optional[Dict[int, int]] = None
+        self._plan = (None, None)   # (amount, notes) of the last plan for the current cassettes
+        self.state = CashBinState.CLOSED
+
+    @property
+    def available_money(self) -> int:
+        return sum(d * n for d, n in self.cassettes.items())
+
+    def plan(self, amount: int) -> Optional[Dict[int, int]]:
+        """Notes to pay out the amount, or None if it cannot be paid out exactly"""
+        if self._plan[0] != amount:
+            self._plan = (amount, plan_dispense(amount, self.cassettes))
+        return self._plan[1]
+
+    def can_dispense(self, amount: int) -> bool:
+        return self.plan(amount) is not None
+
+    def open(self):
+        self._counting_money = 0
+        self._counting_notes = None
+        self.state = CashBinState.OPENED
+
+    def close(self):
+        self.state = CashBinState.CLOSED
+
+    def count_money(self) -> int:
+        return self._counting_money
+
+    def get_available_money(self):
+        return self.available_money
+
+    def pop_money(self, amount: int) -> bool:
+        notes = self.plan(amount)
+        if notes is None:
+            return False
+        for d, n in notes.items():
+            self.cassettes[d] -= n
+        self._plan = (None, None)
+        self.last_dispensed = notes
+        self._counting_money = amount
+        return True
+
+    def push_money(self) -> bool:
+        if self._counting_notes is not None:
+            for d, n in self._counting_notes.items():
+                self.cassettes[d] = self.cassettes.get(d, 0) + n
+            self._plan = (None, None)
+        else:
+            self.deposited += self._counting_money
+        self._counting_money = 0
+        self._counting_notes = None
+        return True
+
+    def set_counting_money(self, amount: int, notes: Optional[Dict[int, int]] = None):
+        """
+        :param amount: inserted money
+        :param notes: {denomination: number of notes} of the inserted money, if recognized
+        """
+        if notes is not None and sum(d * n for d, n in notes.items()) != amount:
+            raise ValueError(f"notes {notes} do not make {amount}")
+        self._counting_money = amount
+        self._counting_notes = notes
+
+
+class AsyncCashBinInterface:
+    """For implementing REAL cash bin with asyncio"""
+    available_money: int
+    state: str
+
+    def __init__(self):
+        pass
+
+    async def open(self):
+        """Open the money counter"""
+        pass
+
+    async def close(self):
+        """Close the money counter"""
+        pass
+
+    async def count_money(self) -> int:
+        """Count the amount of money in money counter"""
+        pass
+
+    async def get_available_money(self):
+        """Get available money to withdraw in the cash bin"""
+        pass
+
+    async def can_dispense(self, amount: int) -> bool:
+        """Check if the cash bin can pay out exactly the amount"""
+        return amount <= await self.get_available_money()
+
+    async def pop_money(self, amount: int) -> bool:
+        """Take out some money from the cash bin"""
+        pass
+
+    async def push_money(self) -> bool:
+        """Put the money into the cash bin"""
+        pass
+
+    async def set_counting_money(self, amount):
+        """Simulate money insertion event for testing ONLY"""
+        pass
+
+
+class AsyncTestCashBin(AsyncCashBinInterface):
+    """Wraps TestCashBin (or another cash bin, e.g. CassetteCashBin) and simulates the latency of the device"""
+    def __init__(self, available_money: int = 1000, latency: float = 0.0,
+                 cash_bin: Optional[CashBinInterface] = None):
+        self.cash_bin = cash_bin if cash_bin is not None else TestCashBin(available_money)
+        self.latency = latency
+
+    @property
+    def available_money(self) -> int:
+        return self.cash_bin.available_money
+
+    @available_money.setter
+    def available_money(self, amount: int):
+        self.cash_bin.available_money = amount
+
+    @property
+    def state(self) -> str:
+        return self.cash_bin.state
+
+    async def open(self):
+        await asyncio.sleep(self.latency)
+        self.cash_bin.open()
+
+    async def close(self):
+        await asyncio.sleep(self.latency)
+        self.cash_bin.close()
+
+    async def count_money(self) -> int:
+        await asyncio.sleep(self.latency)
+        return self.cash_bin.count_money()
+
+    async def get_available_money(self):
+        return self.cash_bin.get_available_money()
+
+    async def can_dispense(self, amount: int) -> bool:
+        return self.cash_bin.can_dispense(amount)
+
+    async def pop_money(self, amount: int) -> bool:
+        await asyncio.sleep(self.latency)
+        return self.cash_bin.pop_money(amount)
+
+    async def push_money(self) -> bool:
+        await asyncio.sleep(self.latency)
+        return self.cash_bin.push_money()
+
+    async def set_counting_money(self, amount: int):
+        self.cash_bin.set_counting_money(amount)
@@ -1,3 +1,8 @@
+import asyncio
+import queue
+import threading
+from typing import List
+
 from app.errors.exceptions import NotEnoughPaperInPrinterException
 
 
@@ -30,7 +35,7 @@ class TestPrinter(PrinterInterface):
         Print some text for the receipt
         Paper in printer will be consumed by the length of text data, not by Line Feed
 
-        :param data: string of receipt text
+        :param data: string (or bytes) of receipt text
         """
         length = len(data)
         if length <= self.paper:
@@ -38,3 +43,98 @@ class TestPrinter(PrinterInterface):
         else:
             raise NotEnoughPaperInPrinterException(self.paper)
 
+
+class SpoolingPrinter(PrinterInterface):
+    """
+    Print spool in front of a printer
+
+    print_receipt() only checks the paper and queues the receipt, a background thread prints it.
+    Paper of queued receipts is reserved (by the length of data, like TestPrinter), so running
+    out of paper is still reported to the caller. Failures of the printer itself are kept in errors.
+    """
+    printer: PrinterInterface
+    errors: List[Exception]
+
+    def __init__(self, printer: PrinterInterface, max_pending: int = 16):
+        self.printer = printer
+        self.errors = []
+        self._queue = queue.Queue(max_pending)
+        self._reserved = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="print-spool", daemon=True)
+        self._thread.start()
+
+    @property
+    def paper(self) -> int:
+        return self.get_available_paper()
+
+    def get_available_paper(self):
+        """Paper left after the queued receipts are printed"""
+        return self.printer.get_available_paper() - self._reserved
+
+    def print_receipt(self, data):
+        data = bytes(data)  # the caller may reuse its buffer
+        with self._lock:
+            available = self.get_available_paper()
+            if len(data) > available:
+                raise NotEnoughPaperInPrinterException(available)
+            self._reserved += len(data)
+        self._queue.put(data)   # blocks only if max_pending receipts are waiting
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                self._queue.task_done()
+                return
+            try:
+                self.printer.print_receipt(data)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                with self._lock:
+                    self._reserved -= len(data)
+                self._queue.task_done()
+
+    def join(self):
+        """Wait until all queued receipts are printed"""
+        self._queue.join()
+
+    def close(self):
+        """Print the queued receipts and stop the thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+
+class AsyncPrinterInterface:
+    """For implementing REAL receipt printer with asyncio"""
+    paper: int
+
+    def __init__(self):
+        pass
+
+    async def get_available_paper(self):
+        """Returns the amount of available paper in the printer"""
+        pass
+
+    async def print_receipt(self, data: str):
+        """Print some text for the receipt"""
+        pass
+
+
+class AsyncTestPrinter(AsyncPrinterInterface):
+    """Wraps TestPrinter and simulates the latency of the device"""
+    def __init__(self, paper: int = 1000, latency: float = 0.0):
+        self.printer = TestPrinter(paper)
+        self.latency = latency
+
+    @property
+    def paper(self) -> int:
+        return self.printer.paper
+
+    async def get_available_paper(self):
+        return self.printer.get_available_paper()
+
+    async def print_receipt(self, data: str):
+        await asyncio.sleep(self.latency)
+        self.printer.print_receipt(data)
@@ -0,0 +1,90 @@
+"""
+Receipt rendering with precompiled templates
+
+A template is compiled once into a byte buffer holding all static text, with a fixed-width
+slot for every field ({name:>width} or {name:<width}). Rendering only writes the field
+values into their slots of the same buffer, so nothing is formatted or concatenated per receipt.
+"""
+import re
+from typing import List, Tuple
+
+from app.bank.models import Account
+
+WIDTH = 24
+"""Characters per line, without Line Feed"""
+
+HEADER = "------ ATM RECEIPT -----\n"
+FOOTER = "------- THANK YOU ------\n"
+ACCOUNT_LINE = "ACCOUNT  {acc_num:>15}\n"
+BALANCE_LINE = "BALANCE  {balance:>15}\n"
+DEPOSIT_LINE = "DEPOSIT  {amount:>15}\n"
+WITHDRAW_LINE = "WITHDRAW {amount:>15}\n"
+
+OVERFLOW = b"*"
+"""Fills a slot whose value is too long, a truncated amount must never be printed"""
+
+_FIELD = re.compile(r"\{(\w+):([<>])(\d+)\}")
+
+
+class ReceiptTemplate:
+    """Template compiled into a reusable byte buffer"""
+    fields: List[Tuple[str, int, int, bool]]
+    """(name, offset, width, right-aligned) of each slot"""
+
+    def __init__(self, *sections: str):
+        text = "".join(sections)
+        buffer = bytearray()
+        self.fields = []
+        pos = 0
+        for match in _FIELD.finditer(text):
+            buffer += text[pos:match.start()].encode("ascii")
+            width = int(match.group(3))
+            self.fields.append((match.group(1), len(buffer), width, match.group(2) == ">"))
+            buffer += b" " * width
+            pos = match.end()
+        buffer += text[pos:].encode("ascii")
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def render(self, **values) -> memoryview:
+        """
+        Write the values into the buffer
+
+        :return: view of the buffer, valid until the next render() of this template
+        """
+        buffer = self._buffer
+        for name, offset, width, right in self.fields:
+            value = str(values[name]).encode("ascii", "replace")
+            if len(value) > width:
+                value = OVERFLOW * width
+            elif right:
+                value = value.rjust(width)
+            else:
+                value = value.ljust(width)
+            buffer[offset:offset + width] = value
+        return self._view
+
+
+class ReceiptRenderer:
+    """
+    Receipts of one ATM
+
+    Templates are not thread-safe, so every controller has own renderer.
+    """
+    def __init__(self, header: str = HEADER, footer: str = FOOTER):
+        self.balance_template = ReceiptTemplate(header, ACCOUNT_LINE, BALANCE_LINE, footer)
+        self.deposit_template = ReceiptTemplate(header, DEPOSIT_LINE, ACCOUNT_LINE, BALANCE_LINE, footer)
+        self.withdraw_template = ReceiptTemplate(header, WITHDRAW_LINE, ACCOUNT_LINE, BALANCE_LINE, footer)
+
+    def balance(self, account: Account) -> memoryview:
+        # also an account dict of an adopter, which may have no acc_num
+        return self.balance_template.render(acc_num=account.get("acc_num", ""), balance=account["balance"])
+
+    def deposit(self, account: Account, amount: int) -> memoryview:
+        return self.deposit_template.render(amount=amount, acc_num=account.acc_num, balance=account.balance)
+
+    def withdraw(self, account: Account, amount: int) -> memoryview:
+        return self.withdraw_template.render(amount=amount, acc_num=account.acc_num, balance=account.balance)
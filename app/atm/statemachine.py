@@ -0,0 +1,202 @@
+"""
+Table-driven state machine of the ATM
+
+TRANSITIONS declares for every event the statuses it is allowed in (the guard) and the
+status it leads to. Guards keep the ">= status" rule of the controller: an event which
+needs an inserted card is allowed in every status from CARD_IN on. StateMachine
+precomputes the table, so a guard check is one lookup.
+
+StateVector keeps the statuses of many sessions in a bytearray (one byte each), and
+step(events) advances all of them with bytes.translate() and one big integer addition
+instead of a Python loop, for simulations and hosts driving many terminals.
+"""
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from app.errors.exceptions import InvalidATMStatusException
+
+
+class ATMStatus:
+    ATM_NEED_MAINTENANCE = -1   # "NEED_MAINTENANCE"
+    """ATM need to be checked for maintenance"""
+    ATM_INIT = 0                # "INITIALIZING"
+    """In initializing process after booting ATM"""
+    ATM_NO_CARD = 10            # "NO_CARD_INSERTED"
+    """Initial state when ATM is ready"""
+    ATM_CARD_IN = 20            # "CARD_INSERTED"
+    """A user inserted a card into the card reader of this ATM"""
+    ATM_REGISTERED_CARD = 21    # "REGISTERED_CARD"
+    """User inserted a registered card."""
+    ATM_VALID_PIN = 30          # "VALID_PIN"
+    """User entered correct PIN number"""
+    ATM_ACCOUNTS_READY = 40     # "ACCOUNTS_READY"
+    """ATM got some informations of accounts of user's."""
+    ATM_ACCOUNT_SELECTED = 41   # "ACCOUNT_SELECTED"
+    """User selected one of accounts to work with"""
+
+    @staticmethod
+    def name(status: int) -> str:
+        """Name of the status without ATM_, e.g. CARD_IN"""
+        return _STATUS_NAMES.get(status, str(status))
+
+
+_STATUS_NAMES = {value: name[len("ATM_"):] for name, value in vars(ATMStatus).items() if name.startswith("ATM_")}
+
+
+class ATMEvent:
+    BOOTED = 0
+    """Initializing finished"""
+    CARD_INSERTED = 1
+    CARD_REGISTERED = 2
+    """The inserted card is registered in the bank"""
+    CARD_INVALID = 3
+    """The card number has a wrong format, the card stays in"""
+    PIN_CORRECT = 4
+    PIN_INVALID = 5
+    """The PIN has a wrong format, the user can enter it again"""
+    ACCOUNTS_READY = 6
+    ACCOUNT_SELECTED = 7
+    TRANSACTION = 8
+    """Balance, deposit or withdraw of the selected account"""
+    RESET = 9
+    """Card ejected or removed: end of a transaction, failures"""
+    FAULT = 10
+    """A device needs maintenance"""
+    REPAIRED = 11
+    """Maintenance finished, initialize again"""
+    NONE = 255
+    """No event for this session (StateVector.step)"""
+
+
+class Transition(NamedTuple):
+    event: int
+    min_status: int
+    """The event is allowed in min_status <= status <= max_status"""
+    max_status: Optional[int]
+    """None: no upper bound"""
+    target: Optional[int]
+    """Status after the event, None: the status stays"""
+
+
+S = ATMStatus
+TRANSITIONS: Tuple[Transition, ...] = (
+    Transition(ATMEvent.BOOTED, S.ATM_INIT, S.ATM_INIT, S.ATM_NO_CARD),
+    Transition(ATMEvent.CARD_INSERTED, S.ATM_NO_CARD, None, S.ATM_CARD_IN),
+    Transition(ATMEvent.CARD_REGISTERED, S.ATM_CARD_IN, None, S.ATM_REGISTERED_CARD),
+    Transition(ATMEvent.CARD_INVALID, S.ATM_CARD_IN, None, None),
+    Transition(ATMEvent.PIN_CORRECT, S.ATM_REGISTERED_CARD, None, S.ATM_VALID_PIN),
+    Transition(ATMEvent.PIN_INVALID, S.ATM_REGISTERED_CARD, None, None),
+    Transition(ATMEvent.ACCOUNTS_READY, S.ATM_VALID_PIN, None, S.ATM_ACCOUNTS_READY),
+    Transition(ATMEvent.ACCOUNT_SELECTED, S.ATM_ACCOUNTS_READY, None, S.ATM_ACCOUNT_SELECTED),
+    Transition(ATMEvent.TRANSACTION, S.ATM_ACCOUNT_SELECTED, None, None),
+    Transition(ATMEvent.RESET, S.ATM_NO_CARD, None, S.ATM_NO_CARD),
+    Transition(ATMEvent.FAULT, S.ATM_NEED_MAINTENANCE, None, S.ATM_NEED_MAINTENANCE),
+    Transition(ATMEvent.REPAIRED, S.ATM_NEED_MAINTENANCE, S.ATM_NEED_MAINTENANCE, S.ATM_INIT),
+)
+del S
+
+
+class StateMachine:
+    """Transition table with the guards precomputed per (event, status)"""
+    statuses: Tuple[int, ...]
+    """All statuses in order, StateVector stores the index in this tuple"""
+
+    def __init__(self, transitions: Sequence[Transition] = TRANSITIONS):
+        self.statuses = tuple(sorted(_STATUS_NAMES))
+        self.index = {status: i for i, status in enumerate(self.statuses)}
+        n_events = max(t.event for t in transitions) + 1
+        # _next[event] = {allowed status: next status}
+        self._next: List[Dict[int, int]] = [{} for _ in range(n_events)]
+        for t in transitions:
+            for status in self.statuses:
+                if t.min_status <= status and (t.max_status is None or status <= t.max_status):
+                    self._next[t.event][status] = status if t.target is None else t.target
+        self._build_vector_tables(n_events)
+
+    def _build_vector_tables(self, n_events: int):
+        """
+        Translation tables of StateVector.step()
+
+        A session is encoded as one byte key = row(event) * n_statuses + status index.
+        Row n_events is "no event", row n_events + 1 is "unknown event" (rejected).
+        """
+        n = len(self.statuses)
+        if (n_events + 2) * n > 256:
+            raise ValueError("too many events and statuses for byte keys")
+        rows = bytearray([n_events + 1] * 256)
+        rows[:n_events] = bytes(range(n_events))
+        rows[ATMEvent.NONE] = n_events
+        self._rows = bytes(row * n for row in rows)
+        step = bytearray(i % n for i in range(256))
+        rejected = bytearray(256)
+        for event in range(n_events):
+            for i, status in enumerate(self.statuses):
+                target = self._next[event].get(status)
+                if target is None:
+                    rejected[event * n + i] = 1
+                else:
+                    step[event * n + i] = self.index[target]
+        for i in range(n):
+            rejected[(n_events + 1) * n + i] = 1
+        self._step = bytes(step)
+        self._rejected = bytes(rejected)
+
+    def allowed(self, status: int, event: int) -> bool:
+        return status in self._next[event]
+
+    def next_status(self, status: int, event: int) -> int:
+        """Status after the event, raises InvalidATMStatusException if the guard rejects it"""
+        try:
+            return self._next[event][status]
+        except KeyError:
+            raise InvalidATMStatusException(status) from None
+
+    def vector(self, size: int, status: int = ATMStatus.ATM_NO_CARD) -> "StateVector":
+        return StateVector(self, size, status)
+
+
+class StateVector:
+    """Statuses of many sessions, one byte (index in StateMachine.statuses) each"""
+    machine: StateMachine
+
+    def __init__(self, machine: StateMachine, size: int, status: int = ATMStatus.ATM_NO_CARD):
+        self.machine = machine
+        self.states = bytearray([machine.index[status]]) * size
+
+    def __len__(self):
+        return len(self.states)
+
+    def __getitem__(self, i: int) -> int:
+        return self.machine.statuses[self.states[i]]
+
+    def status_list(self) -> List[int]:
+        statuses = self.machine.statuses
+        return [statuses[i] for i in self.states]
+
+    def count(self, status: int) -> int:
+        """Number of sessions in the status"""
+        return self.states.count(self.machine.index[status])
+
+    def step(self, events: Union[bytes, bytearray, Sequence[int]]) -> bytes:
+        """
+        Apply events[i] to session i, all at once
+
+        A session whose event is rejected by the guard keeps its status.
+
+        :param events: one ATMEvent per session, ATMEvent.NONE for no event
+        :return: 1 for every session whose event was rejected, else 0
+        """
+        if len(events) != len(self.states):
+            raise ValueError("one event per session is needed")
+        if not isinstance(events, (bytes, bytearray)):
+            events = bytes(events)
+        machine = self.machine
+        # every byte of the sum is row * n_statuses + index < 256: adding as one integer has no carries
+        n = len(self.states)
+        keys = (int.from_bytes(events.translate(machine._rows), "little")
+                + int.from_bytes(self.states, "little")).to_bytes(n, "little")
+        self.states = bytearray(keys.translate(machine._step))
+        return keys.translate(machine._rejected)
+
+
+STATE_MACHINE = StateMachine()
+"""Table of the ATMController"""
@@ -1,8 +1,15 @@
-from typing import List
+import asyncio
+import threading
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+from app.bank.models import CardRecord
 
 
 class BankAdopterInterface:
     """For implementing Real Bank API"""
+    thread_safe: bool = False
+    """tx_update_account() may be called by many threads at once, else Bank serializes the calls"""
+
     def __init__(self):
         pass
 
@@ -22,10 +29,56 @@ class BankAdopterInterface:
         """Update account info. for deposit or withdraw"""
         pass
 
+    def card_numbers(self) -> Iterator[str]:
+        """Iterate all registered card numbers, e.g. to build a local filter"""
+        raise NotImplementedError(f"{type(self).__name__} cannot list its card numbers")
+
+    def load(self, records: Iterable[Tuple[str, dict]]):
+        """
+        Add many cards, one by one, e.g. generated test data
+
+        There is no default: the interface has no call to add a single card.
+
+        :param records: [(card_number, {"pin", "accounts"}), ...]
+        """
+        raise NotImplementedError(f"{type(self).__name__} cannot load cards")
+
+    def is_registered_batch(self, card_numbers: Sequence[str]) -> List[bool]:
+        """Check availability of many card numbers at once"""
+        return [self.is_registered(card_number) for card_number in card_numbers]
+
+    def tx_update_accounts_batch(self, items: Sequence[Tuple[str, int, int]], atomic: bool = True) -> List:
+        """
+        Update many accounts at once, e.g. posting queued deposits
+
+        Per-item result is [valid: bool, account]. account is None if the item was not applied.
+        - atomic=True  : all-or-nothing. If any item is invalid, no item is applied.
+        - atomic=False : partial commit. Valid items are applied, invalid items are skipped.
+
+        This default implementation calls tx_update_account() per item, and rolls back
+        the applied items with the opposite amounts if an atomic batch fails.
+
+        :param items: [(token, acc_idx, amount), ...]
+        :return: [committed: bool, results: list], committed is False only if an atomic batch failed
+        """
+        results = []
+        for token, acc_idx, amount in items:
+            res, account = self.tx_update_account(token, acc_idx, amount)
+            results.append([bool(res), account if res else None])
+        if atomic and not all(res for res, _ in results):
+            for (token, acc_idx, amount), result in zip(items, results):
+                if result[0]:
+                    self.tx_update_account(token, acc_idx, -amount)
+                    result[1] = None
+            return [False, results]
+        return [True, results]
+
 
 class TestBankAdopter(BankAdopterInterface):
     """For testing on local env."""
     bank_data: dict
+    """key(card_num), value(CardRecord)"""
+    thread_safe = True
     # data = {
     #     "12345678": {
     #         "pin": "1234",
@@ -38,7 +91,8 @@ class TestBankAdopter(BankAdopterInterface):
 
     def __init__(self):
         super().__init__()
-        self.bank_data = {}  # key(card_num), value({pin, [accounts]})
+        self.bank_data = {}  # key(card_num), value(CardRecord{pin, [accounts]})
+        self._lock = threading.Lock()
 
     def is_registered(self, card_number: str) -> bool:
         return card_number in self.bank_data
@@ -46,8 +100,7 @@ class TestBankAdopter(BankAdopterInterface):
     def validate(self, card_number: str, entered_pin: str) -> List:
         # print("adoter.validate() : ", card_number, entered_pin)
         if card_number in self.bank_data:
-            pin = self.bank_data[card_number]["pin"]
-            if pin == entered_pin:
+            if self.bank_data[card_number].pin == entered_pin:
                 token = card_number[::-1]   # use reversed card_number as a token
                 return [True, token]
         return [False, ""]
@@ -55,22 +108,116 @@ class TestBankAdopter(BankAdopterInterface):
     def account_list(self, token: str) -> List:
         card_number = token[::-1]           # use reversed card_number as a token
         if card_number in self.bank_data:
-            if "accounts" in self.bank_data[card_number]:
-                return [True, self.bank_data[card_number]["accounts"]]
+            return [True, self.bank_data[card_number].accounts]
         return [False, []]
 
     def tx_update_account(self, token: str, acc_idx: int, amount: int) -> List:
         card_number = token[::-1]  # use reversed card_number as a token
         if card_number in self.bank_data:
-            if "accounts" in self.bank_data[card_number]:
-                accounts = self.bank_data[card_number]["accounts"]
-                if len(accounts) > acc_idx >= 0:
-                    acc = accounts[acc_idx]
-                    acc["balance"] += amount
-                    return [True, acc]
+            accounts = self.bank_data[card_number].accounts
+            if len(accounts) > acc_idx >= 0:
+                acc = accounts[acc_idx]
+                with self._lock:
+                    acc.balance += amount
+                return [True, acc]
         return [False, None]
 
+    def card_numbers(self) -> Iterator[str]:
+        return iter(list(self.bank_data))
+
+    def is_registered_batch(self, card_numbers: Sequence[str]) -> List[bool]:
+        bank_data = self.bank_data
+        return [card_number in bank_data for card_number in card_numbers]
+
+    def tx_update_accounts_batch(self, items: Sequence[Tuple[str, int, int]], atomic: bool = True) -> List:
+        # 1st pass: find the accounts of all items
+        bank_data = self.bank_data
+        targets = []
+        for token, acc_idx, amount in items:
+            record = bank_data.get(token[::-1])     # use reversed card_number as a token
+            if record is not None and len(record.accounts) > acc_idx >= 0:
+                targets.append(record.accounts[acc_idx])
+            else:
+                targets.append(None)
+        if atomic and not all(acc is not None for acc in targets):
+            return [False, [[acc is not None, None] for acc in targets]]
+        # 2nd pass: apply
+        results = []
+        with self._lock:
+            for (_, _, amount), acc in zip(items, targets):
+                if acc is None:
+                    results.append([False, None])
+                else:
+                    acc.balance += amount
+                    results.append([True, acc])
+        return [True, results]
+
+    def load(self, records: Iterable[Tuple[str, dict]]):
+        bank_data = self.bank_data
+        for card_number, record in records:
+            bank_data[card_number] = CardRecord.coerce(record)
+
     def set_bank_data(self, data: dict):
-        """For testing only (instead of DB)"""
-        self.bank_data = data
+        """
+        For testing only (instead of DB)
+
+        Records and accounts given as dicts are converted to CardRecord and Account.
+        """
+        self.bank_data = {card_number: CardRecord.coerce(record) for card_number, record in data.items()}
+
+
+class AsyncBankAdopterInterface:
+    """For implementing Real Bank API with non-blocking (asyncio) calls"""
+    def __init__(self):
+        pass
+
+    async def is_registered(self, card_number: str):
+        """Check availability of the card number"""
+        pass
+
+    async def validate(self, card_number: str, entered_pin: str):
+        """Check validity of the entered-PIN number"""
+        pass
+
+    async def account_list(self, token: str):
+        """Get a list of all accounts related to the card number"""
+        pass
+
+    async def tx_update_account(self, token: str, acc_idx: int, amount: int):
+        """Update account info. for deposit or withdraw"""
+        pass
 
+
+class AsyncTestBankAdopter(AsyncBankAdopterInterface):
+    """
+    For testing on local env. with asyncio
+
+    Wraps TestBankAdopter and simulates network latency of each API call.
+    """
+    adopter: TestBankAdopter
+    latency: float
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.adopter = TestBankAdopter()
+        self.latency = latency
+
+    async def is_registered(self, card_number: str) -> bool:
+        await asyncio.sleep(self.latency)
+        return self.adopter.is_registered(card_number)
+
+    async def validate(self, card_number: str, entered_pin: str) -> List:
+        await asyncio.sleep(self.latency)
+        return self.adopter.validate(card_number, entered_pin)
+
+    async def account_list(self, token: str) -> List:
+        await asyncio.sleep(self.latency)
+        return self.adopter.account_list(token)
+
+    async def tx_update_account(self, token: str, acc_idx: int, amount: int) -> List:
+        await asyncio.sleep(self.latency)
+        return self.adopter.tx_update_account(token, acc_idx, amount)
+
+    def set_bank_data(self, data: dict):
+        """For testing only (instead of DB)"""
+        self.adopter.set_bank_data(data)
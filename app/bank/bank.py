@@ -1,21 +1,35 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List, Optional
-from app.bank.adopter import BankAdopterInterface
+from app.bank.adopter import BankAdopterInterface, AsyncBankAdopterInterface
+from app.bank.cache import AccountCache
+from app.bank.models import Account
 from app.errors.exceptions import InvalidIndexException
 
 
-class Bank:
+def _to_accounts(accounts: list) -> List[Account]:
+    """Accounts from the Bank API as Account (e.g. dicts decoded from JSON)"""
+    return [Account.coerce(account) for account in accounts]
+
+
+class BankSession:
     """
-    Manages all about financial info and Bank API
+    Volatile information of one customer, from card insertion to reset
+
+    Created by Bank.open_session(). Sessions of the same Bank share its adopter and cache,
+    but never their card number, token or accounts.
     """
-    adopter: BankAdopterInterface
+    bank: "Bank"
     card_number: str
     entered_pin: str
     token: str
-    accounts: List
+    accounts: List[Account]
     selected: int
 
-    def __init__(self, adopter: BankAdopterInterface):
-        self.adopter = adopter
+    def __init__(self, bank: "Bank"):
+        self.bank = bank
+        self._prefetch: Optional[Future] = None
+        self._prefetch_version = 0
         self.reset()
 
     def is_registered(self, card_number: str) -> bool:
@@ -25,7 +39,7 @@ class Bank:
         :return: True if it is registered
         """
         self.card_number = card_number
-        return self.adopter.is_registered(card_number)
+        return self.bank.adopter.is_registered(card_number)
 
     def validate(self, entered_pin: str, card_number: str = "") -> bool:
         """
@@ -36,16 +50,54 @@ class Bank:
         if len(card_number):
             self.card_number = card_number
         self.entered_pin = entered_pin
-        res, self.token = self.adopter.validate(self.card_number, entered_pin)
+        res, self.token = self.bank.adopter.validate(self.card_number, entered_pin)
+        if res and self.bank.prefetch:
+            self._start_prefetch()
         return res
 
+    def _start_prefetch(self):
+        """Start account_list() in the background while the customer chooses what to do"""
+        self._cancel_prefetch()
+        if self.bank.cache is not None:
+            self._prefetch_version = self.bank.cache.version(self.card_number)
+        self._prefetch = self.bank.executor().submit(self.bank.adopter.account_list, self.token)
+
+    def _cancel_prefetch(self):
+        if self._prefetch is not None:
+            self._prefetch.cancel()     # if it is already running, its result is just dropped
+            self._prefetch = None
+
     def account_list(self) -> [bool, list]:
         """
         Get the information of accounts from the Bank using the token
 
+        If the accounts were prefetched after validate(), this waits for that call
+        instead of asking the Bank again.
+
         :return: [result: bool, accounts: list]
         """
-        res, self.accounts = self.adopter.account_list(self.token)
+        adopter = self.bank.adopter
+        cache = self.bank.cache
+        prefetch, self._prefetch = self._prefetch, None
+        if cache is None or not self.token:
+            res, accounts = prefetch.result() if prefetch is not None else adopter.account_list(self.token)
+            self.accounts = _to_accounts(accounts)
+            return [res, self.accounts]
+        snapshot = cache.get(self.card_number)
+        if snapshot is not None:
+            if prefetch is not None:
+                prefetch.cancel()
+            self.accounts = snapshot.copy_accounts()
+            return [True, self.accounts]
+        if prefetch is not None:
+            version = self._prefetch_version
+            res, accounts = prefetch.result()
+        else:
+            version = cache.version(self.card_number)
+            res, accounts = adopter.account_list(self.token)
+        self.accounts = _to_accounts(accounts)
+        if res:
+            cache.put(self.card_number, self.accounts, since=version)
         return [res, self.accounts]
 
     def select_account(self, acc_idx: int):
@@ -56,7 +108,7 @@ class Bank:
         else:
             raise InvalidIndexException("bank.select_account()")
 
-    def get_account(self, acc_idx: int = -1) -> dict:
+    def get_account(self, acc_idx: int = -1) -> Account:
         """Get account info. using account index in accounts list"""
         if acc_idx < 0 and len(self.accounts) > self.selected >= 0:
             return self.accounts[self.selected]
@@ -71,23 +123,200 @@ class Bank:
 
         :param acc_idx: account index in accounts list
         :param amount: changing amount of money
-        :return: [result: bool, account: dict]
+        :return: [result: bool, account: Account]
         """
         if acc_idx < 0:
             acc_idx = self.selected
         if len(self.accounts) > acc_idx >= 0:
-            res, data = self.adopter.tx_update_account(self.token, acc_idx, amount)
+            adopter = self.bank.adopter
+            if adopter.thread_safe:
+                res, data = adopter.tx_update_account(self.token, acc_idx, amount)
+            else:
+                with self.bank.lock:
+                    res, data = adopter.tx_update_account(self.token, acc_idx, amount)
             if res:
+                data = Account.coerce(data)
                 # self.accounts[self.selected] = data
                 self.accounts[acc_idx] = data
+                if self.bank.cache is not None:
+                    self.bank.cache.update_account(self.card_number, acc_idx, data)
             return [res, data]
         else:
             raise InvalidIndexException("bank.update_account()")
 
     def reset(self):
-        """Remove all volatile information in memory"""
+        """Remove all volatile information in memory, and cancel the prefetch"""
+        self._cancel_prefetch()
         self.card_number = ""
         self.entered_pin = ""
         self.token = ""
         self.accounts = []
         self.selected = -1
+
+
+def _session_attribute(name: str) -> property:
+    """Attribute of Bank forwarded to its default session"""
+    return property(lambda bank: getattr(bank.session, name),
+                    lambda bank, value: setattr(bank.session, name, value),
+                    doc=f"{name} of the default session")
+
+
+class Bank:
+    """
+    Manages all about financial info and Bank API
+
+    One Bank can be shared by many terminals (threads): each customer gets own BankSession
+    from open_session(). For a single terminal, the methods of Bank work on its default session.
+    """
+    adopter: BankAdopterInterface
+    cache: Optional[AccountCache]
+    """Snapshots of accounts kept after reset() (None: no cache)"""
+    lock: threading.Lock
+    """Serializes balance updates of all sessions if the adopter is not thread_safe"""
+    prefetch: bool
+    """Start account_list() in the background as soon as the PIN is valid"""
+    prefetch_workers: int
+    session: BankSession
+    """Default session"""
+
+    card_number = _session_attribute("card_number")
+    entered_pin = _session_attribute("entered_pin")
+    token = _session_attribute("token")
+    accounts = _session_attribute("accounts")
+    selected = _session_attribute("selected")
+
+    def __init__(self, adopter: BankAdopterInterface, cache: Optional[AccountCache] = None,
+                 prefetch: bool = False, prefetch_workers: int = 4):
+        self.adopter = adopter
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.prefetch = prefetch
+        self.prefetch_workers = prefetch_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.session = BankSession(self)
+
+    def open_session(self) -> BankSession:
+        """New session for a customer, e.g. when a card is inserted"""
+        return BankSession(self)
+
+    def executor(self) -> ThreadPoolExecutor:
+        """Thread pool for background calls to the Bank API, shared by all sessions"""
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.prefetch_workers,
+                                                    thread_name_prefix="bank-prefetch")
+            return self._executor
+
+    def close(self):
+        """Stop the background threads"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def is_registered(self, card_number: str) -> bool:
+        """
+        Check whether the card is registered or not
+
+        :return: True if it is registered
+        """
+        return self.session.is_registered(card_number)
+
+    def validate(self, entered_pin: str, card_number: str = "") -> bool:
+        """
+        Check whether PIN number is correct or not
+
+        :return: True if it is correct
+        """
+        return self.session.validate(entered_pin, card_number)
+
+    def account_list(self) -> [bool, list]:
+        """
+        Get the information of accounts from the Bank using the token
+
+        :return: [result: bool, accounts: list]
+        """
+        return self.session.account_list()
+
+    def select_account(self, acc_idx: int):
+        """Select an account using account index in accounts list"""
+        return self.session.select_account(acc_idx)
+
+    def get_account(self, acc_idx: int = -1) -> Account:
+        """Get account info. using account index in accounts list"""
+        return self.session.get_account(acc_idx)
+
+    def update_account(self, amount: int, acc_idx: int = -1):
+        """
+        Change balance of the account
+
+        :param acc_idx: account index in accounts list
+        :param amount: changing amount of money
+        :return: [result: bool, account: Account]
+        """
+        return self.session.update_account(amount, acc_idx)
+
+    def reset(self):
+        """Remove all volatile information in memory"""
+        self.session.reset()
+
+
+class AsyncBank(Bank):
+    """
+    Bank for AsyncATMController
+
+    Same as Bank but every call to the Bank API is awaitable.
+    """
+    adopter: AsyncBankAdopterInterface
+
+    def __init__(self, adopter: AsyncBankAdopterInterface):
+        super().__init__(adopter=adopter)
+
+    async def is_registered(self, card_number: str) -> bool:
+        """
+        Check whether the card is registered or not
+
+        :return: True if it is registered
+        """
+        self.card_number = card_number
+        return await self.adopter.is_registered(card_number)
+
+    async def validate(self, entered_pin: str, card_number: str = "") -> bool:
+        """
+        Check whether PIN number is correct or not
+
+        :return: True if it is correct
+        """
+        if len(card_number):
+            self.card_number = card_number
+        self.entered_pin = entered_pin
+        res, self.token = await self.adopter.validate(self.card_number, entered_pin)
+        return res
+
+    async def account_list(self) -> [bool, list]:
+        """
+        Get the information of accounts from the Bank using the token
+
+        :return: [result: bool, accounts: list]
+        """
+        res, accounts = await self.adopter.account_list(self.token)
+        self.accounts = _to_accounts(accounts)
+        return [res, self.accounts]
+
+    async def update_account(self, amount: int, acc_idx: int = -1):
+        """
+        Change balance of the account
+
+        :param acc_idx: account index in accounts list
+        :param amount: changing amount of money
+        :return: [result: bool, account: Account]
+        """
+        if acc_idx < 0:
+            acc_idx = self.selected
+        if len(self.accounts) > acc_idx >= 0:
+            res, data = await self.adopter.tx_update_account(self.token, acc_idx, amount)
+            if res:
+                data = Account.coerce(data)
+                self.accounts[acc_idx] = data
+            return [res, data]
+        else:
+            raise InvalidIndexException("bank.update_account()")
@@ -0,0 +1,162 @@
+"""
+Bloom filter of registered card numbers
+
+The controller asks the filter before the bank: a card which is not in the filter is
+definitely not registered, so it is rejected without a round trip. A card in the filter
+is probably registered (false positive rate fp_rate) and is checked by the bank as usual.
+"""
+import math
+import threading
+import time
+from hashlib import blake2b
+from typing import Callable, Iterable, List, Optional
+
+from app.utils.logger import logger
+
+
+class BloomFilter:
+    """Bit array with k hash functions (double hashing of one blake2b digest)"""
+    capacity: int
+    """Expected number of cards, fp_rate holds up to this number"""
+    fp_rate: float
+    num_bits: int
+    num_hashes: int
+    count: int
+    """Number of added cards"""
+
+    def __init__(self, capacity: int, fp_rate: float = 0.01, max_bytes: Optional[int] = None):
+        """
+        :param capacity: expected number of cards
+        :param fp_rate: false positive rate at capacity, e.g. 0.01
+        :param max_bytes: upper limit of the memory of the bit array (raises fp_rate)
+        """
+        if capacity <= 0 or not 0 < fp_rate < 1:
+            raise ValueError("capacity must be > 0 and 0 < fp_rate < 1")
+        num_bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        if max_bytes is not None:
+            num_bits = min(num_bits, max_bytes * 8)
+        self.capacity = capacity
+        self.num_bits = max(num_bits, 8)
+        self.num_hashes = max(round(self.num_bits / capacity * math.log(2)), 1)
+        self.fp_rate = (1 - math.exp(-self.num_hashes * capacity / self.num_bits)) ** self.num_hashes
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    @classmethod
+    def from_cards(cls, card_numbers: Iterable[str], capacity: int, fp_rate: float = 0.01,
+                   max_bytes: Optional[int] = None) -> "BloomFilter":
+        bloom = cls(capacity, fp_rate, max_bytes)
+        for card_number in card_numbers:
+            bloom.add(card_number)
+        return bloom
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of the bit array"""
+        return len(self._bits)
+
+    def _positions(self, card_number: str):
+        digest = blake2b(card_number.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        num_bits = self.num_bits
+        return ((h1 + i * h2) % num_bits for i in range(self.num_hashes))
+
+    def add(self, card_number: str):
+        bits = self._bits
+        for pos in self._positions(card_number):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, card_number: str) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(card_number))
+
+
+class RefreshingCardFilter:
+    """
+    Bloom filter rebuilt from the registered cards every interval seconds
+
+    A card registered after the last refresh is rejected until the next one,
+    unless it is add()ed. Use `card_number in card_filter` like a BloomFilter.
+    A failed refresh keeps the current filter and is retried after retry_interval.
+    """
+    source: Callable[[], Iterable[str]]
+    """Returns all registered card numbers, e.g. adopter.card_numbers"""
+    interval: float
+    retry_interval: float
+    refreshed_at: float
+    rejected: int
+    """Number of cards rejected by the filter"""
+
+    def __init__(self, source: Callable[[], Iterable[str]], capacity: int, fp_rate: float = 0.01,
+                 max_bytes: Optional[int] = None, interval: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic, retry_interval: float = 10.0):
+        self.source = source
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.rejected = 0
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._added_while_rebuilding: Optional[List[str]] = None
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild the filter, then swap it in (readers never see a half-built filter)"""
+        with self._refresh_lock:
+            with self._lock:
+                self._added_while_rebuilding = []
+            try:
+                bloom = BloomFilter.from_cards(self.source(), self.capacity, self.fp_rate, self.max_bytes)
+            except BaseException:
+                with self._lock:
+                    self._added_while_rebuilding = None
+                raise
+            with self._lock:
+                # cards add()ed during the rebuild may be missing from the source's result
+                for card_number in self._added_while_rebuilding:
+                    bloom.add(card_number)
+                self._added_while_rebuilding = None
+                self.bloom = bloom
+                self.refreshed_at = self._clock()
+
+    def add(self, card_number: str):
+        """Accept a newly registered card before the next refresh"""
+        with self._lock:
+            self.bloom.add(card_number)
+            if self._added_while_rebuilding is not None:
+                self._added_while_rebuilding.append(card_number)
+
+    def __contains__(self, card_number: str) -> bool:
+        if card_number in self.bloom:
+            return True
+        self.rejected += 1
+        return False
+
+    def start(self):
+        """Refresh in a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="card-filter", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        interval = self.interval
+        while not self._stop.wait(interval):
+            try:
+                self.refresh()
+                interval = self.interval
+            except Exception as e:
+                logger.error("CARD_FILTER_REFRESH_FAILED:%r", e)
+                interval = min(self.retry_interval, self.interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
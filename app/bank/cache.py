@@ -0,0 +1,138 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+
+class AccountSnapshot:
+    """Accounts of one card at some point of time"""
+    __slots__ = ("accounts", "version", "stored_at")
+
+    def __init__(self, accounts: List, version: int, stored_at: float):
+        self.accounts = accounts
+        self.version = version
+        self.stored_at = stored_at
+
+    def copy_accounts(self) -> List:
+        """Copy of accounts, so a caller cannot change the snapshot in the cache"""
+        return [copy.copy(account) for account in self.accounts]
+
+
+class AccountCache:
+    """
+    Bounded LRU/TTL cache of account snapshots keyed by card number
+
+    Every card has a version stamp which goes up whenever its accounts change, cached
+    or not. A result of Bank API is stored only if no newer change was written meanwhile,
+    so a slow account_list() cannot overwrite the result of our own transaction.
+
+    Versions are kept for up to max_versions cards, longer than the snapshots. The
+    versions of forgotten cards are covered by a floor: a fetch which started before
+    the floor is not stored.
+    """
+    capacity: int
+    """Max. number of cards in the cache"""
+    ttl: float
+    """Seconds until a snapshot expires"""
+    max_versions: int
+    """Max. number of cards whose versions are kept"""
+    hits: int
+    misses: int
+
+    def __init__(self, capacity: int = 1024, ttl: float = 30.0, clock: Callable[[], float] = time.monotonic,
+                 max_versions: Optional[int] = None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_versions = max_versions if max_versions is not None else capacity * 4
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries: "OrderedDict[str, AccountSnapshot]" = OrderedDict()
+        self._versions: "OrderedDict[str, int]" = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, card_number: str) -> Optional[AccountSnapshot]:
+        """Snapshot of the card, or None if it is not cached or expired"""
+        with self._lock:
+            snapshot = self._entries.get(card_number)
+            if snapshot is not None and self._clock() - snapshot.stored_at > self.ttl:
+                del self._entries[card_number]
+                snapshot = None
+            if snapshot is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(card_number)
+            self.hits += 1
+            return snapshot
+
+    def version(self, card_number: str) -> int:
+        """Current version of the card's accounts"""
+        with self._lock:
+            return self._versions.get(card_number, self._floor)
+
+    def _set_version(self, card_number: str, version: int):
+        versions = self._versions
+        versions[card_number] = version
+        versions.move_to_end(card_number)
+        while len(versions) > self.max_versions:
+            _, forgotten = versions.popitem(last=False)
+            self._floor = max(self._floor, forgotten)
+
+    def put(self, card_number: str, accounts: List, since: Optional[int] = None) -> bool:
+        """
+        Store the accounts fetched from the bank
+
+        :param since: version() of the card when the fetch started, None for the current version
+        :return: False if the accounts were changed during the fetch (result is stale)
+        """
+        with self._lock:
+            current = self._versions.get(card_number, self._floor)
+            if since is None:
+                since = current
+            elif current > since:
+                return False
+            snapshot = AccountSnapshot([copy.copy(account) for account in accounts], since + 1, self._clock())
+            self._set_version(card_number, since + 1)
+            self._entries[card_number] = snapshot
+            self._entries.move_to_end(card_number)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            return True
+
+    def update_account(self, card_number: str, acc_idx: int, account) -> bool:
+        """
+        Write the result of a successful transaction into the snapshot
+
+        The version goes up even if the card is not cached, so a fetch running
+        meanwhile cannot store the accounts from before the transaction.
+
+        :return: False if the card is not cached
+        """
+        with self._lock:
+            version = self._versions.get(card_number, self._floor) + 1
+            self._set_version(card_number, version)
+            snapshot = self._entries.get(card_number)
+            if snapshot is None or not len(snapshot.accounts) > acc_idx >= 0:
+                self._entries.pop(card_number, None)
+                return False
+            snapshot.accounts[acc_idx] = copy.copy(account)
+            snapshot.version = version
+            return True
+
+    def invalidate(self, card_number: str):
+        """Remove the snapshot of the card, a fetch running meanwhile is not stored"""
+        with self._lock:
+            self._set_version(card_number, self._versions.get(card_number, self._floor) + 1)
+            self._entries.pop(card_number, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._versions:
+                self._floor = max(self._floor, max(self._versions.values())) + 1
+                self._versions.clear()
@@ -0,0 +1,272 @@
+"""
+Write-ahead journal of balance updates with group commit
+
+Every successful transaction is appended to the journal as a fixed-size record.
+A background thread writes the pending records and calls fsync once for the whole
+group, when the group is full (group_size) or the oldest record waited long enough
+(group_interval). Callers wait until their record is durable. If writing fails, the
+writer stops and every waiting and later caller gets JournalFailedException.
+
+At startup the journal is replayed onto the last snapshot of the ledger
+(e.g. TestBankAdopter.set_bank_data) to rebuild the balances.
+"""
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.bank.adopter import BankAdopterInterface
+from app.common.consts import CARD_NUMBER_DIGITS
+from app.errors.exceptions import JournalFailedException
+
+RECORD = struct.Struct("<IHq")
+"""card number(uint32), account index(uint16), amount(int64)"""
+CRC = struct.Struct("<I")
+RECORD_SIZE = RECORD.size + CRC.size
+
+
+def read_journal(path: str) -> Iterator[Tuple[str, int, int]]:
+    """
+    Read all valid records of the journal
+
+    Stops at the first torn or corrupted record (a crash while writing).
+
+    :return: iterator of (card_number, acc_idx, amount)
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(RECORD_SIZE)
+            if len(chunk) < RECORD_SIZE:
+                return
+            body = chunk[:RECORD.size]
+            if CRC.unpack_from(chunk, RECORD.size)[0] != zlib.crc32(body):
+                return
+            card, acc_idx, amount = RECORD.unpack(body)
+            yield str(card).zfill(CARD_NUMBER_DIGITS), acc_idx, amount
+
+
+class Journal:
+    """Append-only journal file with group commit"""
+    path: str
+    group_size: int
+    """Max. number of records per fsync"""
+    group_interval: float
+    """Max. seconds a record waits for other records before fsync"""
+    fsyncs: int
+    """Number of fsync calls so far"""
+
+    def __init__(self, path: str, group_size: int = 128, group_interval: float = 0.002):
+        self.path = path
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.fsyncs = 0
+
+        # Cut off a torn record at the end, so new records are appended after valid ones.
+        valid = sum(1 for _ in read_journal(path)) * RECORD_SIZE
+        self._file = open(path, "ab")
+        if self._file.tell() != valid:
+            self._file.truncate(valid)
+            self._file.seek(valid)
+
+        self._pending: List[bytes] = []
+        self._first_pending_at = 0.0
+        self._appended_lsn = 0
+        self._durable_lsn = 0
+        self._closed = False
+        self._error: Optional[OSError] = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, card_number: str, acc_idx: int, amount: int) -> int:
+        """
+        Add a record to the next group
+
+        :return: sequence number of the record, see wait_durable()
+        """
+        body = RECORD.pack(int(card_number), acc_idx, amount)
+        record = body + CRC.pack(zlib.crc32(body))
+        with self._cond:
+            if self._closed:
+                raise ValueError("journal is closed")
+            if self._error is not None:
+                raise JournalFailedException(self._error)
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+            self._pending.append(record)
+            self._appended_lsn += 1
+            self._cond.notify_all()
+            return self._appended_lsn
+
+    def wait_durable(self, lsn: int):
+        """Block until the record of lsn was written and fsync'ed, raise JournalFailedException if it cannot be"""
+        with self._cond:
+            while self._durable_lsn < lsn:
+                if self._error is not None:
+                    raise JournalFailedException(self._error)
+                self._cond.wait()
+
+    def commit(self, card_number: str, acc_idx: int, amount: int):
+        """Append a record and wait until it is durable"""
+        self.wait_durable(self.append(card_number, acc_idx, amount))
+
+    def close(self):
+        """Write all pending records and close the file"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        try:
+            self._file.close()
+        except OSError:
+            if self._error is None:
+                raise
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                # wait for more records to share one fsync
+                while not self._closed and len(self._pending) < self.group_size:
+                    remaining = self._first_pending_at + self.group_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                group = self._pending
+                self._pending = []
+                lsn = self._appended_lsn
+                if not group and self._closed:
+                    return
+            try:
+                self._file.write(b"".join(group))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self.fsyncs += 1
+                self._durable_lsn = lsn
+                self._cond.notify_all()
+
+
+class JournaledBankAdopter(BankAdopterInterface):
+    """
+    Makes balance updates of another adopter durable
+
+    tx_update_account() returns after the transaction is in the journal on disk,
+    but many transactions share one fsync. If the journal fails, the update is rolled
+    back in the adopter and JournalFailedException is raised (ValueError if the journal
+    is closed).
+    """
+    adopter: BankAdopterInterface
+    journal: Journal
+    thread_safe = True
+
+    def __init__(self, adopter: BankAdopterInterface, journal: Journal, wait_durable: bool = True):
+        super().__init__()
+        self.adopter = adopter
+        self.journal = journal
+        self.wait_durable = wait_durable
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, adopter: BankAdopterInterface, path: str, **kwargs) -> "JournaledBankAdopter":
+        """
+        Replay the journal onto the adopter, then keep journaling to the same file
+
+        :param adopter: adopter holding the last snapshot of the ledger
+        :param kwargs: group_size, group_interval of Journal
+        """
+        replay(adopter, path)
+        return cls(adopter, Journal(path, **kwargs))
+
+    def is_registered(self, card_number: str) -> bool:
+        return self.adopter.is_registered(card_number)
+
+    def validate(self, card_number: str, entered_pin: str) -> List:
+        return self.adopter.validate(card_number, entered_pin)
+
+    def account_list(self, token: str) -> List:
+        return self.adopter.account_list(token)
+
+    def tx_update_account(self, token: str, acc_idx: int, amount: int) -> List:
+        # The record order in the journal must be the order of updates.
+        with self._lock:
+            res, account = self.adopter.tx_update_account(token, acc_idx, amount)
+            if not res:
+                return [res, account]
+            try:
+                lsn = self.journal.append(token[::-1], acc_idx, amount)    # use reversed card_number as a token
+            except Exception:   # failed or closed journal
+                self.adopter.tx_update_account(token, acc_idx, -amount)
+                raise
+        if self.wait_durable:
+            try:
+                self.journal.wait_durable(lsn)
+            except JournalFailedException:
+                self._rollback([(token, acc_idx, amount)])
+                raise
+        return [res, account]
+
+    def card_numbers(self) -> Iterator[str]:
+        return self.adopter.card_numbers()
+
+    def load(self, records: Iterable[Tuple[str, dict]]):
+        """Bulk import, not journaled"""
+        self.adopter.load(records)
+
+    def is_registered_batch(self, card_numbers: Sequence[str]) -> List[bool]:
+        return self.adopter.is_registered_batch(card_numbers)
+
+    def tx_update_accounts_batch(self, items: Sequence[Tuple[str, int, int]], atomic: bool = True) -> List:
+        with self._lock:
+            committed, results = self.adopter.tx_update_accounts_batch(items, atomic)
+            applied = [item for item, (_, account) in zip(items, results) if account is not None]
+            lsn = 0
+            try:
+                for token, acc_idx, amount in applied:
+                    lsn = self.journal.append(token[::-1], acc_idx, amount)
+            except Exception:
+                for token, acc_idx, amount in applied:
+                    self.adopter.tx_update_account(token, acc_idx, -amount)
+                raise
+        if self.wait_durable and lsn:
+            # the whole batch is durable with its last record
+            try:
+                self.journal.wait_durable(lsn)
+            except JournalFailedException:
+                self._rollback(applied)
+                raise
+        return [committed, results]
+
+    def _rollback(self, items: Sequence[Tuple[str, int, int]]):
+        """Undo updates whose records did not become durable (balance updates commute)"""
+        with self._lock:
+            for token, acc_idx, amount in items:
+                self.adopter.tx_update_account(token, acc_idx, -amount)
+
+    def close(self):
+        self.journal.close()
+
+
+def replay(adopter: BankAdopterInterface, path: str) -> int:
+    """
+    Apply all records of the journal to the adopter
+
+    :return: number of replayed records
+    """
+    count = 0
+    for card_number, acc_idx, amount in read_journal(path):
+        adopter.tx_update_account(card_number[::-1], acc_idx, amount)   # use reversed card_number as a token
+        count += 1
+    return count
@@ -0,0 +1,234 @@
+"""
+Columnar ledger engine
+
+Keeps cards and accounts in compact array-backed columns instead of Python dicts,
+with an open-addressing hash index from card number to the card's row.
+The accounts of a card are stored in a contiguous range of account rows.
+
+- card rows    : cards(uint32), pins(uint16), first(uint32), counts(uint16)
+- account rows : acc_nums(uint32), balances(int64), available(uint8)
+
+Card numbers, PINs and account numbers are decimal strings of fixed digits,
+so they are stored as integers and restored with zero-padding.
+"""
+import threading
+from array import array
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+from app.bank.adopter import BankAdopterInterface
+from app.bank.models import Account
+from app.common.consts import CARD_NUMBER_DIGITS, PIN_NUMBER_DIGITS
+
+ACCOUNT_NUMBER_DIGITS = 8
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_HASH_MASK = 0xFFFFFFFFFFFFFFFF
+_UINT16_MAX = 0xFFFF
+_UINT32_MAX = 0xFFFFFFFF
+
+
+class ColumnarLedger:
+    """Cards and accounts in array-backed columns"""
+    cards: array
+    pins: array
+    first: array
+    """Row of the first account of each card"""
+    counts: array
+    """Number of accounts of each card"""
+    acc_nums: array
+    balances: array
+    available: array
+
+    def __init__(self, capacity: int = 1024):
+        self.cards = array("I")
+        self.pins = array("H")
+        self.first = array("I")
+        self.counts = array("H")
+        self.acc_nums = array("I")
+        self.balances = array("q")
+        self.available = array("B")
+        self._init_index(capacity)
+
+    def __len__(self):
+        """Number of cards"""
+        return len(self.cards)
+
+    def _init_index(self, capacity: int):
+        bits = max((capacity * 2 - 1).bit_length(), 4)    # load factor <= 0.5
+        self._shift = 64 - bits
+        self._mask = (1 << bits) - 1
+        self._slots = array("i", [-1]) * (1 << bits)
+
+    def _slot(self, card: int) -> int:
+        return ((card * _HASH_MULTIPLIER) & _HASH_MASK) >> self._shift
+
+    def find(self, card: int) -> int:
+        """Row of the card, or -1 if it is not registered"""
+        slots = self._slots
+        cards = self.cards
+        mask = self._mask
+        i = self._slot(card)
+        while True:
+            row = slots[i]
+            if row < 0:
+                return -1
+            if cards[row] == card:
+                return row
+            i = (i + 1) & mask
+
+    def _insert_index(self, card: int, row: int):
+        slots = self._slots
+        mask = self._mask
+        i = self._slot(card)
+        while slots[i] >= 0:
+            i = (i + 1) & mask
+        slots[i] = row
+
+    def add_card(self, card: int, pin: int, accounts: Iterable[Tuple[int, int, bool]]) -> int:
+        """
+        Append a card and its accounts
+
+        A value which does not fit its column raises OverflowError, and nothing is added.
+
+        :param accounts: [(acc_num, balance, available), ...]
+        :return: row of the card
+        """
+        if self.find(card) >= 0:
+            raise ValueError(f"duplicated card number: {card}")
+        if not (0 <= card <= _UINT32_MAX and 0 <= pin <= _UINT16_MAX):
+            raise OverflowError(f"card does not fit the ledger: {card}")
+        if (len(self.cards) + 1) * 2 > len(self._slots):
+            self._init_index(len(self._slots))
+            for row, existing in enumerate(self.cards):
+                self._insert_index(existing, row)
+        row = len(self.cards)
+        first = len(self.acc_nums)
+        try:
+            for acc_num, balance, available in accounts:
+                self.acc_nums.append(acc_num)
+                self.balances.append(balance)
+                self.available.append(1 if available else 0)
+            self.counts.append(len(self.acc_nums) - first)
+        except Exception:
+            # The columns check the values of the accounts: remove the rows appended before the bad one.
+            for column, length in ((self.acc_nums, first), (self.balances, first),
+                                   (self.available, first), (self.counts, row)):
+                del column[length:]
+            raise
+        self.cards.append(card)
+        self.pins.append(pin)
+        self.first.append(first)
+        self._insert_index(card, row)
+        return row
+
+    def account_rows(self, row: int) -> range:
+        """Rows of all accounts of the card"""
+        first = self.first[row]
+        return range(first, first + self.counts[row])
+
+    def account(self, acc_row: int) -> Account:
+        """Account row in the format of BankAdopterInterface"""
+        return Account(str(self.acc_nums[acc_row]).zfill(ACCOUNT_NUMBER_DIGITS),
+                       self.balances[acc_row],
+                       bool(self.available[acc_row]))
+
+    def nbytes(self) -> int:
+        """Memory used by the columns and the index"""
+        columns = (self.cards, self.pins, self.first, self.counts,
+                   self.acc_nums, self.balances, self.available, self._slots)
+        return sum(column.itemsize * len(column) for column in columns)
+
+
+class LedgerBankAdopter(BankAdopterInterface):
+    """BankAdopterInterface on top of ColumnarLedger"""
+    ledger: ColumnarLedger
+    thread_safe = True
+
+    def __init__(self, ledger: ColumnarLedger = None):
+        super().__init__()
+        self.ledger = ledger if ledger is not None else ColumnarLedger()
+        self._lock = threading.Lock()
+
+    def _card_row(self, card_number: str) -> int:
+        if not (card_number.isdecimal() and len(card_number) == CARD_NUMBER_DIGITS):
+            return -1
+        return self.ledger.find(int(card_number))
+
+    def is_registered(self, card_number: str) -> bool:
+        return self._card_row(card_number) >= 0
+
+    def validate(self, card_number: str, entered_pin: str) -> List:
+        row = self._card_row(card_number)
+        if row >= 0 and entered_pin.isdecimal() and len(entered_pin) == PIN_NUMBER_DIGITS:
+            if self.ledger.pins[row] == int(entered_pin):
+                token = card_number[::-1]   # use reversed card_number as a token
+                return [True, token]
+        return [False, ""]
+
+    def account_list(self, token: str) -> List:
+        row = self._card_row(token[::-1])   # use reversed card_number as a token
+        if row >= 0:
+            return [True, [self.ledger.account(acc_row) for acc_row in self.ledger.account_rows(row)]]
+        return [False, []]
+
+    def tx_update_account(self, token: str, acc_idx: int, amount: int) -> List:
+        row = self._card_row(token[::-1])   # use reversed card_number as a token
+        if row >= 0 and self.ledger.counts[row] > acc_idx >= 0:
+            acc_row = self.ledger.first[row] + acc_idx
+            with self._lock:
+                self.ledger.balances[acc_row] += amount
+            return [True, self.ledger.account(acc_row)]
+        return [False, None]
+
+    def card_numbers(self) -> Iterator[str]:
+        return (str(card).zfill(CARD_NUMBER_DIGITS) for card in self.ledger.cards)
+
+    def is_registered_batch(self, card_numbers: Sequence[str]) -> List[bool]:
+        return [self._card_row(card_number) >= 0 for card_number in card_numbers]
+
+    def tx_update_accounts_batch(self, items: Sequence[Tuple[str, int, int]], atomic: bool = True) -> List:
+        ledger = self.ledger
+        cards, slots, first, counts = ledger.cards, ledger._slots, ledger.first, ledger.counts
+        shift, mask = ledger._shift, ledger._mask
+        # 1st pass: find the account rows of all items (-1: invalid item), with _card_row() and find() inlined
+        acc_rows = []
+        for token, acc_idx, _ in items:
+            card_number = token[::-1]   # use reversed card_number as a token
+            row = -1
+            if card_number.isdecimal() and len(card_number) == CARD_NUMBER_DIGITS:
+                card = int(card_number)
+                i = ((card * _HASH_MULTIPLIER) & _HASH_MASK) >> shift
+                row = slots[i]
+                while row >= 0 and cards[row] != card:
+                    i = (i + 1) & mask
+                    row = slots[i]
+            acc_rows.append(first[row] + acc_idx if row >= 0 and counts[row] > acc_idx >= 0 else -1)
+        if atomic and -1 in acc_rows:
+            return [False, [[acc_row >= 0, None] for acc_row in acc_rows]]
+        # 2nd pass: apply to the columns directly
+        acc_nums, balances, available = ledger.acc_nums, ledger.balances, ledger.available
+        results = []
+        with self._lock:
+            for (_, _, amount), acc_row in zip(items, acc_rows):
+                if acc_row < 0:
+                    results.append([False, None])
+                else:
+                    balances[acc_row] += amount
+                    results.append([True, Account(f"{acc_nums[acc_row]:0{ACCOUNT_NUMBER_DIGITS}d}",
+                                                  balances[acc_row], available[acc_row] != 0)])
+        return [True, results]
+
+    def load(self, records: Iterable[Tuple[str, dict]]):
+        """
+        Append cards in the format of TestBankAdopter.bank_data, one by one
+
+        :param records: [(card_number, {"pin", "accounts"}), ...]
+        """
+        for card_number, record in records:
+            self.ledger.add_card(int(card_number), int(record["pin"]),
+                                 ((int(acc["acc_num"]), acc["balance"], acc.get("available", True))
+                                  for acc in record.get("accounts", [])))
+
+    def set_bank_data(self, data: dict):
+        """For testing only (same format as TestBankAdopter)"""
+        self.ledger = ColumnarLedger(capacity=len(data))
+        self.load(data.items())
@@ -0,0 +1,128 @@
+from typing import List
+
+
+class Account:
+    """
+    Account info. of a card
+
+    Uses __slots__ to keep millions of accounts small and attribute access fast.
+    For existing callers, it can be also used like the old dict:
+    account["balance"], "balance" in account, account == {"acc_num": ..., ...}
+    """
+    __slots__ = ("acc_num", "balance", "available")
+    FIELDS = ("acc_num", "balance", "available")
+
+    acc_num: str
+    balance: int
+    available: bool
+
+    def __init__(self, acc_num: str, balance: int = 0, available: bool = True):
+        self.acc_num = acc_num
+        self.balance = balance
+        self.available = available
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Account":
+        return cls(data["acc_num"], data["balance"], data.get("available", True))
+
+    @classmethod
+    def coerce(cls, data):
+        """Account from an account dict, or data itself if it is not convertible"""
+        if isinstance(data, dict) and "acc_num" in data and "balance" in data:
+            return cls.from_dict(data)
+        return data
+
+    def to_dict(self) -> dict:
+        return {"acc_num": self.acc_num, "balance": self.balance, "available": self.available}
+
+    def copy(self) -> "Account":
+        return Account(self.acc_num, self.balance, self.available)
+
+    __copy__ = copy
+
+    # compatibility view as dict
+
+    def __getitem__(self, key: str):
+        if key in Account.FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        if key in Account.FIELDS:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        return key in Account.FIELDS
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in Account.FIELDS else default
+
+    def keys(self):
+        return Account.FIELDS
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Account):
+            return (self.acc_num == other.acc_num and self.balance == other.balance
+                    and self.available == other.available)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        # Same as the old dict, so logs and receipts are not changed.
+        return repr(self.to_dict())
+
+
+class CardRecord:
+    """
+    PIN and accounts of a card in the bank
+
+    Can be also used like the old dict: record["pin"], record["accounts"]
+    """
+    __slots__ = ("pin", "accounts")
+    FIELDS = ("pin", "accounts")
+
+    pin: str
+    accounts: List[Account]
+
+    def __init__(self, pin: str, accounts: List[Account] = None):
+        self.pin = pin
+        self.accounts = accounts if accounts is not None else []
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CardRecord":
+        return cls(data["pin"], [Account.from_dict(acc) for acc in data.get("accounts", [])])
+
+    @classmethod
+    def coerce(cls, data) -> "CardRecord":
+        return data if isinstance(data, CardRecord) else cls.from_dict(data)
+
+    def to_dict(self) -> dict:
+        return {"pin": self.pin, "accounts": [acc.to_dict() for acc in self.accounts]}
+
+    def __getitem__(self, key: str):
+        if key in CardRecord.FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        return key in CardRecord.FIELDS
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in CardRecord.FIELDS else default
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, CardRecord):
+            return self.pin == other.pin and self.accounts == other.accounts
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
@@ -0,0 +1,214 @@
+"""
+Bank adopter over the network with pooled, persistent connections
+
+Connections are opened lazily, kept alive and reused by the next call, so a customer
+costs no handshake once the pool is warm. Several requests can be pipelined on one
+connection. The wire protocol is described in app/bank/server.py.
+"""
+import json
+import queue
+import socket
+import threading
+from itertools import islice
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+from app.bank.adopter import BankAdopterInterface
+from app.errors.exceptions import BankConnectionException
+
+
+IDEMPOTENT_METHODS = frozenset(("is_registered", "validate", "account_list", "is_registered_batch", "card_numbers"))
+"""Calls which can be sent again if the connection failed, never a balance update"""
+
+
+class BankConnection:
+    """One persistent connection to the bank server"""
+    sock: socket.socket
+    answered: int
+    """Number of requests answered on this connection"""
+
+    def __init__(self, address: Tuple[str, int], timeout: float):
+        self.sock = socket.create_connection(address, timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self._rfile = self.sock.makefile("rb")
+        self._next_id = 0
+        self.answered = 0
+
+    def request(self, calls: Sequence[Tuple[str, Sequence]]) -> List:
+        """
+        Send all calls at once and read their results in order
+
+        All responses are read before an error response is raised, so the next
+        request on this connection gets its own responses.
+
+        :param calls: [(method, params), ...]
+        :return: list of results
+        """
+        ids = []
+        lines = []
+        for method, params in calls:
+            self._next_id += 1
+            ids.append(self._next_id)
+            lines.append(json.dumps({"id": self._next_id, "method": method, "params": list(params)}))
+        self.sock.sendall(("\n".join(lines) + "\n").encode())
+
+        results = []
+        error = None
+        for req_id in ids:
+            line = self._rfile.readline()
+            if not line:
+                raise ConnectionError("closed by the bank server")
+            response = json.loads(line)
+            if response.get("id") != req_id:
+                raise ConnectionError(f"unexpected response id {response.get('id')} != {req_id}")
+            if "error" in response:
+                if error is None:
+                    error = response["error"]
+                results.append(None)
+            else:
+                results.append(response["result"])
+        self.answered += 1
+        if error is not None:
+            raise BankConnectionException(error)
+        return results
+
+    def close(self):
+        try:
+            self._rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """Bounded pool of persistent connections"""
+    address: Tuple[str, int]
+    size: int
+    timeout: float
+    connects: int
+    """Number of connections opened so far (handshakes)"""
+
+    def __init__(self, address: Tuple[str, int], size: int = 4, timeout: float = 5.0):
+        self.address = address
+        self.size = size
+        self.timeout = timeout
+        self.connects = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def acquire(self) -> BankConnection:
+        """Get an idle connection or open a new one. Blocks if all of them are busy."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise BankConnectionException("no connection available in the pool")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = BankConnection(self.address, self.timeout)
+        except OSError as e:
+            self._slots.release()
+            raise BankConnectionException(e)
+        with self._lock:
+            self.connects += 1
+        return conn
+
+    def release(self, conn: BankConnection, broken: bool = False):
+        """Give back the connection to keep it alive, or close it if broken"""
+        if broken:
+            conn.close()
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class NetBankAdopter(BankAdopterInterface):
+    """Bank API over the network, using a pool of persistent connections"""
+    pool: ConnectionPool
+    thread_safe = True
+
+    def __init__(self, host: str, port: int, pool_size: int = 4, timeout: float = 5.0):
+        super().__init__()
+        self.pool = ConnectionPool((host, port), size=pool_size, timeout=timeout)
+
+    def pipeline(self, calls: Sequence[Tuple[str, Sequence]]) -> List:
+        """
+        Send many calls on one connection without waiting for each response
+
+        If a kept-alive connection was closed meanwhile (server restart, idle timeout),
+        calls which are all in IDEMPOTENT_METHODS are sent once more on a new connection.
+
+        :param calls: [(method, params), ...], e.g. [("is_registered", ["12345678"])]
+        :return: list of results in the same order
+        """
+        retry = all(method in IDEMPOTENT_METHODS for method, _ in calls)
+        while True:
+            conn = self.pool.acquire()
+            reused = conn.answered > 0
+            try:
+                results = conn.request(calls)
+            except BankConnectionException:
+                # The server answered with an error and all responses were read, the connection is fine.
+                self.pool.release(conn)
+                raise
+            except OSError as e:
+                self.pool.release(conn, broken=True)
+                if reused and retry:
+                    # the other idle connections are older, they are most likely closed too
+                    self.pool.close()
+                    retry = False
+                    continue
+                raise BankConnectionException(e)
+            except ValueError as e:
+                self.pool.release(conn, broken=True)
+                raise BankConnectionException(e)
+            self.pool.release(conn)
+            return results
+
+    def _call(self, method: str, *params):
+        return self.pipeline([(method, params)])[0]
+
+    def is_registered(self, card_number: str) -> bool:
+        return self._call("is_registered", card_number)
+
+    def validate(self, card_number: str, entered_pin: str) -> List:
+        return self._call("validate", card_number, entered_pin)
+
+    def account_list(self, token: str) -> List:
+        return self._call("account_list", token)
+
+    def tx_update_account(self, token: str, acc_idx: int, amount: int) -> List:
+        return self._call("tx_update_account", token, acc_idx, amount)
+
+    def card_numbers(self) -> Iterator[str]:
+        # one response with all card numbers, e.g. for RefreshingCardFilter
+        return iter(self._call("card_numbers"))
+
+    def load(self, records: Iterable[Tuple[str, dict]], chunk_size: int = 1000):
+        """Add many cards on the server, chunk_size cards per request"""
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                return
+            self._call("load", chunk)
+
+    def is_registered_batch(self, card_numbers: Sequence[str]) -> List[bool]:
+        return self._call("is_registered_batch", list(card_numbers))
+
+    def tx_update_accounts_batch(self, items: Sequence[Tuple[str, int, int]], atomic: bool = True) -> List:
+        # one round trip for the whole batch
+        return self._call("tx_update_accounts_batch", [list(item) for item in items], atomic)
+
+    def close(self):
+        """Close all kept-alive connections"""
+        self.pool.close()
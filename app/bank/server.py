@@ -0,0 +1,136 @@
+"""
+Local stand-in of the bank server
+
+Serves a BankAdopterInterface (TestBankAdopter by default) over TCP, so that
+NetBankAdopter can be tested and benchmarked offline.
+
+Protocol: one JSON object per line, on persistent connections.
+Responses are written in the same order as the requests (pipelining).
+
+- request  : {"id": 1, "method": "validate", "params": ["12345678", "1234"]}
+- response : {"id": 1, "result": [true, "87654321"]}
+- error    : {"id": 1, "error": "unknown method"}
+"""
+import argparse
+import json
+import socket
+import socketserver
+import threading
+from typing import Iterator, Tuple
+
+from app.bank.adopter import BankAdopterInterface, TestBankAdopter
+
+METHODS = ("is_registered", "validate", "account_list", "tx_update_account",
+           "is_registered_batch", "tx_update_accounts_batch", "card_numbers", "load")
+"""Bank APIs served to the clients"""
+
+
+def _to_json(obj):
+    """Account and CardRecord as plain dicts"""
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    raise TypeError(f"not JSON serializable: {type(obj).__name__}")
+
+
+class BankRequestHandler(socketserver.StreamRequestHandler):
+    """Handles all requests of one connection until the client closes it"""
+    server: "BankServer"
+
+    def handle(self):
+        self.server.add_connection(self.connection)
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                response = self.server.dispatch(line)
+                self.wfile.write(response)
+        finally:
+            self.server.remove_connection(self.connection)
+
+
+class BankServer(socketserver.ThreadingTCPServer):
+    """TCP server wrapping a bank adopter"""
+    daemon_threads = True
+    allow_reuse_address = True
+    adopter: BankAdopterInterface
+
+    def __init__(self, adopter: BankAdopterInterface = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), BankRequestHandler)
+        self.adopter = adopter if adopter is not None else TestBankAdopter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """(host, port) the server is listening on"""
+        return self.server_address[:2]
+
+    def dispatch(self, line: bytes) -> bytes:
+        """Run one request line and make one response line"""
+        try:
+            request = json.loads(line)
+            req_id = request.get("id")
+        except ValueError:
+            return b'{"id": null, "error": "invalid request"}\n'
+        method = request.get("method")
+        if method not in METHODS:
+            response = {"id": req_id, "error": f"unknown method: {method}"}
+        else:
+            # TestBankAdopter is not thread-safe, so the requests are serialized.
+            with self._lock:
+                try:
+                    result = getattr(self.adopter, method)(*request.get("params", []))
+                    if isinstance(result, Iterator):
+                        result = list(result)   # e.g. card_numbers()
+                    response = {"id": req_id, "result": result}
+                except Exception as e:
+                    response = {"id": req_id, "error": str(e)}
+        return json.dumps(response, default=_to_json).encode() + b"\n"
+
+    def add_connection(self, connection: socket.socket):
+        with self._connections_lock:
+            self._connections.add(connection)
+
+    def remove_connection(self, connection: socket.socket):
+        with self._connections_lock:
+            self._connections.discard(connection)
+
+    def start(self, poll_interval: float = 0.1):
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, args=(poll_interval,),
+                                        name="bank-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving, close the listening socket and cut the connections of the clients like a restart"""
+        self.shutdown()
+        self.server_close()
+        with self._connections_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+if __name__ == "__main__":
+    from app.sim.fleet import make_bank_data
+
+    parser = argparse.ArgumentParser(description="Local stand-in of the bank server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--cards", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    test_adopter = TestBankAdopter()
+    test_adopter.set_bank_data(make_bank_data(args.cards, args.seed))
+    with BankServer(test_adopter, args.host, args.port) as server:
+        print("Bank server on %s:%d" % server.address)
+        server.serve_forever()
@@ -0,0 +1,219 @@
+"""
+Memory-mapped card and account store
+
+A single binary file of fixed-size records, opened with mmap. Nothing is loaded at
+startup: the OS pages in only the records that are read, and processes opening the
+same file share those pages.
+
+Layout (little-endian):
+- header   : magic, version, number of cards, number of accounts, number of index slots
+- index    : open-addressing hash index, card number -> card row (int32, -1: empty)
+- cards    : card(uint32), pin(uint16), count(uint16), first account row(uint32)
+- accounts : balance(int64), acc_num(uint32), available(uint8)
+
+Card numbers, PINs and account numbers are stored as integers like ColumnarLedger.
+"""
+import mmap
+import struct
+import threading
+from array import array
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.bank.adopter import BankAdopterInterface
+from app.bank.ledger import ACCOUNT_NUMBER_DIGITS, _HASH_MASK, _HASH_MULTIPLIER
+from app.bank.models import Account
+from app.common.consts import CARD_NUMBER_DIGITS, PIN_NUMBER_DIGITS
+
+MAGIC = b"ATMSTORE"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIQ")
+"""magic, version, cards, accounts, index slots, reserved"""
+SLOT = struct.Struct("<i")
+CARD = struct.Struct("<IHHI")
+ACCOUNT = struct.Struct("<qIB3x")
+
+
+def _index_bits(n_cards: int) -> int:
+    return max((n_cards * 2 - 1).bit_length(), 4)    # load factor <= 0.5
+
+
+def build_store(path: str, records: Iterable[Tuple[str, dict]], n_cards: Optional[int] = None) -> int:
+    """
+    Write a store file from cards in the format of TestBankAdopter.bank_data
+
+    :param records: [(card_number, {"pin", "accounts"}), ...], e.g. data.items()
+    :param n_cards: number of records, if records is an iterator
+    :return: number of cards
+    """
+    if n_cards is None:
+        records = list(records)
+        n_cards = len(records)
+    bits = _index_bits(n_cards)
+    shift = 64 - bits
+    mask = (1 << bits) - 1
+    slots = array("i", [-1]) * (1 << bits)
+    cards = array("I")
+    cards_offset = HEADER.size + len(slots) * SLOT.size
+    accounts_offset = cards_offset + n_cards * CARD.size
+
+    n_accounts = 0
+    row = -1
+    with open(path, "wb") as f_cards, open(path, "r+b") as f_accounts:
+        f_cards.truncate(accounts_offset)
+        f_cards.seek(cards_offset)
+        f_accounts.seek(accounts_offset)
+        for row, (card_number, record) in enumerate(records):
+            if row >= n_cards:
+                raise ValueError(f"more cards than n_cards={n_cards}")
+            card = int(card_number)
+            i = ((card * _HASH_MULTIPLIER) & _HASH_MASK) >> shift
+            while slots[i] >= 0:
+                if cards[slots[i]] == card:
+                    raise ValueError(f"duplicated card number: {card_number}")
+                i = (i + 1) & mask
+            slots[i] = row
+            cards.append(card)
+            accounts = record.get("accounts", [])
+            f_cards.write(CARD.pack(card, int(record["pin"]), len(accounts), n_accounts))
+            for acc in accounts:
+                f_accounts.write(ACCOUNT.pack(acc["balance"], int(acc["acc_num"]), 1 if acc.get("available", True) else 0))
+            n_accounts += len(accounts)
+        if row + 1 != n_cards:
+            raise ValueError(f"{row + 1} cards written, but n_cards={n_cards}")
+        f_cards.seek(0)
+        f_cards.write(HEADER.pack(MAGIC, VERSION, n_cards, n_accounts, len(slots), 0))
+        f_cards.write(slots.tobytes())
+    return n_cards
+
+
+class MmapBankAdopter(BankAdopterInterface):
+    """
+    BankAdopterInterface on a memory-mapped store file (see build_store)
+
+    Opening takes the same time for any number of cards. Balances are updated in place
+    in the mapped pages; call flush() to write them to the file. Updates of one adopter
+    are serialized, but updates from several processes must be serialized by the caller.
+    """
+    path: str
+    n_cards: int
+    n_accounts: int
+    thread_safe = True
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._file = open(path, "r+b")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"not a store file: {path}")
+        magic, version, self.n_cards, self.n_accounts, n_slots, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"not a store file: {path}")
+        self._shift = 64 - (n_slots.bit_length() - 1)
+        self._mask = n_slots - 1
+        self._cards_offset = HEADER.size + n_slots * SLOT.size
+        self._accounts_offset = self._cards_offset + self.n_cards * CARD.size
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.n_cards
+
+    def _card_row(self, card_number: str) -> int:
+        if not (card_number.isdecimal() and len(card_number) == CARD_NUMBER_DIGITS):
+            return -1
+        card = int(card_number)
+        mm = self._mm
+        cards_offset = self._cards_offset
+        i = ((card * _HASH_MULTIPLIER) & _HASH_MASK) >> self._shift
+        while True:
+            row = SLOT.unpack_from(mm, HEADER.size + i * SLOT.size)[0]
+            if row < 0:
+                return -1
+            if CARD.unpack_from(mm, cards_offset + row * CARD.size)[0] == card:
+                return row
+            i = (i + 1) & self._mask
+
+    def _card(self, row: int) -> Tuple[int, int, int, int]:
+        """(card, pin, count, first)"""
+        return CARD.unpack_from(self._mm, self._cards_offset + row * CARD.size)
+
+    def _account(self, acc_row: int) -> Account:
+        balance, acc_num, available = ACCOUNT.unpack_from(self._mm, self._accounts_offset + acc_row * ACCOUNT.size)
+        return Account(str(acc_num).zfill(ACCOUNT_NUMBER_DIGITS), balance, bool(available))
+
+    def _acc_row(self, token: str, acc_idx: int) -> int:
+        row = self._card_row(token[::-1])   # use reversed card_number as a token
+        if row >= 0:
+            _, _, count, first = self._card(row)
+            if count > acc_idx >= 0:
+                return first + acc_idx
+        return -1
+
+    def _add_balance(self, acc_row: int, amount: int) -> Account:
+        # balance is the first field of the account record
+        offset = self._accounts_offset + acc_row * ACCOUNT.size
+        balance = struct.unpack_from("<q", self._mm, offset)[0] + amount
+        struct.pack_into("<q", self._mm, offset, balance)
+        return self._account(acc_row)
+
+    def is_registered(self, card_number: str) -> bool:
+        return self._card_row(card_number) >= 0
+
+    def validate(self, card_number: str, entered_pin: str) -> List:
+        row = self._card_row(card_number)
+        if row >= 0 and entered_pin.isdecimal() and len(entered_pin) == PIN_NUMBER_DIGITS:
+            if self._card(row)[1] == int(entered_pin):
+                token = card_number[::-1]   # use reversed card_number as a token
+                return [True, token]
+        return [False, ""]
+
+    def account_list(self, token: str) -> List:
+        row = self._card_row(token[::-1])   # use reversed card_number as a token
+        if row >= 0:
+            _, _, count, first = self._card(row)
+            return [True, [self._account(acc_row) for acc_row in range(first, first + count)]]
+        return [False, []]
+
+    def tx_update_account(self, token: str, acc_idx: int, amount: int) -> List:
+        acc_row = self._acc_row(token, acc_idx)
+        if acc_row >= 0:
+            with self._lock:
+                return [True, self._add_balance(acc_row, amount)]
+        return [False, None]
+
+    def card_numbers(self) -> Iterator[str]:
+        for row in range(self.n_cards):
+            yield str(self._card(row)[0]).zfill(CARD_NUMBER_DIGITS)
+
+    def load(self, records: Iterable[Tuple[str, dict]]):
+        """The cards of a store are fixed, build a new store with build_store()"""
+        raise ValueError("cards cannot be added to a store file, use build_store()")
+
+    def is_registered_batch(self, card_numbers: Sequence[str]) -> List[bool]:
+        return [self._card_row(card_number) >= 0 for card_number in card_numbers]
+
+    def tx_update_accounts_batch(self, items: Sequence[Tuple[str, int, int]], atomic: bool = True) -> List:
+        # 1st pass: find the account rows of all items (-1: invalid item)
+        acc_rows = [self._acc_row(token, acc_idx) for token, acc_idx, _ in items]
+        if atomic and -1 in acc_rows:
+            return [False, [[acc_row >= 0, None] for acc_row in acc_rows]]
+        # 2nd pass: apply
+        results = []
+        with self._lock:
+            for (_, _, amount), acc_row in zip(items, acc_rows):
+                if acc_row < 0:
+                    results.append([False, None])
+                else:
+                    results.append([True, self._add_balance(acc_row, amount)])
+        return [True, results]
+
+    def flush(self):
+        """Write the updated balances to the file"""
+        self._mm.flush()
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
@@ -9,6 +9,15 @@ class Config:
     """
     DEBUG: bool = False
     TEST_MODE: bool = False
+    LOG_FILE: str = "./controller.log"
+    LOG_QUEUE: bool = False
+    """Write the log by a background thread, not by the caller"""
+    LOG_QUEUE_SIZE: int = 10000
+    """Max. number of records waiting in the queue. More records are dropped."""
+    LOG_FLUSH_RECORDS: int = 64
+    """Flush the log file once per this number of records in queue mode"""
+    LOG_FLUSH_INTERVAL: float = 0.5
+    """Flush the log file at least once per this seconds in queue mode"""
 
 
 @dataclass
@@ -23,6 +32,7 @@ class ProdConfig(Config):
     """Configuration for production device"""
     DEBUG: bool = False
     TEST_MODE: bool = False
+    LOG_QUEUE: bool = True
 
 
 @dataclass
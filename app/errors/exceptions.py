@@ -103,6 +103,14 @@ class NotEnoughMoneyInCashBinException(Exception):
         return f"{C.FAIL}Cash Bin has only ${self._param}.{C.ENDC}"
 
 
+class UndispensableAmountException(Exception):
+    def __init__(self, param):
+        self._param = param
+
+    def __str__(self):
+        return f"{C.FAIL}Cash Bin cannot pay out exactly ${self._param}.{C.ENDC}"
+
+
 class NotEnoughMoneyInAccountException(Exception):
     def __init__(self, param):
         self._param = param
@@ -116,4 +124,29 @@ class NotEnoughPaperInPrinterException(Exception):
         self._param = param
 
     def __str__(self):
-        return f"{C.WARNING}Paper in printer: {self._param}.{C.ENDC}"
\ No newline at end of file
+        return f"{C.WARNING}Paper in printer: {self._param}.{C.ENDC}"
+
+
+class BankConnectionException(Exception):
+    def __init__(self, param):
+        self._param = param
+
+    def __str__(self):
+        return f"{C.FAIL}Connection to the bank failed: {self._param}{C.ENDC}"
+
+
+class DeviceActionsFailedException(Exception):
+    def __init__(self, errors: list):
+        self.errors = errors
+
+    def __str__(self):
+        details = ", ".join(f"{type(e).__name__}({e})" for e in self.errors)
+        return f"{C.FAIL}{len(self.errors)} device action(s) failed: {details}{C.ENDC}"
+
+
+class JournalFailedException(Exception):
+    def __init__(self, param):
+        self._param = param
+
+    def __str__(self):
+        return f"{C.FAIL}Writing the journal failed: {self._param}{C.ENDC}"
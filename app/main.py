@@ -255,5 +255,6 @@ if __name__ == "__main__":
     normal_flow_balance()
     normal_flow_deposit(10)
     normal_flow_withdraw(25)
+    ctrl.close()
 
 
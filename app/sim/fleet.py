@@ -0,0 +1,265 @@
+"""
+Fleet load simulator
+
+Starts N ATMController terminals sharing one TestBankAdopter and drives them with
+the seeded customer operations of a Workload (Zipf card popularity). Terminals are
+stepped round-robin, so sessions of different terminals interleave like they do in
+front of a real bank.
+
+```shell
+export PYTHONPATH=`pwd`
+python3 app/sim/fleet.py --terminals 1000 --sessions 20000 --seed 7
+```
+"""
+import argparse
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator
+
+from app.atm.controller import ATMController, ATMStatus
+from app.atm.hardware.cardreader import TestCardReader
+from app.atm.hardware.cashbin import TestCashBin
+from app.atm.hardware.printer import TestPrinter
+from app.bank.adopter import TestBankAdopter
+from app.bank.bank import Bank
+from app.errors.exceptions import *
+from app.sim.workload import OPERATIONS, ZIPF_EXPONENT, Operation, Workload
+from app.utils.logger import logger
+from app.utils.metrics import Histogram
+
+FLOWS = OPERATIONS
+"""Kinds of customer flows"""
+EXPECTED_EXCEPTIONS = {
+    "withdraw": (NotEnoughMoneyInAccountException,),
+    "wrong_pin": (IncorrectPinNumberException,),
+    "unregistered": (UnregisteredCardNumberException,),
+}
+"""Exceptions which are the normal end of a flow"""
+PERCENTILES = (50, 95, 99)
+
+
+@dataclass
+class FleetReport:
+    """Result of a fleet simulation"""
+    terminals: int
+    sessions: int = 0
+    elapsed: float = 0.0
+    flows: Dict[str, int] = field(default_factory=dict)
+    """Number of sessions per kind of flow"""
+    errors: Dict[str, int] = field(default_factory=dict)
+    """Number of unexpected exceptions per exception name"""
+    latencies: Dict[str, Histogram] = field(default_factory=dict)
+    """Latency histogram(us) per controller step"""
+    cash_start: int = 0
+    cash_end: int = 0
+    """Money in all cash bins"""
+    balance_start: int = 0
+    balance_end: int = 0
+    """Balance of all accounts in the bank"""
+
+    @property
+    def sessions_per_sec(self) -> float:
+        return self.sessions / self.elapsed if self.elapsed > 0 else 0.0
+
+    def step_percentiles(self) -> Dict[str, Dict[int, float]]:
+        """p50/p95/p99 latency(sec.) per controller step"""
+        return {step: {p: histogram.percentile(p) / 1e6 for p in PERCENTILES}
+                for step, histogram in self.latencies.items()}
+
+    def merge(self, other: "FleetReport"):
+        """Add the results of a fleet which ran at the same time (e.g. in another process)"""
+        self.terminals += other.terminals
+        self.sessions += other.sessions
+        self.elapsed = max(self.elapsed, other.elapsed)
+        for name, n in other.flows.items():
+            self.flows[name] = self.flows.get(name, 0) + n
+        for name, n in other.errors.items():
+            self.errors[name] = self.errors.get(name, 0) + n
+        for step, histogram in other.latencies.items():
+            self.latencies.setdefault(step, Histogram()).merge(histogram)
+        self.cash_start += other.cash_start
+        self.cash_end += other.cash_end
+        self.balance_start += other.balance_start
+        self.balance_end += other.balance_end
+
+    def summary(self) -> str:
+        lines = [f"terminals={self.terminals} sessions={self.sessions} "
+                 f"elapsed={self.elapsed:.3f}s sessions/sec={self.sessions_per_sec:.1f}",
+                 f"flows={self.flows} errors={self.errors}",
+                 f"cash={self.cash_start}->{self.cash_end} balance={self.balance_start}->{self.balance_end}",
+                 f"{'step':<20}{'count':>10}" + "".join(f"{'p' + str(p) + '(us)':>12}" for p in PERCENTILES)]
+        for step, values in sorted(self.step_percentiles().items()):
+            lines.append(f"{step:<20}{len(self.latencies[step]):>10}"
+                         + "".join(f"{values[p] * 1e6:>12.1f}" for p in PERCENTILES))
+        return "\n".join(lines)
+
+
+def make_bank_data(n_cards: int, seed: int = 0, max_accounts: int = 3) -> dict:
+    """Seeded cards and accounts in the format of TestBankAdopter.set_bank_data()"""
+    return dict(Workload(n_cards, seed, max_accounts=max_accounts).records())
+
+
+class Terminal:
+    """One simulated ATM and its customer flows"""
+    ctrl: ATMController
+
+    def __init__(self, bank: Bank, cash: int):
+        self.ctrl = ATMController(bank=bank,
+                                  reader=TestCardReader(),
+                                  cashbin=TestCashBin(available_money=cash),
+                                  printer=TestPrinter(paper=10 ** 9))
+
+    def session(self, op: Operation, report: FleetReport) -> Iterator[None]:
+        """
+        Run one customer flow, yielding after every controller step
+
+        Expected failures (wrong PIN, unregistered card, ...) belong to the flows,
+        any other exception is counted in report.errors and ends the session.
+        """
+        ctrl = self.ctrl
+        flow = op.kind
+        latencies = report.latencies
+        clock = time.perf_counter_ns
+
+        def step(name: str, func, *args):
+            start = clock()
+            try:
+                return func(*args)
+            finally:
+                histogram = latencies.get(name)
+                if histogram is None:
+                    histogram = latencies[name] = Histogram()
+                histogram.record((clock() - start) // 1000)
+
+        try:
+            step("insert_card", ctrl.insert_card, op.card_number)
+            yield
+            step("read_card_number", ctrl.read_card_number)
+            yield
+            step("validate_pin_number", ctrl.validate_pin_number, op.pin)
+            yield
+            step("get_accounts", ctrl.get_accounts)
+            yield
+            step("select_account", ctrl.select_account, op.acc_idx)
+            yield
+            if flow == "balance":
+                step("get_balance", ctrl.get_balance)
+            elif flow == "deposit":
+                ctrl.open_door()
+                ctrl.cash_bin.set_counting_money(op.amount)
+                ctrl.close_door()
+                step("deposit", ctrl.deposit, ctrl.count_money())
+            else:
+                step("withdraw", ctrl.withdraw, op.amount)
+                ctrl.close_door()
+        except EXPECTED_EXCEPTIONS.get(flow, ()):
+            pass
+        except Exception as e:
+            name = type(e).__name__
+            report.errors[name] = report.errors.get(name, 0) + 1
+            if ctrl.status != ATMStatus.ATM_NO_CARD:
+                ctrl.reset()
+
+
+def total_balance(adopter: TestBankAdopter) -> int:
+    """Balance of all accounts"""
+    return sum(acc.balance for record in adopter.bank_data.values() for acc in record.accounts)
+
+
+def run_workload(workload: Workload,
+                 terminals: int,
+                 sessions: int,
+                 cash: int = 10 ** 9,
+                 quiet: bool = True) -> FleetReport:
+    """
+    Run sessions of the workload's operations on terminals sharing one bank with its cards
+
+    :param workload: cards of the bank and customer operations
+    :param terminals: number of ATMController instances
+    :param sessions: total number of customer sessions over all terminals
+    :param cash: initial money in each cash bin
+    :param quiet: disable controller.log while running
+    """
+    operations = workload.operations()
+    adopter = TestBankAdopter()
+    workload.load(adopter)
+
+    report = FleetReport(terminals=terminals)
+    bank = Bank(adopter=adopter)    # shared by all terminals, one session per customer
+    fleet = [Terminal(bank, cash) for _ in range(terminals)]
+    report.cash_start = cash * terminals
+    report.balance_start = total_balance(adopter)
+
+    def new_session(terminal: Terminal) -> Iterator[None]:
+        op = next(operations)
+        report.flows[op.kind] = report.flows.get(op.kind, 0) + 1
+        return terminal.session(op, report)
+
+    was_disabled = logger.disabled
+    logger.disabled = quiet or was_disabled
+    try:
+        started = 0
+        running = []
+        for terminal in fleet[:sessions]:
+            running.append((terminal, new_session(terminal)))
+            started += 1
+        start = time.perf_counter()
+        while running:
+            still_running = []
+            for terminal, session in running:
+                try:
+                    next(session)
+                except StopIteration:
+                    report.sessions += 1
+                    if started < sessions:
+                        session = new_session(terminal)
+                        started += 1
+                    else:
+                        continue
+                still_running.append((terminal, session))
+            running = still_running
+        report.elapsed = time.perf_counter() - start
+    finally:
+        logger.disabled = was_disabled
+        for terminal in fleet:
+            terminal.ctrl.close()
+    report.cash_end = sum(terminal.ctrl.cash_bin.available_money for terminal in fleet)
+    report.balance_end = total_balance(adopter)
+    return report
+
+
+def run_fleet(terminals: int,
+              sessions: int,
+              seed: int = 0,
+              n_cards: int = 1000,
+              flow_weights: Dict[str, float] = None,
+              cash: int = 10 ** 9,
+              quiet: bool = True,
+              zipf: float = ZIPF_EXPONENT) -> FleetReport:
+    """
+    Run the simulation and report throughput and latency per step
+
+    :param terminals: number of ATMController instances
+    :param sessions: total number of customer sessions over all terminals
+    :param seed: seed of the Workload (flows and test data)
+    :param n_cards: number of registered cards in the shared TestBankAdopter
+    :param flow_weights: weights of FLOWS (default: uniform)
+    :param cash: initial money in each cash bin
+    :param quiet: disable controller.log while running
+    :param zipf: exponent of the card popularity, 0 is uniform
+    """
+    mix = flow_weights if flow_weights else {flow: 1.0 for flow in FLOWS}
+    return run_workload(Workload(n_cards, seed, zipf=zipf, mix=mix), terminals, sessions, cash, quiet)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fleet load simulator of ATMController")
+    parser.add_argument("--terminals", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cards", type=int, default=1000)
+    parser.add_argument("--zipf", type=float, default=ZIPF_EXPONENT, help="card popularity, 0 is uniform")
+    parser.add_argument("--log", action="store_true", help="write controller.log while running")
+    args = parser.parse_args()
+    print(run_fleet(args.terminals, args.sessions, args.seed, args.cards, quiet=not args.log,
+                    zipf=args.zipf).summary())
@@ -0,0 +1,101 @@
+"""
+Multi-process fleet simulator
+
+One CPython process runs the fleet on one core. run_parallel_fleet() splits it over a
+process pool: every worker owns a partition of the card space (a Workload partition
+with its own bank) and its share of the terminals, so workers never share state. The
+sessions are divided in proportion to the Zipf weight of each partition, so all
+workers together follow the popularity of one fleet. The reports of the workers
+(latency histograms, counters, cash and balance totals) are merged at the end.
+
+```shell
+export PYTHONPATH=`pwd`
+python3 app/sim/parallel.py --workers 8 --terminals 1000 --sessions 1000000 --cards 100000
+```
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.sim.fleet import FLOWS, FleetReport, run_workload
+from app.sim.workload import ZIPF_EXPONENT, Workload
+
+
+@dataclass
+class ParallelFleetReport(FleetReport):
+    """Merged result of all workers, elapsed is the slowest worker"""
+    workers: int = 0
+    wall: float = 0.0
+    """Seconds of the whole run, with starting the processes and loading the banks"""
+
+
+def split(total: int, weights: List[float]) -> List[int]:
+    """Divide total in proportion to weights (largest remainder), the parts add up to total"""
+    exact = [total * w / sum(weights) for w in weights]
+    parts = [int(x) for x in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact[i] - parts[i], reverse=True)
+    for i in by_remainder[:total - sum(parts)]:
+        parts[i] += 1
+    return parts
+
+
+def _run_worker(workload: Workload, terminals: int, sessions: int, cash: int) -> FleetReport:
+    return run_workload(workload, terminals, sessions, cash, quiet=True)
+
+
+def run_parallel_fleet(workers: int,
+                       terminals: int,
+                       sessions: int,
+                       seed: int = 0,
+                       n_cards: int = 1000,
+                       flow_weights: Optional[Dict[str, float]] = None,
+                       cash: int = 10 ** 9,
+                       zipf: float = ZIPF_EXPONENT) -> ParallelFleetReport:
+    """
+    Run the fleet simulation in a process pool
+
+    :param workers: number of processes (= partitions of the card space)
+    :param terminals: number of ATMController instances over all workers
+    :param sessions: total number of customer sessions over all workers
+    :param seed: seed of the Workload
+    :param n_cards: number of registered cards over all partitions
+    :param flow_weights: weights of FLOWS (default: uniform)
+    :param cash: initial money in each cash bin
+    :param zipf: exponent of the card popularity, 0 is uniform
+    """
+    if not 0 < workers <= min(terminals, n_cards):
+        raise ValueError("workers must be in 1..min(terminals, n_cards)")
+    mix = flow_weights if flow_weights else {flow: 1.0 for flow in FLOWS}
+    workloads = [Workload(n_cards, seed, zipf=zipf, mix=mix, partition=i, partitions=workers)
+                 for i in range(workers)]
+    terminal_parts = split(terminals, [1.0] * workers)
+    session_parts = split(sessions, [workload.weight() for workload in workloads])
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_worker, workload, n_terminals, n_sessions, cash)
+                   for workload, n_terminals, n_sessions in zip(workloads, terminal_parts, session_parts)]
+        reports = [future.result() for future in futures]
+
+    merged = ParallelFleetReport(terminals=0, workers=workers)
+    for report in reports:
+        merged.merge(report)
+    merged.wall = time.perf_counter() - start
+    return merged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-process fleet simulator of ATMController")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--terminals", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cards", type=int, default=1000)
+    parser.add_argument("--zipf", type=float, default=ZIPF_EXPONENT, help="card popularity, 0 is uniform")
+    args = parser.parse_args()
+    result = run_parallel_fleet(args.workers, args.terminals, args.sessions, args.seed, args.cards, zipf=args.zipf)
+    print(f"workers={result.workers} wall={result.wall:.3f}s")
+    print(result.summary())
@@ -0,0 +1,359 @@
+"""
+Session replay of controller.log
+
+Streams the log of one controller, rebuilds every customer session from its tokens
+(INSERTED_CARD: ... RESET) and runs the sessions again against a fresh ATMController
+and TestBankAdopter as fast as possible, with logging disabled. The outcome of every
+step is compared with the one in the log, so recorded traffic becomes a regression
+and performance workload.
+
+The log has no PINs: every card of the replay bank gets REPLAY_PIN, and the steps enter
+it or WRONG_PIN as logged. Cards and accounts are registered when they first appear in
+the log (REGISTERED_CARD, ACCOUNTS_DATA). Logs of several terminals written into one file
+cannot be told apart, and their sessions diverge.
+
+```shell
+export PYTHONPATH=`pwd`
+python3 app/sim/replay.py controller.log
+```
+"""
+import argparse
+import time
+from ast import literal_eval
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.atm.controller import ATMController
+from app.atm.hardware.cardreader import TestCardReader
+from app.atm.hardware.cashbin import TestCashBin
+from app.atm.hardware.printer import TestPrinter
+from app.bank.adopter import TestBankAdopter
+from app.bank.bank import Bank
+from app.bank.models import Account, CardRecord
+from app.common.consts import PIN_NUMBER_DIGITS
+from app.errors.exceptions import *
+from app.utils.logger import logger
+
+REPLAY_PIN = "0" * PIN_NUMBER_DIGITS
+WRONG_PIN = "9" * PIN_NUMBER_DIGITS
+
+OUTCOMES: Dict[str, Tuple[str, Dict[type, str]]] = {
+    "insert_card": ("INSERTED_CARD", {}),
+    "read_card_number": ("REGISTERED_CARD", {UnregisteredCardNumberException: "UNREGISTERED_CARD",
+                                             InvalidCardNumberException: "INVALID_CARD_FORMAT"}),
+    "validate_pin_number": ("PIN_IS_CORRECT", {IncorrectPinNumberException: "PIN_IS_INCORRECT",
+                                               InvalidPinNumberException: "INVALID_PIN_FORMAT"}),
+    "get_accounts": ("ACCOUNTS_DATA", {NoAccountException: "NO_ACCOUNTS"}),
+    "select_account": ("ACCOUNT_SELECTED", {}),
+    "get_balance": ("BANK_BALANCE_OK", {InvalidAccountInfoException: "INVALID_ACCOUNT_INFO"}),
+    "deposit": ("BANK_DEPOSIT_OK", {InvalidAmountValueException: "INVALID_DEPOSIT_VALUE",
+                                    UpdateAccountFailedException: "BANK_DEPOSIT_FAIL"}),
+    "withdraw": ("BANK_WITHDRAW_OK", {InvalidAmountValueException: "INVALID_WITHDRAW_VALUE",
+                                      NotEnoughMoneyInAccountException: "NOT_ENOUGH_MONEY_IN_ACCOUNT",
+                                      NotEnoughMoneyInCashBinException: "NOT_ENOUGH_MONEY_IN_CASH_BIN",
+                                      UndispensableAmountException: "UNDISPENSABLE_AMOUNT",
+                                      UpdateAccountFailedException: "BANK_WITHDRAW_FAIL"}),
+    "card_removed": ("REMOVED_CARD", {}),
+}
+"""Log token of the success and of the expected exceptions of each controller step"""
+
+_PLACEHOLDER_ARGS = {"validate_pin_number": (REPLAY_PIN,), "select_account": (0,), "deposit": (1,), "withdraw": (1,)}
+"""Arguments of a step which failed with INVALID_STATUS (they are not logged)"""
+
+_RESULTS = ("BANK_BALANCE_OK", "INVALID_ACCOUNT_INFO", "BANK_DEPOSIT_OK", "BANK_DEPOSIT_FAIL",
+            "BANK_WITHDRAW_OK", "BANK_WITHDRAW_FAIL")
+"""Tokens logged after *_START, the outcome of that step"""
+
+_WITHDRAW_REFUSED = ("INVALID_WITHDRAW_VALUE", "NOT_ENOUGH_MONEY_IN_ACCOUNT",
+                     "NOT_ENOUGH_MONEY_IN_CASH_BIN", "UNDISPENSABLE_AMOUNT")
+
+
+@dataclass
+class Step:
+    """One controller call of a session"""
+    action: str
+    """Method of ATMController"""
+    args: tuple = ()
+    expected: Optional[str] = None
+    """Token of the outcome in the log, None if the log ends before it"""
+    data: Optional[str] = None
+    """Logged result to compare (ACCOUNTS_DATA)"""
+    cash: Optional[int] = None
+    """Money in the cash bin at this step, if logged"""
+
+
+@dataclass
+class ReplaySession:
+    """Steps from INSERTED_CARD to RESET (or to the next INSERTED_CARD)"""
+    card_number: str
+    started: float
+    """Timestamp(sec.) of the first line"""
+    ended: float = 0.0
+    """Timestamp(sec.) of the last line"""
+    steps: List[Step] = field(default_factory=list)
+    replayable: bool = True
+    """False if the arguments of a step are not in the log (e.g. amounts in older logs)"""
+
+
+@dataclass
+class Divergence:
+    """First step of a session whose outcome differs from the log"""
+    session: int
+    """Index of the session in the log"""
+    step: int
+    action: str
+    expected: str
+    actual: str
+
+
+@dataclass
+class ReplayReport:
+    """Result of a replay"""
+    sessions: int = 0
+    replayed: int = 0
+    skipped: int = 0
+    """Sessions which are not replayable"""
+    diverged: int = 0
+    steps: int = 0
+    elapsed: float = 0.0
+    """Seconds spent replaying (without reading the log)"""
+    live_busy: float = 0.0
+    """Seconds the replayed sessions took live, from their first to their last line"""
+    live_span: float = 0.0
+    """Seconds from the first to the last replayed session in the log, with idle time"""
+    divergences: List[Divergence] = field(default_factory=list)
+    """The first divergences, up to max_divergences"""
+
+    @property
+    def sessions_per_sec(self) -> float:
+        return self.replayed / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def live_sessions_per_sec(self) -> float:
+        return self.replayed / self.live_busy if self.live_busy > 0 else 0.0
+
+    @property
+    def speedup(self) -> float:
+        """How many times faster than live (busy time)"""
+        return self.live_busy / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        lines = [f"sessions={self.sessions} replayed={self.replayed} skipped={self.skipped} "
+                 f"diverged={self.diverged} steps={self.steps}",
+                 f"replay: elapsed={self.elapsed:.3f}s sessions/sec={self.sessions_per_sec:.1f}",
+                 f"live:   busy={self.live_busy:.3f}s span={self.live_span:.3f}s "
+                 f"sessions/sec={self.live_sessions_per_sec:.1f} speedup={self.speedup:.1f}x"]
+        for d in self.divergences:
+            lines.append(f"  session {d.session} step {d.step} {d.action}: "
+                         f"expected {d.expected}, got {d.actual}")
+        return "\n".join(lines)
+
+
+_dates: Dict[str, float] = {}
+
+
+def _timestamp(stamp: str) -> float:
+    """Seconds of a log time "YYYY-MM-DD HH:MM:SS.mmm" (strptime only once per date)"""
+    date, _, clock = stamp.partition(" ")
+    base = _dates.get(date)
+    if base is None:
+        base = _dates[date] = datetime.strptime(date, "%Y-%m-%d").timestamp()
+    h, m, s = clock.split(":")
+    return base + int(h) * 3600 + int(m) * 60 + float(s)
+
+
+def parse_log(lines: Iterable[str]) -> Iterator[ReplaySession]:
+    """Sessions of a controller.log, one at a time (lines outside of a session are skipped)"""
+    session: Optional[ReplaySession] = None
+    stamp = ""
+    for line in lines:
+        header, sep, message = line.rstrip("\n").partition("    ")
+        if not sep:
+            continue
+        token, _, value = message.partition(":")
+        if token == "INSERTED_CARD":
+            if session is not None:
+                session.ended = _timestamp(stamp)
+                yield session
+            stamp = header.partition("\t")[2]
+            session = ReplaySession(value, _timestamp(stamp))
+            session.steps.append(Step("insert_card", (value,), token))
+            continue
+        if session is None:
+            continue
+        stamp = header.partition("\t")[2]
+        try:
+            _add_step(session, token, value.strip())
+        except ValueError:
+            session.replayable = False
+        if token == "RESET":
+            session.ended = _timestamp(stamp)
+            yield session
+            session = None
+    if session is not None:
+        session.ended = _timestamp(stamp)
+        yield session
+
+
+def _add_step(session: ReplaySession, token: str, value: str):
+    steps = session.steps
+    if token in ("REGISTERED_CARD", "UNREGISTERED_CARD", "INVALID_CARD_FORMAT"):
+        steps.append(Step("read_card_number", (), token))
+    elif token == "PIN_IS_CORRECT":
+        steps.append(Step("validate_pin_number", (REPLAY_PIN,), token))
+    elif token == "PIN_IS_INCORRECT":
+        steps.append(Step("validate_pin_number", (WRONG_PIN,), token))
+    elif token == "INVALID_PIN_FORMAT":
+        steps.append(Step("validate_pin_number", (value,), token))
+    elif token == "ACCOUNTS_DATA":
+        steps.append(Step("get_accounts", (), token, data=value))
+    elif token == "NO_ACCOUNTS":
+        steps.append(Step("get_accounts", (), token))
+    elif token == "ACCOUNT_SELECTED":
+        steps.append(Step("select_account", (int(value),), token))
+    elif token == "BANK_BALANCE_START":
+        steps.append(Step("get_balance"))
+    elif token in ("BANK_DEPOSIT_START", "BANK_WITHDRAW_START"):
+        # the outcome follows as a token of _RESULTS
+        steps.append(Step("deposit" if token == "BANK_DEPOSIT_START" else "withdraw", (int(value),)))
+    elif token in _RESULTS:
+        if steps and steps[-1].expected is None:
+            steps[-1].expected = token
+    elif token == "INVALID_DEPOSIT_VALUE":
+        steps.append(Step("deposit", (int(value),), token))
+    elif token in _WITHDRAW_REFUSED:
+        amount, _, available = value.partition(" > ")
+        step = Step("withdraw", (int(amount),), token)
+        if token == "NOT_ENOUGH_MONEY_IN_CASH_BIN":
+            step.cash = int(available)
+        steps.append(step)
+    elif token == "INVALID_STATUS":
+        action = value.rpartition(" at ")[2]
+        if action not in OUTCOMES:
+            raise ValueError(action)
+        steps.append(Step(action, _PLACEHOLDER_ARGS.get(action, ()), token))
+    elif token == "REMOVED_CARD":
+        steps.append(Step("card_removed", (), token))
+
+
+class Replayer:
+    """Fresh controller and bank which replay sessions one after another"""
+    adopter: TestBankAdopter
+    ctrl: ATMController
+
+    def __init__(self, cash: int = 10 ** 9):
+        self.adopter = TestBankAdopter()
+        self.ctrl = ATMController(bank=Bank(adopter=self.adopter),
+                                  reader=TestCardReader(),
+                                  cashbin=TestCashBin(available_money=cash),
+                                  printer=TestPrinter(paper=10 ** 9))
+        self._accounts_known = set()
+
+    def close(self):
+        self.ctrl.close()
+
+    def register(self, session: ReplaySession):
+        """Add the card and its accounts to the bank as the session saw them, if still unknown"""
+        card_number = session.card_number
+        bank_data = self.adopter.bank_data
+        for step in session.steps:
+            if step.expected == "REGISTERED_CARD":
+                if card_number not in bank_data:
+                    bank_data[card_number] = CardRecord(REPLAY_PIN)
+            elif step.expected == "UNREGISTERED_CARD":
+                bank_data.pop(card_number, None)
+                self._accounts_known.discard(card_number)
+            elif step.action == "get_accounts" and card_number not in self._accounts_known:
+                if step.expected == "ACCOUNTS_DATA":
+                    accounts = [Account.from_dict(acc) for acc in literal_eval(step.data)]
+                elif step.expected == "NO_ACCOUNTS":
+                    accounts = []
+                else:
+                    continue
+                bank_data.setdefault(card_number, CardRecord(REPLAY_PIN)).accounts = accounts
+                self._accounts_known.add(card_number)
+
+    def run(self, session: ReplaySession, index: int = 0) -> Optional[Divergence]:
+        """Run the steps, stop at the first one whose outcome differs from the log"""
+        ctrl = self.ctrl
+        for i, step in enumerate(session.steps):
+            success, failures = OUTCOMES[step.action]
+            if step.cash is not None:
+                ctrl.cash_bin.available_money = step.cash
+            if step.action == "deposit":
+                ctrl.cash_bin.set_counting_money(step.args[0])
+            try:
+                result = getattr(ctrl, step.action)(*step.args)
+                actual = success
+                if step.data is not None and str(result) != step.data:
+                    actual = f"{success}: {result}"
+            except InvalidATMStatusException:
+                actual = "INVALID_STATUS"
+            except Exception as e:
+                actual = failures.get(type(e), type(e).__name__)
+            if step.expected is not None and actual != step.expected:
+                expected = step.expected if step.data is None else f"{step.expected}: {step.data}"
+                return Divergence(index, i, step.action, expected, actual)
+        return None
+
+
+def replay(sessions: Iterable[ReplaySession], cash: int = 10 ** 9, max_divergences: int = 20,
+           limit: Optional[int] = None) -> ReplayReport:
+    """
+    Replay the sessions in order against a fresh controller and bank
+
+    :param sessions: e.g. parse_log(open("controller.log"))
+    :param cash: initial money in the cash bin
+    :param max_divergences: number of divergences kept in the report
+    :param limit: stop after this number of sessions
+    """
+    report = ReplayReport()
+    replayer = Replayer(cash)
+    clock = time.perf_counter
+    first_started = last_ended = None
+    was_disabled = logger.disabled
+    logger.disabled = True
+    try:
+        for index, session in enumerate(sessions):
+            if limit is not None and index >= limit:
+                break
+            report.sessions += 1
+            if not session.replayable:
+                report.skipped += 1
+                continue
+            replayer.register(session)
+            start = clock()
+            divergence = replayer.run(session, index)
+            report.elapsed += clock() - start
+            report.replayed += 1
+            report.steps += len(session.steps)
+            report.live_busy += session.ended - session.started
+            if first_started is None:
+                first_started = session.started
+            last_ended = session.ended
+            if divergence is not None:
+                report.diverged += 1
+                if len(report.divergences) < max_divergences:
+                    report.divergences.append(divergence)
+    finally:
+        logger.disabled = was_disabled
+        replayer.close()
+    if first_started is not None:
+        report.live_span = last_ended - first_started
+    return report
+
+
+def replay_file(path: str, **kwargs) -> ReplayReport:
+    """Replay a controller.log, streaming it line by line"""
+    with open(path) as f:
+        return replay(parse_log(f), **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the sessions of a controller.log")
+    parser.add_argument("log", nargs="?", default="controller.log")
+    parser.add_argument("--limit", type=int, default=None, help="replay only the first N sessions")
+    parser.add_argument("--cash", type=int, default=10 ** 9)
+    args = parser.parse_args()
+    print(replay_file(args.log, cash=args.cash, limit=args.limit).summary())
@@ -0,0 +1,202 @@
+"""
+Seeded synthetic workload
+
+Workload streams cards and accounts into an adopter, and customer operations whose
+cards follow a Zipf distribution: the card of popularity rank k is picked with a
+weight of 1 / (k + 1) ** zipf. Everything is a function of the seed, so cache, index
+and ledger work can be measured on the same skewed traffic again.
+
+Nothing is kept per card. The card of rank k is an affine permutation of the card
+number space, and its PIN and accounts are hashed from (seed, k). Ranks >= n_cards
+map to card numbers which are not registered. A Workload can be limited to one of
+several partitions of the ranks (k % partitions == partition), e.g. one per process.
+
+```shell
+export PYTHONPATH=`pwd`
+python3 app/sim/workload.py --cards 1000000 --operations 10 --seed 7
+```
+"""
+import argparse
+import random
+from array import array
+from bisect import bisect
+from itertools import accumulate
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.bank.adopter import BankAdopterInterface
+from app.common.consts import CARD_NUMBER_DIGITS, PIN_NUMBER_DIGITS
+
+OPERATIONS = ("balance", "deposit", "withdraw", "wrong_pin", "unregistered")
+"""Kinds of customer operations"""
+DEFAULT_MIX = {"balance": 0.40, "deposit": 0.15, "withdraw": 0.35, "wrong_pin": 0.07, "unregistered": 0.03}
+ZIPF_EXPONENT = 1.1
+
+CARD_SPACE = 10 ** CARD_NUMBER_DIGITS
+PIN_SPACE = 10 ** PIN_NUMBER_DIGITS
+_MASK64 = (1 << 64) - 1
+
+
+def _mix(x: int) -> int:
+    """splitmix64 finalizer, spreads the bits of x over 64 bits"""
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+class Operation(NamedTuple):
+    """One customer session"""
+    kind: str
+    """One of OPERATIONS"""
+    card_number: str
+    pin: str
+    """PIN to enter (a wrong one for wrong_pin)"""
+    acc_idx: int
+    amount: int
+    """Money to deposit or withdraw"""
+    rank: int
+    """Popularity rank of the card, -1 if it is not registered"""
+
+
+class Workload:
+    """Deterministic cards, accounts and operations of a seed"""
+    n_cards: int
+    seed: int
+    zipf: float
+    """Exponent of the card popularity, 0 is uniform"""
+    mix: Dict[str, float]
+    """Weights of the kinds of operations"""
+    max_accounts: int
+    max_balance: int
+    max_amount: int
+    partition: int
+    partitions: int
+    """The cards and operations are those of the ranks k % partitions == partition"""
+
+    def __init__(self, n_cards: int, seed: int = 0, zipf: float = ZIPF_EXPONENT,
+                 mix: Optional[Dict[str, float]] = None, max_accounts: int = 3,
+                 max_balance: int = 1000, max_amount: int = 500,
+                 partition: int = 0, partitions: int = 1):
+        if not 0 < n_cards < CARD_SPACE:
+            raise ValueError(f"n_cards must be in 1..{CARD_SPACE - 1}")
+        if not 0 <= partition < partitions <= n_cards:
+            raise ValueError("partition must be in 0..partitions-1, and partitions <= n_cards")
+        mix = dict(DEFAULT_MIX if mix is None else mix)
+        unknown = set(mix) - set(OPERATIONS)
+        if unknown or sum(mix.values()) <= 0:
+            raise ValueError(f"invalid operation mix: {mix}")
+        self.n_cards = n_cards
+        self.seed = seed
+        self.zipf = zipf
+        self.mix = mix
+        self.max_accounts = max_accounts
+        self.max_balance = max_balance
+        self.max_amount = max_amount
+        self.partition = partition
+        self.partitions = partitions
+        self._key = _mix(seed)
+        # card = (a * rank + b) mod CARD_SPACE is a permutation if a is coprime to 10
+        a = _mix(self._key) % CARD_SPACE | 1
+        self._a = a + 2 if a % 5 == 0 else a
+        self._b = _mix(self._key + 1) % CARD_SPACE
+        self._cdf: Optional[array] = None
+
+    def card_number(self, rank: int) -> str:
+        """Card number of a popularity rank (0 is the most popular)"""
+        return str((self._a * rank + self._b) % CARD_SPACE).zfill(CARD_NUMBER_DIGITS)
+
+    def _card_hash(self, rank: int) -> Tuple[int, str, int]:
+        """(hash, PIN, number of accounts) of the card of a rank"""
+        h = _mix(self._key ^ (rank + 2))
+        return h, str(h % PIN_SPACE).zfill(PIN_NUMBER_DIGITS), 1 + (h >> 16) % self.max_accounts
+
+    def record(self, rank: int) -> dict:
+        """PIN and accounts of the card of a rank, in the format of TestBankAdopter.set_bank_data()"""
+        h, pin, n_accounts = self._card_hash(rank)
+        accounts = []
+        for i in range(n_accounts):
+            g = _mix(h + i)
+            accounts.append({"acc_num": str(g % 10 ** 8).zfill(8),
+                             "balance": (g >> 32) % self.max_balance,
+                             "available": True})
+        return {"pin": pin, "accounts": accounts}
+
+    def ranks(self) -> range:
+        """Ranks of the cards of the partition"""
+        return range(self.partition, self.n_cards, self.partitions)
+
+    def records(self) -> Iterator[Tuple[str, dict]]:
+        """All cards of the partition, in rank order"""
+        for rank in self.ranks():
+            yield self.card_number(rank), self.record(rank)
+
+    def load(self, adopter: BankAdopterInterface):
+        """Stream all cards into the adopter"""
+        adopter.load(self.records())
+
+    def cdf(self) -> array:
+        """Cumulative Zipf weights of the ranks of the partition (built on first use, 8 bytes per card)"""
+        if self._cdf is None:
+            s = self.zipf
+            self._cdf = array("d", accumulate((k + 1) ** -s for k in self.ranks()))
+        return self._cdf
+
+    def weight(self) -> float:
+        """Zipf weight of the partition, its share of the operations of all partitions"""
+        return self.cdf()[-1]
+
+    def operations(self, count: Optional[int] = None) -> Iterator[Operation]:
+        """
+        Random operations of the seed, endless if count is None
+
+        The amount of a withdraw is not limited by the balance, so some of them
+        fail with not enough money like at a real ATM.
+        """
+        if self.partitions == 1:
+            rng = random.Random(self.seed)
+        else:
+            rng = random.Random(f"{self.seed}/{self.partition}/{self.partitions}")
+        cdf = self.cdf()
+        total = cdf[-1]
+        kinds = list(self.mix)
+        weights = list(accumulate(self.mix[kind] for kind in kinds))
+        n_cards = self.n_cards
+        partition, partitions, last = self.partition, self.partitions, len(cdf) - 1
+        done = 0
+        while count is None or done < count:
+            kind = kinds[min(bisect(weights, rng.random() * weights[-1]), len(kinds) - 1)]
+            if kind == "unregistered":
+                card_number = self.card_number(n_cards + rng.randrange(CARD_SPACE - n_cards))
+                yield Operation(kind, card_number, "0" * PIN_NUMBER_DIGITS, 0, 0, -1)
+            else:
+                rank = partition + min(bisect(cdf, rng.random() * total), last) * partitions
+                h, pin, n_accounts = self._card_hash(rank)
+                if kind == "wrong_pin":
+                    pin = str((h + 1 + rng.randrange(PIN_SPACE - 1)) % PIN_SPACE).zfill(PIN_NUMBER_DIGITS)
+                yield Operation(kind, self.card_number(rank), pin, rng.randrange(n_accounts),
+                                rng.randint(1, self.max_amount), rank)
+            done += 1
+
+
+def popularity(operations: Iterable[Operation], top: int) -> float:
+    """Share of the operations on registered cards which hit the top ranks"""
+    hits = total = 0
+    for op in operations:
+        if op.rank >= 0:
+            total += 1
+            hits += op.rank < top
+    return hits / total if total else 0.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seeded synthetic workload")
+    parser.add_argument("--cards", type=int, default=100000)
+    parser.add_argument("--operations", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--zipf", type=float, default=ZIPF_EXPONENT)
+    args = parser.parse_args()
+    workload = Workload(args.cards, args.seed, args.zipf)
+    ops: List[Operation] = list(workload.operations(10000))
+    print(f"top 1% of cards: {popularity(ops, max(args.cards // 100, 1)):.1%} of operations")
+    for op in ops[:args.operations]:
+        print(op)
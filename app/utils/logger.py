@@ -1,18 +1,158 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Optional
 
-from app.common.config import conf
+from app.common.config import conf, Config
 
+LOG_FORMAT = "[%(levelname)s]\t%(asctime)s.%(msecs)03d    %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_IMMUTABLE_ARGS = (str, int, float, bool, type(None))
+
+
+class BatchingFileHandler(logging.FileHandler):
+    """FileHandler which flushes once per batch of records instead of once per record"""
+
+    def __init__(self, filename: str, flush_records: int = 64, flush_interval: float = 0.5):
+        super().__init__(filename)
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            self._pending += 1
+            if self._pending >= self.flush_records or time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        super().flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records into the queue without formatting them
+
+    Formatting is done later by the writer thread. Only the arguments which may be
+    changed after logging (lists, dicts, ...) are merged into the message right now.
+    If the queue is full, the record is dropped instead of blocking the caller.
+    """
+    dropped: int
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args and not all(isinstance(arg, _IMMUTABLE_ARGS) for arg in record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class QueueLogWriter:
+    """Background thread which writes the queued records to the handler"""
+    queue: queue.Queue
+    handler: logging.Handler
+
+    def __init__(self, log_queue: queue.Queue, handler: logging.Handler, flush_interval: float = 0.5):
+        self.queue = log_queue
+        self.handler = handler
+        self.flush_interval = flush_interval
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write all queued records and stop the thread"""
+        if self._thread is None:
+            return
+        self.queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self.handler.close()
+
+    def _run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # idle: write out the last incomplete batch
+                self.handler.flush()
+                continue
+            if record is None:
+                break
+            self.handler.handle(record)
+        self.handler.flush()
 
-logging.basicConfig(
-    filename="./controller.log",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    format="[%(levelname)s]\t%(asctime)s.%(msecs)03d    %(message)s"
-)
 
 logger = logging.getLogger("controller")
+log_writer: Optional[QueueLogWriter] = None
+"""Writer thread in queue mode (None in synchronous mode)"""
+
+
+def configure(config: Config):
+    """
+    Set up the controller logger
+
+    - synchronous mode: every record is formatted and written to the file by the caller.
+    - queue mode (LOG_QUEUE): the caller only puts the record into a bounded queue,
+      a background thread formats the records and flushes the file once per batch.
+    """
+    global log_writer
+    if log_writer is not None:
+        log_writer.stop()
+        log_writer = None
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    if config.LOG_QUEUE:
+        file_handler = BatchingFileHandler(config.LOG_FILE, config.LOG_FLUSH_RECORDS, config.LOG_FLUSH_INTERVAL)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+        log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+        logger.addHandler(DeferredQueueHandler(log_queue))
+        logger.propagate = False
+        log_writer = QueueLogWriter(log_queue, file_handler, config.LOG_FLUSH_INTERVAL)
+        log_writer.start()
+    else:
+        logging.basicConfig(filename=config.LOG_FILE, datefmt=LOG_DATE_FORMAT, format=LOG_FORMAT)
+        logger.propagate = True
+
+    if config.DEBUG:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+
+
+def shutdown():
+    """Write out all queued records"""
+    if log_writer is not None:
+        log_writer.stop()
+
 
 c = conf()
-if c.DEBUG:
-    logger.setLevel(logging.DEBUG)
-else:
-    logger.setLevel(logging.INFO)
+configure(c)
+atexit.register(shutdown)
@@ -0,0 +1,186 @@
+"""
+Low-overhead latency histograms and counters
+
+Histogram keeps HDR-style log-linear buckets of integer values (microseconds):
+exact below 32, then 16 buckets per power of two (relative error < 1/16).
+Recording is one bucket increment, so it can stay on in production.
+"""
+import threading
+import time
+from typing import Callable, Dict, Iterable, List
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS          # exact values below this
+HALF_BUCKETS = SUB_BUCKETS >> 1             # buckets per power of two above
+SNAPSHOT_PERCENTILES = (50, 90, 99)
+
+
+def bucket_index(value: int) -> int:
+    if value < SUB_BUCKETS:
+        return value if value > 0 else 0
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    # = SUB_BUCKETS + (shift - 1) * HALF_BUCKETS + (value >> shift) - HALF_BUCKETS
+    return (shift << (SUB_BUCKET_BITS - 1)) + (value >> shift)
+
+
+def bucket_value(index: int) -> int:
+    """Highest value of the bucket"""
+    if index < SUB_BUCKETS:
+        return index
+    shift, sub = divmod(index - SUB_BUCKETS, HALF_BUCKETS)
+    shift += 1
+    return ((sub + HALF_BUCKETS + 1) << shift) - 1
+
+
+class Histogram:
+    """
+    Log-linear histogram of non-negative integers
+
+    record() takes no lock to stay cheap. Values recorded by several threads at the
+    same moment may rarely lose a count, which is fine for diagnosis.
+    """
+    count: int
+    total: int
+    min: int
+    max: int
+
+    def __init__(self):
+        self.counts: List[int] = []
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def __len__(self):
+        """Number of values"""
+        return self.count
+
+    def record(self, value: int):
+        # bucket_index() inlined, this is the hot path
+        if value < SUB_BUCKETS:
+            index = value if value > 0 else 0
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS
+            index = (shift << (SUB_BUCKET_BITS - 1)) + (value >> shift)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        if value > self.max:
+            self.max = value
+        if value < self.min or not self.count:
+            self.min = value
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: "Histogram"):
+        """Add all values of other histogram"""
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, n in enumerate(other.counts):
+            self.counts[index] += n
+        if other.count:
+            self.min = other.min if self.count == 0 else min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, p: float) -> int:
+        """Value at or below which p percent of the values are (within the bucket precision)"""
+        if self.count == 0:
+            return 0
+        rank = max(p / 100.0 * self.count, 1)
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def snapshot(self) -> Dict[str, float]:
+        result = {"count": self.count, "min": self.min, "mean": round(self.mean, 1)}
+        for p in SNAPSHOT_PERCENTILES:
+            result[f"p{p}"] = self.percentile(p)
+        result["max"] = self.max
+        return result
+
+    def to_dict(self) -> dict:
+        """All buckets, e.g. to send to another process and merge there"""
+        return {"counts": list(self.counts), "count": self.count, "total": self.total,
+                "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        histogram = cls()
+        histogram.counts = list(data["counts"])
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+
+class Metrics:
+    """Named latency histograms (microseconds) and counters"""
+
+    def __init__(self, clock: Callable[[], int] = time.perf_counter_ns):
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def increment(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_us(self, name: str, value: int):
+        (self.histograms.get(name) or self.histogram(name)).record(value)
+
+    def timed(self, name: str, func: Callable, *args, **kwargs):
+        """Call func and record its latency as name, failures are counted as name.errors"""
+        clock = self.clock
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            self.increment(name + ".errors")
+            raise
+        finally:
+            (self.histograms.get(name) or self.histogram(name)).record((clock() - start) // 1000)
+
+    def merge(self, other: "Metrics"):
+        for name, histogram in other.histograms.items():
+            self.histogram(name).merge(histogram)
+        for name, n in other.counters.items():
+            self.increment(name, n)
+
+    def snapshot(self) -> dict:
+        """Compact summary: {"counters": {name: n}, "latency_us": {name: {count, min, mean, p50, p90, p99, max}}}"""
+        return {
+            "counters": dict(self.counters),
+            "latency_us": {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())},
+        }
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+
+
+def merge_metrics(metrics: Iterable[Metrics]) -> Metrics:
+    """One Metrics with all values of the given ones"""
+    merged = Metrics()
+    for m in metrics:
+        merged.merge(m)
+    return merged
@@ -0,0 +1,284 @@
+"""
+Spooling telemetry exporter
+
+emit() only appends an event to a bounded in-memory queue, so it never blocks or does I/O
+on the transaction path. A background thread packs the events into gzip-compressed
+JSON-lines segments in a spool directory. The spool has a size limit: when it is full,
+the oldest segments are dropped. An Uploader drains the segments to a sink, optionally
+only while the ATM is idle.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from app.utils.logger import logger
+
+SEGMENT_PREFIX = "seg-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+SEQ_FILE = "next-seq"
+"""Next segment number, kept when all segments are uploaded so names are never reused"""
+
+
+class TelemetrySpool:
+    """Bounded spool directory of compressed telemetry segments"""
+    directory: str
+    segment_events: int
+    """Max. number of events per segment"""
+    segment_interval: float
+    """Max. seconds an event waits before its segment is written"""
+    max_bytes: int
+    """Size limit of the spool directory, the oldest segments are dropped above it"""
+    dropped_events: int
+    """Events dropped because the queue was full"""
+    dropped_segments: int
+    """Segments dropped because the spool was full"""
+    lost_events: int
+    """Events of segments which could not be written, e.g. because the disk was full"""
+    retry_interval: float
+    """Seconds the writer waits after a failed write"""
+
+    def __init__(self, directory: str, segment_events: int = 256, segment_interval: float = 5.0,
+                 max_bytes: int = 16 * 1024 * 1024, max_pending: int = 10000, compress_level: int = 6,
+                 retry_interval: float = 5.0):
+        self.directory = directory
+        self.segment_events = segment_events
+        self.segment_interval = segment_interval
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.retry_interval = retry_interval
+        self.dropped_events = 0
+        self.dropped_segments = 0
+        self.lost_events = 0
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        self._next_seq = max(int(segments[-1][len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1 if segments else 0,
+                             self._read_seq())
+        self._pending = deque(maxlen=max_pending)
+        self._first_pending_at = 0.0
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="telemetry-spool", daemon=True)
+        self._thread.start()
+
+    def emit(self, kind: str, data):
+        """Queue an event, dropping the oldest one if the queue is full"""
+        event = {"ts": time.time(), "kind": kind, "data": data}
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped_events += 1
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+                self._cond.notify()     # start the timer of the segment
+            self._pending.append(event)
+            if len(self._pending) >= self.segment_events:
+                self._cond.notify()
+
+    def segments(self) -> List[str]:
+        """File names of the segments, oldest first"""
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+        return sorted(names)
+
+    def size(self) -> int:
+        """Bytes of all segments"""
+        return sum(os.path.getsize(os.path.join(self.directory, name)) for name in self.segments())
+
+    def flush(self):
+        """Write all queued events now, raises OSError if they could not be written (see lost_events)"""
+        with self._cond:
+            events = list(self._pending)
+            self._pending.clear()
+        self._write(events)
+
+    def close(self):
+        """Write all queued events and stop the thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and len(self._pending) < self.segment_events:
+                    if self._pending:
+                        remaining = self._first_pending_at + self.segment_interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+                events = [self._pending.popleft() for _ in range(min(len(self._pending), self.segment_events))]
+                if self._pending:
+                    self._first_pending_at = time.monotonic()
+            try:
+                self._write(events)
+            except OSError as e:
+                logger.error("TELEMETRY_WRITE_FAILED:%r", e)
+                with self._cond:
+                    self._cond.wait_for(lambda: self._closed, self.retry_interval)
+
+    def _read_seq(self) -> int:
+        try:
+            with open(os.path.join(self.directory, SEQ_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_seq(self):
+        path = os.path.join(self.directory, SEQ_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(str(self._next_seq))
+        os.replace(path + ".tmp", path)
+
+    def _write(self, events: List[dict]):
+        if not events:
+            return
+        body = "".join(json.dumps(event, separators=(",", ":"), default=str) + "\n" for event in events)
+        payload = gzip.compress(body.encode(), compresslevel=self.compress_level)
+        with self._write_lock:
+            name = f"{SEGMENT_PREFIX}{self._next_seq:012d}{SEGMENT_SUFFIX}"
+            self._next_seq += 1
+            path = os.path.join(self.directory, name)
+            # a segment is visible only when it is complete
+            try:
+                with open(path + ".tmp", "wb") as f:
+                    f.write(payload)
+                os.replace(path + ".tmp", path)
+            except OSError:
+                self.lost_events += len(events)
+                try:
+                    os.remove(path + ".tmp")
+                except OSError:
+                    pass
+                raise
+            self._write_seq()
+            self._enforce_limit()
+
+    def _enforce_limit(self):
+        segments = self.segments()
+        sizes = [os.path.getsize(os.path.join(self.directory, name)) for name in segments]
+        total = sum(sizes)
+        for name, size in zip(segments[:-1], sizes):     # keep the newest one
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:   # uploaded meanwhile
+                pass
+            total -= size
+            self.dropped_segments += 1
+
+
+def read_segment(path: str) -> List[dict]:
+    """Events of a segment file"""
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+class TelemetrySinkInterface:
+    """For implementing the destination of telemetry (e.g. the monitoring server)"""
+    def send(self, name: str, payload: bytes) -> bool:
+        """Send a compressed segment. Return True if it was accepted."""
+        pass
+
+
+class FileSink(TelemetrySinkInterface):
+    """Copies the segments into a local directory, for testing"""
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, name: str, payload: bytes) -> bool:
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(payload)
+        return True
+
+
+class Uploader:
+    """Drains the spool to a sink, oldest segment first"""
+    spool: TelemetrySpool
+    sink: TelemetrySinkInterface
+    interval: float
+    idle: Optional[Callable[[], bool]]
+    """Upload only while this returns True, e.g. lambda: controller.status == ATMStatus.ATM_NO_CARD"""
+    uploaded: int
+
+    def __init__(self, spool: TelemetrySpool, sink: TelemetrySinkInterface, interval: float = 30.0,
+                 idle: Optional[Callable[[], bool]] = None):
+        self.spool = spool
+        self.sink = sink
+        self.interval = interval
+        self.idle = idle
+        self.uploaded = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def drain(self) -> int:
+        """
+        Upload segments until the spool is empty, the sink refuses one or the ATM is busy
+
+        :return: number of uploaded segments
+        """
+        count = 0
+        for name in self.spool.segments():
+            if self.idle is not None and not self.idle():
+                break
+            path = os.path.join(self.spool.directory, name)
+            try:
+                with open(path, "rb") as f:
+                    payload = f.read()
+            except FileNotFoundError:   # dropped by the spool meanwhile
+                continue
+            try:
+                if not self.sink.send(name, payload):
+                    break
+            except OSError:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            count += 1
+        self.uploaded += count
+        return count
+
+    def start(self):
+        """Upload every interval seconds in a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry-uploader", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.drain()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class TelemetryLogHandler(logging.Handler):
+    """Sends log records to the spool as "log" events, e.g. instead of a growing controller.log"""
+    def __init__(self, spool: TelemetrySpool, level: int = logging.INFO):
+        super().__init__(level)
+        self.spool = spool
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.spool.emit("log", {"level": record.levelname, "msg": record.getMessage()})
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,83 @@
+"""End-to-end customer flows like app/main.py"""
+from typing import Dict
+
+from app.bank.adopter import BankAdopterInterface, TestBankAdopter
+from app.bank.net_adopter import NetBankAdopter
+from app.bank.server import BankServer
+from app.sim.fleet import run_fleet
+from benchmarks.common import CARD_NUMBER, PIN_NUMBER, make_controller, measure, small_bank_data
+
+
+def bench_flows(adopter: BankAdopterInterface, number: int, prefix: str) -> Dict[str, dict]:
+    ctrl = make_controller(adopter)
+
+    def select_account():
+        ctrl.insert_card(CARD_NUMBER)
+        ctrl.read_card_number()
+        ctrl.validate_pin_number(PIN_NUMBER)
+        ctrl.get_accounts()
+        ctrl.select_account(0)
+
+    def flow_balance():
+        select_account()
+        ctrl.get_balance()
+
+    def flow_deposit():
+        select_account()
+        ctrl.open_door()
+        ctrl.cash_bin.set_counting_money(10)
+        ctrl.close_door()
+        ctrl.deposit(ctrl.count_money())
+
+    def flow_withdraw():
+        select_account()
+        ctrl.withdraw(10)
+        ctrl.close_door()
+
+    return {
+        f"{prefix}.flow_balance": measure(flow_balance, None, number),
+        f"{prefix}.flow_deposit": measure(flow_deposit, None, number),
+        f"{prefix}.flow_withdraw": measure(flow_withdraw, None, number),
+    }
+
+
+def bench_net_batch(adopter: NetBankAdopter, number: int) -> Dict[str, dict]:
+    """1000 deposits through the network: one round trip per item vs. one per batch"""
+    items = [("87654321", 0, 1)] * 1000
+
+    def loop():
+        for token, acc_idx, amount in items:
+            adopter.tx_update_account(token, acc_idx, amount)
+
+    return {
+        "net_pooled.tx_update_account_loop[1000]": measure(loop, None, number),
+        "net_pooled.tx_update_accounts_batch[1000]": measure(lambda: adopter.tx_update_accounts_batch(items),
+                                                             None, number),
+    }
+
+
+def run(number: int) -> Dict[str, dict]:
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(small_bank_data())
+    results = bench_flows(adopter, number, "local")
+
+    # same flows through the pooled network adopter and the local stand-in server
+    server_adopter = TestBankAdopter()
+    server_adopter.set_bank_data(small_bank_data())
+    server = BankServer(server_adopter)
+    server.start()
+    net_adopter = NetBankAdopter(*server.address)
+    try:
+        results.update(bench_flows(net_adopter, max(number // 10, 1), "net_pooled"))
+        results.update(bench_net_batch(net_adopter, max(number // 1000, 1)))
+    finally:
+        net_adopter.close()
+        server.stop()
+
+    report = run_fleet(terminals=100, sessions=number, seed=0)
+    results["fleet"] = {
+        "calls": report.sessions,
+        "ops_per_sec": report.sessions_per_sec,
+        "mean_us": report.elapsed / max(report.sessions, 1) * 1e6,
+    }
+    return results
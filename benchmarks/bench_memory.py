@@ -0,0 +1,35 @@
+"""Memory per customer session"""
+import tracemalloc
+from typing import Dict
+
+from app.bank.adopter import TestBankAdopter
+from benchmarks.common import CARD_NUMBER, PIN_NUMBER, make_controller, small_bank_data
+
+
+def run(sessions: int) -> Dict[str, dict]:
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(small_bank_data())
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        terminals = []
+        for _ in range(sessions):
+            # one terminal in the middle of a session (account selected)
+            ctrl = make_controller(adopter)
+            ctrl.insert_card(CARD_NUMBER)
+            ctrl.read_card_number()
+            ctrl.validate_pin_number(PIN_NUMBER)
+            ctrl.get_accounts()
+            ctrl.select_account(0)
+            terminals.append(ctrl)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "memory.open_session": {
+            "sessions": sessions,
+            "bytes_per_session": (after - before) / sessions,
+            "peak_bytes": peak - before,
+        }
+    }
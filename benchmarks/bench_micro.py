@@ -0,0 +1,145 @@
+"""Cost of single methods of the controller, the bank and the bank adopter"""
+import itertools
+import os
+import tempfile
+from typing import Dict
+
+from app.bank.adopter import TestBankAdopter
+from app.bank.bank import Bank
+from app.bank.ledger import LedgerBankAdopter
+from app.bank.store import MmapBankAdopter, build_store
+from app.sim.fleet import make_bank_data
+try:
+    from app.bank.vectorized import VectorLedger
+except ImportError:     # numpy is not installed
+    VectorLedger = None
+from benchmarks.common import CARD_NUMBER, PIN_NUMBER, make_controller, measure, small_bank_data
+
+
+def bench_controller(number: int) -> Dict[str, dict]:
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(small_bank_data())
+    ctrl = make_controller(adopter)
+
+    def to_card_in():
+        ctrl.insert_card(CARD_NUMBER)
+
+    def to_registered_card():
+        to_card_in()
+        ctrl.read_card_number()
+
+    def to_valid_pin():
+        to_registered_card()
+        ctrl.validate_pin_number(PIN_NUMBER)
+
+    def to_account_selected():
+        to_valid_pin()
+        ctrl.get_accounts()
+        ctrl.select_account(0)
+
+    return {
+        "ATMController.read_card_number": measure(ctrl.read_card_number, to_card_in, number),
+        "ATMController.validate_pin_number": measure(lambda: ctrl.validate_pin_number(PIN_NUMBER),
+                                                     to_registered_card, number),
+        "ATMController.get_accounts": measure(ctrl.get_accounts, to_valid_pin, number),
+        "ATMController.withdraw": measure(lambda: ctrl.withdraw(1), to_account_selected, number),
+    }
+
+
+def bench_bank(number: int) -> Dict[str, dict]:
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(small_bank_data())
+    bank = Bank(adopter=adopter)
+    bank.validate(card_number=CARD_NUMBER, entered_pin=PIN_NUMBER)
+    bank.account_list()
+    bank.select_account(0)
+    return {
+        "Bank.update_account": measure(lambda: bank.update_account(amount=-1), None, number),
+    }
+
+
+def bench_adopter(adopter, data: dict, number: int) -> Dict[str, dict]:
+    adopter.set_bank_data(data)
+    # spread over the whole dataset, not only the hot head of the dict
+    sample = list(data)[::max(len(data) // number, 1)][:number]
+    card_numbers = itertools.cycle(sample)
+    tokens = itertools.cycle([card[::-1] for card in sample])
+    name = f"{type(adopter).__name__}[{len(data)}].%s"
+    return {
+        name % "is_registered": measure(lambda: adopter.is_registered(next(card_numbers)), None, number),
+        name % "tx_update_account": measure(lambda: adopter.tx_update_account(next(tokens), 0, 1), None, number),
+    }
+
+
+def bench_batch(adopter, data: dict, batch: int, number: int) -> Dict[str, dict]:
+    """Posting a batch of deposits with one call vs. one call per item"""
+    adopter.set_bank_data(data)
+    sample = list(data)[::max(len(data) // batch, 1)][:batch]
+    items = [(card[::-1], 0, 1) for card in sample]
+
+    def loop():
+        # keep the results like the batch does, else the loop skips the cost of keeping them alive
+        return [adopter.tx_update_account(token, acc_idx, amount) for token, acc_idx, amount in items]
+
+    name = f"{type(adopter).__name__}[{len(data)}].%s[{len(items)}]"
+    return {
+        name % "tx_update_account_loop": measure(loop, None, number),
+        name % "tx_update_accounts_batch": measure(lambda: adopter.tx_update_accounts_batch(items), None, number),
+    }
+
+
+def bench_vectorized(data: dict, batch: int, number: int) -> Dict[str, dict]:
+    """Posting a batch of deposits with numpy, and jobs over all accounts"""
+    adopter = LedgerBankAdopter()
+    adopter.set_bank_data(data)
+    vector = VectorLedger(adopter.ledger)
+    cards = [int(card) for card in list(data)[::max(len(data) // batch, 1)][:batch]]
+    acc_idx = [0] * len(cards)
+    amounts = [1] * len(cards)
+    name = f"VectorLedger[{len(data)}].%s"
+    return {
+        name % f"apply[{len(cards)}]": measure(lambda: vector.apply(cards, acc_idx, amounts), None, number),
+        name % "charge": measure(lambda: vector.charge(0), None, 3),
+        name % "stats": measure(vector.stats, None, 3),
+    }
+
+
+def bench_store(data: dict, number: int) -> Dict[str, dict]:
+    """Startup of the memory-mapped store vs. building the dicts, and its lookups"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bank.store")
+        build_store(path, data.items())
+        opened = []
+        results = {
+            f"TestBankAdopter[{len(data)}].set_bank_data": measure(lambda: TestBankAdopter().set_bank_data(data),
+                                                                    None, 3),
+            f"MmapBankAdopter[{len(data)}].open": measure(lambda: opened.append(MmapBankAdopter(path)), None, 3),
+        }
+        for adopter in opened:
+            adopter.close()
+        adopter = MmapBankAdopter(path)
+        sample = list(data)[::max(len(data) // number, 1)][:number]
+        card_numbers = itertools.cycle(sample)
+        tokens = itertools.cycle([card[::-1] for card in sample])
+        name = f"MmapBankAdopter[{len(data)}].%s"
+        results[name % "is_registered"] = measure(lambda: adopter.is_registered(next(card_numbers)), None, number)
+        results[name % "tx_update_account"] = measure(lambda: adopter.tx_update_account(next(tokens), 0, 1),
+                                                      None, number)
+        adopter.close()
+    return results
+
+
+def run(number: int, cards: int) -> Dict[str, dict]:
+    results = {}
+    results.update(bench_controller(number))
+    results.update(bench_bank(number))
+    data = make_bank_data(cards, seed=0, max_accounts=1)
+    results.update(bench_adopter(LedgerBankAdopter(), data, number))
+    results.update(bench_adopter(TestBankAdopter(), data, number))
+    results.update(bench_store(data, number))
+    for adopter in (TestBankAdopter(), LedgerBankAdopter()):
+        # at least 20 calls: a single sample of a 1000-item batch is mostly noise
+        results.update(bench_batch(adopter, data, 1000, max(number // 1000, 20)))
+    if VectorLedger is not None:
+        results.update(bench_vectorized(data, 1000, max(number // 1000, 1)))
+    return results
@@ -0,0 +1,64 @@
+import time
+from typing import Callable, Dict, Optional
+
+from app.atm.controller import ATMController
+from app.atm.hardware.cardreader import TestCardReader
+from app.atm.hardware.cashbin import TestCashBin
+from app.atm.hardware.printer import TestPrinter
+from app.bank.adopter import BankAdopterInterface
+from app.bank.bank import Bank
+
+CARD_NUMBER = "12345678"
+PIN_NUMBER = "1234"
+
+
+def small_bank_data() -> dict:
+    """Same cards as app/main.py"""
+    return {
+        "12345678": {
+            "pin": "1234",
+            "accounts": [
+                {"acc_num": "11112222", "balance": 10 ** 12, "available": True},
+                {"acc_num": "33334444", "balance": 0, "available": True},
+            ]
+        },
+        "13572468": {
+            "pin": "8888",
+            "accounts": [
+                {"acc_num": "11113333", "balance": 10, "available": True},
+                {"acc_num": "22224444", "balance": 50, "available": True},
+            ]
+        },
+    }
+
+
+def make_controller(adopter: BankAdopterInterface) -> ATMController:
+    return ATMController(bank=Bank(adopter=adopter),
+                         reader=TestCardReader(),
+                         cashbin=TestCashBin(available_money=10 ** 12),
+                         printer=TestPrinter(paper=10 ** 12))
+
+
+def measure(func: Callable, setup: Optional[Callable] = None, number: int = 10000) -> Dict[str, float]:
+    """
+    Time each call of func, running setup (not timed) before every call
+
+    :return: {"calls", "ops_per_sec", "mean_us", "p50_us", "p99_us"}
+    """
+    samples = []
+    clock = time.perf_counter
+    for _ in range(number):
+        if setup is not None:
+            setup()
+        start = clock()
+        func()
+        samples.append(clock() - start)
+    samples.sort()
+    total = sum(samples)
+    return {
+        "calls": number,
+        "ops_per_sec": number / total if total > 0 else 0.0,
+        "mean_us": total / number * 1e6,
+        "p50_us": samples[number // 2] * 1e6,
+        "p99_us": samples[min(int(number * 0.99), number - 1)] * 1e6,
+    }
@@ -0,0 +1,125 @@
+"""
+Benchmark suite of the controller, the bank and the hardware drivers
+
+Writes machine-readable results, so the results of two commits can be compared.
+
+```shell
+export PYTHONPATH=`pwd`
+python3 benchmarks/run.py --out bench_new.json
+python3 benchmarks/run.py --out bench_new.json --compare bench_old.json
+```
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from app.utils.logger import logger
+from benchmarks import bench_macro, bench_memory, bench_micro
+
+SUITES = ("micro", "macro", "memory")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run(suites=SUITES, number: int = 10000, cards: int = 10 ** 6, sessions: int = 1000, log: bool = False) -> dict:
+    """
+    Run the benchmark suites
+
+    :param number: calls per benchmark
+    :param cards: number of cards in the large TestBankAdopter dataset
+    :param sessions: number of open sessions for memory benchmark
+    :param log: write controller.log while running
+    """
+    results = {}
+    was_disabled = logger.disabled
+    logger.disabled = not log
+    try:
+        if "micro" in suites:
+            results.update(bench_micro.run(number, cards))
+        if "macro" in suites:
+            results.update(bench_macro.run(number))
+        if "memory" in suites:
+            results.update(bench_memory.run(sessions))
+    finally:
+        logger.disabled = was_disabled
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "number": number,
+            "cards": cards,
+            "sessions": sessions,
+            "log": log,
+        },
+        "results": results,
+    }
+
+
+def compare(base: dict, new: dict, threshold: float) -> List[str]:
+    """
+    Find regressions of mean latency and memory per session
+
+    :param threshold: allowed ratio of slowdown, e.g. 0.1 = 10%
+    :return: list of messages (empty if no regression)
+    """
+    regressions = []
+    for name, result in new["results"].items():
+        old = base["results"].get(name)
+        if old is None:
+            continue
+        for key in ("mean_us", "bytes_per_session"):
+            if key in result and key in old and old[key] > 0:
+                ratio = result[key] / old[key] - 1
+                if ratio > threshold:
+                    regressions.append(f"{name}.{key}: {old[key]:.2f} -> {result[key]:.2f} (+{ratio:.1%})")
+    return regressions
+
+
+def summary(report: dict) -> str:
+    lines = []
+    for name, result in report["results"].items():
+        values = " ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items())
+        lines.append(f"{name:<55}{values}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark suite of ATM controller")
+    parser.add_argument("--suite", action="append", choices=SUITES, help="suites to run (default: all)")
+    parser.add_argument("--number", type=int, default=10000, help="calls per benchmark")
+    parser.add_argument("--cards", type=int, default=10 ** 6, help="cards in the large dataset")
+    parser.add_argument("--sessions", type=int, default=1000, help="open sessions for memory benchmark")
+    parser.add_argument("--log", action="store_true", help="write controller.log while running")
+    parser.add_argument("--out", default="bench.json", help="JSON file for results")
+    parser.add_argument("--compare", help="JSON file of the base commit to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown ratio")
+    args = parser.parse_args(argv)
+
+    report = run(args.suite or SUITES, args.number, args.cards, args.sessions, args.log)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(summary(report))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for message in regressions:
+            print("[REGRESSION]", message)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1 +1 @@
-pdoc ./app/main.py ./app/atm/controller.py ./app/bank/*.py ./app/atm/hardware/*.py ./app/errors/exceptions.py ./tests/test_adopter.py ./tests/test_bank.py ./tests/test_cardreader.py ./tests/test_cashbin.py ./tests/test_controller.py ./tests/test_printer.py 
+pdoc ./app/main.py ./app/atm/controller.py ./app/atm/async_controller.py ./app/bank/*.py ./app/atm/hardware/*.py ./app/errors/exceptions.py ./tests/test_adopter.py ./tests/test_async_controller.py ./tests/test_bank.py ./tests/test_cardreader.py ./tests/test_cashbin.py ./tests/test_controller.py ./tests/test_printer.py 
@@ -1,16 +1,22 @@
 import pytest
 
 from app.atm.controller import ATMController
-from app.atm.hardware.cardreader import TestCardReader
-from app.atm.hardware.cashbin import TestCashBin
-from app.atm.hardware.printer import TestPrinter
-from app.bank.adopter import TestBankAdopter
-from app.bank.bank import Bank
+from app.atm.async_controller import AsyncATMController
+from app.atm.hardware.cardreader import TestCardReader, AsyncTestCardReader
+from app.atm.hardware.cashbin import TestCashBin, AsyncTestCashBin
+from app.atm.hardware.printer import TestPrinter, AsyncTestPrinter
+from app.bank.adopter import TestBankAdopter, AsyncTestBankAdopter
+from app.bank.bank import Bank, AsyncBank
 
 # To remove PyTest Warnings (about TestClass.__init__())
 TestCardReader.__test__ = False
 TestCashBin.__test__ = False
 TestPrinter.__test__ = False
+TestBankAdopter.__test__ = False
+AsyncTestCardReader.__test__ = False
+AsyncTestCashBin.__test__ = False
+AsyncTestPrinter.__test__ = False
+AsyncTestBankAdopter.__test__ = False
 
 
 @pytest.fixture()
@@ -53,4 +59,17 @@ def controller():
     cashbin = TestCashBin()
     printer = TestPrinter()
     ctrl = ATMController(bank=bank, reader=reader, cashbin=cashbin, printer=printer)
+    yield ctrl
+    ctrl.close()
+
+
+@pytest.fixture()
+def async_controller():
+    adopter = AsyncTestBankAdopter()
+    bank = AsyncBank(adopter=adopter)
+
+    reader = AsyncTestCardReader("12345678")
+    cashbin = AsyncTestCashBin()
+    printer = AsyncTestPrinter()
+    ctrl = AsyncATMController(bank=bank, reader=reader, cashbin=cashbin, printer=printer)
     return ctrl
@@ -1,3 +1,8 @@
+import pytest
+
+from app.bank.adopter import BankAdopterInterface, TestBankAdopter
+from app.bank.ledger import LedgerBankAdopter
+
 test_data = {
     "12345678": {
         "pin": "1234",
@@ -58,3 +63,98 @@ def test_adopter_update_account_ok(adopter):
     res, account = adopter.tx_update_account(token, 0, 10)
     assert res == True
     assert account["balance"] == 110
+
+
+def make_batch_adopter(adopter_class=TestBankAdopter):
+    adopter = adopter_class()
+    adopter.set_bank_data({
+        "12345678": {"pin": "1234", "accounts": [
+            {"acc_num": "11112222", "balance": 100, "available": True},
+            {"acc_num": "33334444", "balance": 0, "available": True},
+        ]},
+        "13572468": {"pin": "8888", "accounts": [
+            {"acc_num": "11113333", "balance": 10, "available": True},
+            {"acc_num": "22224444", "balance": 50, "available": True},
+        ]},
+    })
+    return adopter
+
+
+class LoopBankAdopter(TestBankAdopter):
+    """Uses the default batch implementation of BankAdopterInterface"""
+    is_registered_batch = BankAdopterInterface.is_registered_batch
+    tx_update_accounts_batch = BankAdopterInterface.tx_update_accounts_batch
+
+
+@pytest.mark.parametrize("adopter_class", [TestBankAdopter, LoopBankAdopter, LedgerBankAdopter])
+def test_adopter_is_registered_batch_ok(adopter_class):
+    """Check many cards at once"""
+    adopter = make_batch_adopter(adopter_class)
+    assert adopter.is_registered_batch(["12345678", "11112222", "13572468"]) == [True, False, True]
+
+
+@pytest.mark.parametrize("adopter_class", [TestBankAdopter, LoopBankAdopter, LedgerBankAdopter])
+def test_adopter_tx_update_accounts_batch_ok_atomic(adopter_class):
+    """All items are applied in order"""
+    adopter = make_batch_adopter(adopter_class)
+    committed, results = adopter.tx_update_accounts_batch([
+        ("87654321", 0, 10),
+        ("86427531", 1, -20),
+        ("87654321", 1, 5),
+    ])
+    assert committed == True
+    assert [res for res, _ in results] == [True, True, True]
+    assert results[1][1]["balance"] == 30
+    _, accounts = adopter.account_list("87654321")
+    assert [acc["balance"] for acc in accounts] == [110, 5]
+
+
+@pytest.mark.parametrize("adopter_class", [TestBankAdopter, LoopBankAdopter, LedgerBankAdopter])
+def test_adopter_tx_update_accounts_batch_fail_atomic(adopter_class):
+    """If one item is invalid, nothing is applied"""
+    adopter = make_batch_adopter(adopter_class)
+    committed, results = adopter.tx_update_accounts_batch([
+        ("87654321", 0, 10),
+        ("87654321", 2, 10),    # invalid index
+        ("00000000", 0, 10),    # unregistered card
+        ("86427531", 0, 10),
+    ])
+    assert committed == False
+    assert results == [[True, None], [False, None], [False, None], [True, None]]
+    assert adopter.account_list("87654321")[1][0]["balance"] == 100
+    assert adopter.account_list("86427531")[1][0]["balance"] == 10
+
+
+@pytest.mark.parametrize("adopter_class", [TestBankAdopter, LoopBankAdopter, LedgerBankAdopter])
+def test_adopter_tx_update_accounts_batch_ok_partial(adopter_class):
+    """Without atomic, valid items are applied and invalid items are skipped"""
+    adopter = make_batch_adopter(adopter_class)
+    committed, results = adopter.tx_update_accounts_batch([
+        ("87654321", 0, 10),
+        ("87654321", 2, 10),
+        ("86427531", 0, 10),
+    ], atomic=False)
+    assert committed == True
+    assert [res for res, _ in results] == [True, False, True]
+    assert results[1][1] is None
+    assert adopter.account_list("87654321")[1][0]["balance"] == 110
+    assert adopter.account_list("86427531")[1][0]["balance"] == 20
+
+
+@pytest.mark.parametrize("adopter_class", [TestBankAdopter, LedgerBankAdopter])
+def test_adopter_card_numbers_ok(adopter_class):
+    """All registered card numbers can be listed for a local filter"""
+    adopter = make_batch_adopter(adopter_class)
+    assert sorted(adopter.card_numbers()) == ["12345678", "13572468"]
+
+
+def test_adopter_fail_card_numbers_and_load_not_implemented():
+    """An adopter without card_numbers() and load() says so instead of listing or loading nothing"""
+    class MinimalBankAdopter(BankAdopterInterface):
+        pass
+
+    adopter = MinimalBankAdopter()
+    with pytest.raises(NotImplementedError, match="MinimalBankAdopter"):
+        adopter.card_numbers()
+    with pytest.raises(NotImplementedError, match="MinimalBankAdopter"):
+        adopter.load([("12345678", test_data["12345678"])])
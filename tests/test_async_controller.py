@@ -0,0 +1,220 @@
+import asyncio
+import time
+
+import pytest
+
+from app.atm.controller import ATMStatus
+from app.atm.async_controller import AsyncATMController
+from app.atm.hardware.cardreader import AsyncTestCardReader
+from app.atm.hardware.cashbin import AsyncTestCashBin, CassetteCashBin
+from app.atm.hardware.printer import AsyncTestPrinter
+from app.bank.adopter import AsyncTestBankAdopter
+from app.bank.bank import AsyncBank
+from app.errors.exceptions import *
+
+test_data = {
+    "12345678": {
+        "pin": "1234",
+        "accounts": [
+            {"acc_num": "11112222", "balance": 100, "available": True},
+            {"acc_num": "33334444", "balance": 0,   "available": True},
+        ]
+    },
+    "13572468": {
+        "pin": "8888",
+        "accounts": [
+            {"acc_num": "11113333", "balance": 10, "available": True},
+            {"acc_num": "22224444", "balance": 50, "available": True},
+        ]
+    },
+}
+
+
+async def select_first_account(ctrl, card_number: str, pin_number: str):
+    await ctrl.insert_card(card_number)
+    await ctrl.read_card_number()
+    await ctrl.validate_pin_number(pin_number)
+    await ctrl.get_accounts()
+    return await ctrl.select_account(0)
+
+
+def test_async_controller_read_card_fail_unregistered_card_number(async_controller):
+    """If card is unregistered, ATM will eject the card and reset itself."""
+    async_controller.bank.adopter.set_bank_data(test_data)
+
+    async def flow():
+        await async_controller.insert_card("00000001")
+        assert async_controller.status == ATMStatus.ATM_CARD_IN
+        with pytest.raises(UnregisteredCardNumberException):
+            await async_controller.read_card_number()
+
+    asyncio.run(flow())
+    assert async_controller.status == ATMStatus.ATM_NO_CARD
+
+
+def test_async_controller_validate_pin_number_fail_incorrect_entered_pin(async_controller):
+    """If PIN is not correct, ATM need to eject the card and reset itself"""
+    async_controller.bank.adopter.set_bank_data(test_data)
+
+    async def flow():
+        await async_controller.insert_card("12345678")
+        await async_controller.read_card_number()
+        with pytest.raises(IncorrectPinNumberException):
+            await async_controller.validate_pin_number("0000")
+
+    asyncio.run(flow())
+    assert async_controller.status == ATMStatus.ATM_NO_CARD
+
+
+def test_async_controller_get_balance_ok(async_controller):
+    """Check the balance by ATM (compare ATM with Bank)"""
+    async_controller.bank.adopter.set_bank_data(test_data)
+
+    async def flow():
+        await select_first_account(async_controller, "12345678", "1234")
+        return await async_controller.get_balance()
+
+    balance = asyncio.run(flow())
+    assert balance == 100
+    assert async_controller.status == ATMStatus.ATM_NO_CARD
+    assert async_controller.card_reader.status == "NO_CARD"
+
+
+def test_async_controller_deposit_ok(async_controller):
+    """Check the balance and the cash bin after deposit"""
+    async_controller.bank.adopter.set_bank_data(test_data)
+    before_cash = async_controller.cash_bin.available_money
+
+    async def flow():
+        account = await select_first_account(async_controller, "12345678", "1234")
+        before_deposit = account["balance"]
+        await async_controller.open_door()
+        await async_controller.cash_bin.set_counting_money(15)
+        await async_controller.close_door()
+        amount = await async_controller.count_money()
+        account = await async_controller.deposit(amount)
+        return before_deposit, account["balance"]
+
+    before_deposit, after_deposit = asyncio.run(flow())
+    assert (before_deposit + 15) == after_deposit
+    assert async_controller.cash_bin.available_money == before_cash + 15
+    assert async_controller.status == ATMStatus.ATM_NO_CARD
+
+
+def test_async_controller_withdraw_ok(async_controller):
+    """Check the balance and the cash bin after withdraw"""
+    async_controller.bank.adopter.set_bank_data(test_data)
+    before_cash = async_controller.cash_bin.available_money
+
+    async def flow():
+        account = await select_first_account(async_controller, "12345678", "1234")
+        before_withdraw = account["balance"]
+        account = await async_controller.withdraw(15)
+        return before_withdraw, account["balance"]
+
+    before_withdraw, after_withdraw = asyncio.run(flow())
+    assert before_withdraw == (after_withdraw + 15)
+    assert async_controller.cash_bin.available_money == before_cash - 15
+    assert async_controller.cash_bin.state == "OPENED"
+    assert async_controller.status == ATMStatus.ATM_NO_CARD
+
+
+def test_async_controller_withdraw_fail_not_enough_money_in_cashbin(async_controller):
+    """Check (the value of amount) > (available in cash bin) to withdraw"""
+    async_controller.bank.adopter.set_bank_data(test_data)
+    async_controller.cash_bin.available_money = 50
+
+    async def flow():
+        await select_first_account(async_controller, "12345678", "1234")
+        with pytest.raises(NotEnoughMoneyInCashBinException):
+            await async_controller.withdraw(100)
+
+    asyncio.run(flow())
+    assert async_controller.status == ATMStatus.ATM_NO_CARD
+
+
+def test_async_controller_withdraw_fail_undispensable_amount(async_controller):
+    """The bank is not charged if the notes in the cash bin cannot make the amount"""
+    async_controller.bank.adopter.set_bank_data(test_data)
+    async_controller.cash_bin = AsyncTestCashBin(cash_bin=CassetteCashBin({50: 10, 20: 10}))
+
+    async def flow():
+        await select_first_account(async_controller, "12345678", "1234")
+        with pytest.raises(UndispensableAmountException):
+            await async_controller.withdraw(30)
+
+    asyncio.run(flow())
+    assert async_controller.bank.adopter.adopter.bank_data["12345678"]["accounts"][0]["balance"] == 100
+    assert async_controller.cash_bin.available_money == 700
+    assert async_controller.status == ATMStatus.ATM_NO_CARD
+
+
+def test_async_controller_withdraw_ok_devices_overlap():
+    """Dispensing, printing and ejecting run at the same time after the bank confirms"""
+    latency = 0.05
+    adopter = AsyncTestBankAdopter()
+    adopter.set_bank_data(test_data)
+    ctrl = AsyncATMController(bank=AsyncBank(adopter=adopter),
+                              reader=AsyncTestCardReader(latency=latency),
+                              cashbin=AsyncTestCashBin(latency=latency),
+                              printer=AsyncTestPrinter(latency=latency))
+
+    async def flow():
+        await select_first_account(ctrl, "12345678", "1234")
+        start = time.perf_counter()
+        await ctrl.withdraw(10)
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(flow())
+    # pop_money + open_door (2 x latency) is the slowest, not the sum (4 x latency)
+    assert elapsed < 3 * latency
+
+
+def test_async_controller_ok_many_terminals_in_one_loop():
+    """One event loop drives many terminals sharing one bank adopter"""
+    latency = 0.05
+    adopter = AsyncTestBankAdopter(latency=latency)
+    adopter.set_bank_data(test_data)
+    controllers = [
+        AsyncATMController(bank=AsyncBank(adopter=adopter),
+                           reader=AsyncTestCardReader(),
+                           cashbin=AsyncTestCashBin(),
+                           printer=AsyncTestPrinter())
+        for _ in range(20)
+    ]
+
+    async def flow(ctrl):
+        await select_first_account(ctrl, "13572468", "8888")
+        return await ctrl.get_balance()
+
+    async def run_all():
+        return await asyncio.gather(*(flow(ctrl) for ctrl in controllers))
+
+    start = time.perf_counter()
+    balances = asyncio.run(run_all())
+    elapsed = time.perf_counter() - start
+    assert balances == [10] * len(controllers)
+    # 3 bank calls per terminal, but terminals are waiting for the bank concurrently
+    assert elapsed < 10 * latency
+
+
+def test_async_controller_withdraw_fail_devices_errors_aggregated():
+    """Failures of devices are raised together after all devices finished and ATM was reset"""
+    adopter = AsyncTestBankAdopter()
+    adopter.set_bank_data(test_data)
+    ctrl = AsyncATMController(bank=AsyncBank(adopter=adopter),
+                              reader=AsyncTestCardReader(),
+                              cashbin=AsyncTestCashBin(),
+                              printer=AsyncTestPrinter(paper=1))
+
+    async def flow():
+        await select_first_account(ctrl, "13572468", "8888")
+        with pytest.raises(DeviceActionsFailedException) as e:
+            await ctrl.withdraw(5)
+        return e.value.errors
+
+    errors = asyncio.run(flow())
+    assert [type(err) for err in errors] == [NotEnoughPaperInPrinterException]
+    assert ctrl.cash_bin.available_money == 995
+    assert ctrl.card_reader.status == "NO_CARD"
+    assert ctrl.status == ATMStatus.ATM_NO_CARD
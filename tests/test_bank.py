@@ -1,5 +1,12 @@
+import copy
+import threading
+import time
+
 import pytest
 
+from app.bank.adopter import TestBankAdopter
+from app.bank.bank import Bank
+from app.bank.cache import AccountCache
 from app.errors.exceptions import InvalidIndexException
 
 test_data = {
@@ -98,3 +105,205 @@ def test_bank_reset_ok(bank):
     assert bank.accounts == []
     assert bank.selected < 0
 
+
+class CountingBankAdopter(TestBankAdopter):
+    def __init__(self):
+        super().__init__()
+        self.account_list_calls = 0
+
+    def account_list(self, token: str):
+        self.account_list_calls += 1
+        return super().account_list(token)
+
+
+def test_bank_account_list_ok_cached_after_reset():
+    """Repeat visits skip account_list round trip and see own transactions"""
+    adopter = CountingBankAdopter()
+    adopter.set_bank_data(copy.deepcopy(test_data))
+    bank = Bank(adopter=adopter, cache=AccountCache())
+
+    bank.validate(card_number="12345678", entered_pin="1234")
+    bank.account_list()
+    before = bank.select_account(0)["balance"]
+    bank.update_account(amount=-30)
+    bank.reset()
+
+    bank.validate(card_number="12345678", entered_pin="1234")
+    result, accounts = bank.account_list()
+    assert result == True
+    assert accounts[0]["balance"] == before - 30
+    assert adopter.account_list_calls == 1
+
+
+def test_bank_account_list_ok_cache_needs_valid_pin():
+    """Cached accounts are not shown without a token"""
+    adopter = CountingBankAdopter()
+    adopter.set_bank_data(copy.deepcopy(test_data))
+    bank = Bank(adopter=adopter, cache=AccountCache())
+    bank.validate(card_number="12345678", entered_pin="1234")
+    bank.account_list()
+    bank.reset()
+
+    assert bank.validate(card_number="12345678", entered_pin="0000") == False
+    result, accounts = bank.account_list()
+    assert result == False
+    assert accounts == []
+
+
+def test_bank_open_session_ok_isolated(bank):
+    """Sessions of the same Bank don't share customer information"""
+    bank.adopter.set_bank_data(test_data)
+    first = bank.open_session()
+    second = bank.open_session()
+
+    first.validate(card_number="12345678", entered_pin="1234")
+    second.validate(card_number="13572468", entered_pin="8888")
+    first.account_list()
+    second.account_list()
+    first.select_account(0)
+    second.select_account(1)
+
+    assert first.token == "87654321" and second.token == "86427531"
+    assert first.get_account()["acc_num"] == "11112222"
+    assert second.get_account()["acc_num"] == "22224444"
+    second.reset()
+    assert first.accounts != [] and second.accounts == []
+    assert bank.card_number == ""
+
+
+def test_bank_open_session_ok_concurrent_updates():
+    """Balance updates from many sessions in many threads are not lost"""
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(test_data)
+    bank = Bank(adopter=adopter)
+    before = adopter.bank_data["12345678"].accounts[0].balance
+
+    def customer():
+        session = bank.open_session()
+        session.validate(card_number="12345678", entered_pin="1234")
+        session.account_list()
+        session.select_account(0)
+        for _ in range(1000):
+            session.update_account(amount=1)
+
+    threads = [threading.Thread(target=customer) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert adopter.bank_data["12345678"].accounts[0].balance == before + 8000
+
+
+class BlockingBankAdopter(CountingBankAdopter):
+    """account_list() waits until released, like a slow Bank API"""
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def account_list(self, token: str):
+        self.started.set()
+        self.release.wait(5)
+        return super().account_list(token)
+
+
+def test_bank_account_list_ok_prefetched():
+    """account_list() starts right after a valid PIN, and the result is used later"""
+    adopter = BlockingBankAdopter()
+    adopter.set_bank_data(test_data)
+    bank = Bank(adopter=adopter, prefetch=True)
+    session = bank.open_session()
+
+    assert session.validate(card_number="12345678", entered_pin="1234") == True
+    assert adopter.started.wait(5)
+    adopter.release.set()
+    result, accounts = session.account_list()
+    assert result == True
+    assert accounts == test_data["12345678"]["accounts"]
+    assert adopter.account_list_calls == 1
+    bank.close()
+
+
+def test_bank_account_list_ok_no_prefetch_for_wrong_pin():
+    """Nothing is prefetched without a token"""
+    adopter = CountingBankAdopter()
+    adopter.set_bank_data(test_data)
+    bank = Bank(adopter=adopter, prefetch=True)
+    bank.validate(card_number="12345678", entered_pin="0000")
+    bank.close()
+    assert adopter.account_list_calls == 0
+
+
+def test_bank_reset_ok_prefetch_cancelled():
+    """A prefetch which didn't start yet is cancelled by reset()"""
+    adopter = BlockingBankAdopter()
+    adopter.set_bank_data(test_data)
+    bank = Bank(adopter=adopter, prefetch=True, prefetch_workers=1)
+    first = bank.open_session()
+    second = bank.open_session()
+
+    first.validate(card_number="12345678", entered_pin="1234")
+    assert adopter.started.wait(5)      # the only worker is busy with the first session
+    second.validate(card_number="13572468", entered_pin="8888")
+    second.reset()
+    adopter.release.set()
+    first.account_list()
+    bank.close()
+    assert adopter.account_list_calls == 1
+
+
+def test_bank_account_list_ok_prefetch_with_cache():
+    """Prefetched accounts are stored in the cache"""
+    adopter = CountingBankAdopter()
+    adopter.set_bank_data(test_data)
+    bank = Bank(adopter=adopter, cache=AccountCache(), prefetch=True)
+    bank.validate(card_number="12345678", entered_pin="1234")
+    bank.account_list()
+    bank.reset()
+    bank.validate(card_number="12345678", entered_pin="1234")
+    result, accounts = bank.account_list()
+    bank.close()
+    assert result == True
+    assert accounts == test_data["12345678"]["accounts"]
+    assert len(bank.cache) == 1
+
+
+class SlowUpdateBankAdopter(TestBankAdopter):
+    """tx_update_account() takes a while and records how many calls ran at once"""
+    def __init__(self, thread_safe: bool):
+        super().__init__()
+        self.thread_safe = thread_safe
+        self.active = 0
+        self.max_active = 0
+        self._count_lock = threading.Lock()
+
+    def tx_update_account(self, token: str, acc_idx: int, amount: int):
+        with self._count_lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self._count_lock:
+            self.active -= 1
+        return super().tx_update_account(token, acc_idx, amount)
+
+
+@pytest.mark.parametrize("thread_safe", [True, False])
+def test_bank_update_account_ok_lock_only_if_not_thread_safe(thread_safe):
+    """Updates of a thread-safe adopter run concurrently, others are serialized by Bank.lock"""
+    adopter = SlowUpdateBankAdopter(thread_safe)
+    adopter.set_bank_data(test_data)
+    bank = Bank(adopter=adopter)
+    sessions = []
+    for _ in range(4):
+        session = bank.open_session()
+        session.validate(card_number="12345678", entered_pin="1234")
+        session.account_list()
+        session.select_account(0)
+        sessions.append(session)
+    threads = [threading.Thread(target=session.update_account, args=(1,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (adopter.max_active > 1) == thread_safe
+    assert adopter.bank_data["12345678"].accounts[0].balance == test_data["12345678"]["accounts"][0]["balance"] + 4
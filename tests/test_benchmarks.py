@@ -0,0 +1,23 @@
+from benchmarks.run import compare, run
+
+
+def test_benchmarks_run_ok_all_suites():
+    """Every benchmark runs and reports its numbers"""
+    report = run(number=20, cards=100, sessions=10)
+    results = report["results"]
+    assert report["meta"]["cards"] == 100
+    assert results["ATMController.withdraw"]["calls"] == 20
+    assert results["TestBankAdopter[100].tx_update_account"]["mean_us"] > 0
+    assert results["net_pooled.flow_withdraw"]["calls"] == 2
+    assert results["memory.open_session"]["bytes_per_session"] > 0
+
+
+def test_benchmarks_compare_ok_regressions():
+    """Slowdowns over the threshold are reported"""
+    base = {"results": {"a": {"mean_us": 10.0}, "b": {"mean_us": 10.0}, "c": {"bytes_per_session": 100.0}}}
+    new = {"results": {"a": {"mean_us": 10.5}, "b": {"mean_us": 12.0}, "c": {"bytes_per_session": 200.0},
+                       "d": {"mean_us": 1.0}}}
+    regressions = compare(base, new, threshold=0.1)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("b.mean_us")
+    assert regressions[1].startswith("c.bytes_per_session")
@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+
+from app.atm.controller import ATMController, ATMStatus
+from app.atm.hardware.cardreader import TestCardReader
+from app.atm.hardware.cashbin import TestCashBin
+from app.atm.hardware.printer import TestPrinter
+from app.bank.adopter import TestBankAdopter
+from app.bank.bank import Bank
+from app.bank.bloom import BloomFilter, RefreshingCardFilter
+from app.bank.ledger import LedgerBankAdopter
+from app.errors.exceptions import UnregisteredCardNumberException
+from app.sim.fleet import make_bank_data
+
+
+class CountingBankAdopter(TestBankAdopter):
+    def __init__(self):
+        super().__init__()
+        self.is_registered_calls = 0
+
+    def is_registered(self, card_number: str) -> bool:
+        self.is_registered_calls += 1
+        return super().is_registered(card_number)
+
+
+def test_bloom_ok_no_false_negative():
+    """Every added card is in the filter"""
+    cards = [str(n).zfill(8) for n in range(0, 10 ** 8, 10 ** 8 // 5000)]
+    bloom = BloomFilter.from_cards(cards, capacity=len(cards), fp_rate=0.01)
+    assert all(card in bloom for card in cards)
+    assert bloom.count == len(cards)
+
+
+def test_bloom_ok_false_positive_rate():
+    """False positive rate is close to the configured one"""
+    bloom = BloomFilter.from_cards((str(n).zfill(8) for n in range(10000)), capacity=10000, fp_rate=0.01)
+    false_positives = sum(str(n).zfill(8) in bloom for n in range(50000000, 50020000))
+    assert false_positives / 20000 < 0.02
+    assert 0.005 < bloom.fp_rate < 0.015
+
+
+def test_bloom_ok_max_bytes():
+    """Memory can be limited, with a higher false positive rate"""
+    small = BloomFilter(capacity=10000, fp_rate=0.001, max_bytes=4096)
+    assert small.nbytes == 4096
+    assert small.fp_rate > 0.001
+
+
+def test_bloom_fail_invalid_params():
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=0)
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=10, fp_rate=1.0)
+
+
+def test_card_filter_ok_refresh():
+    """Filter sees new cards after refresh or add, from any adopter"""
+    adopter = LedgerBankAdopter()
+    adopter.set_bank_data(make_bank_data(100, seed=1))
+    card_filter = RefreshingCardFilter(adopter.card_numbers, capacity=1000)
+    assert all(card in card_filter for card in adopter.card_numbers())
+
+    data = make_bank_data(100, seed=2)
+    adopter.set_bank_data(data)
+    new_card = next(card for card in data if card not in card_filter)
+    card_filter.refresh()
+    assert new_card in card_filter
+    card_filter.add("99999999")
+    assert "99999999" in card_filter
+
+
+def test_card_filter_ok_add_during_refresh():
+    """A card added while the filter is rebuilt from an older list of cards is kept"""
+    cards = ["%08d" % i for i in range(100)]
+    card_filter = None
+
+    def source():
+        for i, card in enumerate(cards):
+            if i == 50 and card_filter is not None:
+                card_filter.add("99999999")     # registered after the source was read
+            yield card
+
+    card_filter = RefreshingCardFilter(source, capacity=1000, fp_rate=0.0001)
+    assert "99999999" not in card_filter
+    card_filter.refresh()
+    assert "99999999" in card_filter
+
+
+def test_card_filter_ok_refresh_retried_after_failure():
+    """A failing source is logged and retried, the refresh thread keeps running"""
+    calls = []
+    refreshed = threading.Event()
+
+    def source():
+        calls.append(1)
+        if len(calls) == 3:
+            refreshed.set()
+        if len(calls) == 2:
+            raise ConnectionError("bank is down")
+        return ["12345678"]
+
+    card_filter = RefreshingCardFilter(source, capacity=100, interval=0.01, retry_interval=0.01)
+    card_filter.start()
+    assert refreshed.wait(timeout=2)
+    card_filter.stop()
+    assert "12345678" in card_filter
+
+
+def test_controller_read_card_ok_filtered_without_bank():
+    """Unregistered cards are rejected by the filter without calling the bank"""
+    adopter = CountingBankAdopter()
+    adopter.set_bank_data(make_bank_data(1000, seed=0))
+    card_filter = RefreshingCardFilter(adopter.card_numbers, capacity=1000, fp_rate=0.0001)
+    ctrl = ATMController(bank=Bank(adopter=adopter), reader=TestCardReader(), cashbin=TestCashBin(),
+                         printer=TestPrinter(), card_filter=card_filter)
+
+    unregistered = next(str(n).zfill(8) for n in range(10 ** 7, 10 ** 8)
+                        if str(n).zfill(8) not in adopter.bank_data and str(n).zfill(8) not in card_filter.bloom)
+    ctrl.insert_card(unregistered)
+    with pytest.raises(UnregisteredCardNumberException):
+        ctrl.read_card_number()
+    assert adopter.is_registered_calls == 0
+    assert card_filter.rejected == 1
+    assert ctrl.status == ATMStatus.ATM_NO_CARD
+
+    registered = next(iter(adopter.bank_data))
+    ctrl.insert_card(registered)
+    assert ctrl.read_card_number() == registered
+    assert adopter.is_registered_calls == 1
@@ -0,0 +1,91 @@
+from app.bank.cache import AccountCache
+
+accounts = [
+    {"acc_num": "11112222", "balance": 100, "available": True},
+    {"acc_num": "33334444", "balance": 0,   "available": True},
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_get_ok_snapshot_is_copied():
+    """Changing the stored or returned accounts doesn't change the snapshot"""
+    cache = AccountCache()
+    data = [dict(acc) for acc in accounts]
+    cache.put("12345678", data)
+    data[0]["balance"] = 999
+    copied = cache.get("12345678").copy_accounts()
+    copied[1]["balance"] = 999
+    assert cache.get("12345678").accounts == accounts
+
+
+def test_cache_get_fail_expired():
+    """Snapshots expire after ttl"""
+    clock = FakeClock()
+    cache = AccountCache(ttl=10, clock=clock)
+    cache.put("12345678", accounts)
+    clock.now = 5
+    assert cache.get("12345678") is not None
+    clock.now = 11
+    assert cache.get("12345678") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_put_ok_lru_eviction():
+    """The least recently used card is evicted over capacity"""
+    cache = AccountCache(capacity=2)
+    cache.put("00000001", accounts)
+    cache.put("00000002", accounts)
+    cache.get("00000001")
+    cache.put("00000003", accounts)
+    assert len(cache) == 2
+    assert cache.get("00000002") is None
+    assert cache.get("00000001") is not None
+
+
+def test_cache_update_account_ok_version():
+    """Results of transactions are written into the snapshot with a new version"""
+    cache = AccountCache()
+    cache.put("12345678", accounts)
+    assert cache.version("12345678") == 1
+    assert cache.update_account("12345678", 0, {"acc_num": "11112222", "balance": 90, "available": True})
+    assert cache.version("12345678") == 2
+    assert cache.get("12345678").accounts[0]["balance"] == 90
+    assert not cache.update_account("00000000", 0, accounts[0])
+
+
+def test_cache_put_fail_stale_result():
+    """A fetch started before our own transaction cannot overwrite its result"""
+    cache = AccountCache()
+    cache.put("12345678", accounts)
+    since = cache.version("12345678")
+    cache.update_account("12345678", 0, {"acc_num": "11112222", "balance": 90, "available": True})
+    assert cache.put("12345678", accounts, since=since) == False
+    assert cache.get("12345678").accounts[0]["balance"] == 90
+
+
+def test_cache_put_fail_stale_result_not_cached():
+    """fetch -> update -> put: the update of a card which is not cached still makes the fetch stale"""
+    cache = AccountCache()
+    since = cache.version("12345678")
+    assert not cache.update_account("12345678", 0, {"acc_num": "11112222", "balance": 90, "available": True})
+    assert cache.put("12345678", accounts, since=since) == False
+    assert cache.get("12345678") is None
+
+
+def test_cache_put_fail_stale_result_after_eviction():
+    """A version forgotten by the eviction is covered by the floor"""
+    cache = AccountCache(capacity=1, max_versions=2)
+    cache.put("12345678", accounts)
+    since = cache.version("12345678")
+    cache.update_account("12345678", 0, {"acc_num": "11112222", "balance": 90, "available": True})
+    for card_number in ("00000001", "00000002", "00000003"):
+        assert cache.put(card_number, accounts)
+    assert cache.put("12345678", accounts, since=since) == False
+    assert cache.put("12345678", accounts, since=cache.version("12345678")) == True
@@ -1,4 +1,11 @@
-from app.atm.hardware.cardreader import TestCardReader, CardReaderStatus
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from app.atm.hardware.cardreader import TestCardReader, CardReaderStatus, PipeCardReader, CardReaderHub
 from app.common.consts import CARD_NUMBER_DIGITS
 
 
@@ -30,3 +37,91 @@ def test_cardreader_read_ok_no_check_format(reader):
     assert reader.status == CardReaderStatus.CARD_IN
     assert len(fake_card) != CARD_NUMBER_DIGITS
 
+
+
+@pytest.fixture()
+def pipe_reader():
+    reader, device = PipeCardReader.open_pipe()
+    yield reader, device
+    for fd in (reader.fd, device):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="selectors on pipes need POSIX")
+def test_pipe_cardreader_ok_events(pipe_reader):
+    """Card insertion and removal are pushed as events"""
+    reader, device = pipe_reader
+    events = []
+    reader.on_inserted = lambda card_number: events.append(("IN", card_number))
+    reader.on_removed = lambda: events.append(("OUT",))
+
+    assert reader.handle_readable() == 0      # nothing to read, doesn't block
+    os.write(device, b"IN 12345678\nOU")
+    assert reader.handle_readable() == 1
+    assert reader.read() == "12345678"
+    assert reader.status == CardReaderStatus.CARD_IN
+    os.write(device, b"T\n")
+    assert reader.handle_readable() == 1
+    assert events == [("IN", "12345678"), ("OUT",)]
+    assert reader.status == CardReaderStatus.NO_CARD
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="selectors on pipes need POSIX")
+def test_cardreader_hub_ok_failing_callback():
+    """A callback which raises does not stop the hub thread or the events of other readers"""
+    hub = CardReaderHub()
+    (bad, bad_device), (good, good_device) = PipeCardReader.open_pipe(), PipeCardReader.open_pipe()
+    inserted = []
+    received = threading.Event()
+
+    def fail(card_number):
+        raise RuntimeError("ATM needs maintenance")
+
+    def on_good(card_number):
+        inserted.append(card_number)
+        if len(inserted) == 2:
+            received.set()
+
+    hub.add(bad, on_inserted=fail)
+    hub.add(good, on_inserted=on_good)
+    hub.start()
+    os.write(bad_device, b"IN 11111111\nIN 22222222\n")
+    os.write(good_device, b"IN 33333333\n")
+    time.sleep(0.05)
+    os.write(good_device, b"IN 44444444\n")
+    assert received.wait(timeout=2)
+    assert inserted == ["33333333", "44444444"]
+    assert bad.read() == "22222222"     # the lines after the failing callback were handled too
+    hub.stop()
+    for reader, device in ((bad, bad_device), (good, good_device)):
+        reader.close()
+        os.close(device)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="selectors on pipes need POSIX")
+def test_cardreader_hub_ok_many_readers():
+    """One hub watches many readers, and drops a reader when the device is closed"""
+    hub = CardReaderHub()
+    pairs = [PipeCardReader.open_pipe() for _ in range(3)]
+    inserted = []
+    for reader, _ in pairs:
+        hub.add(reader, on_inserted=inserted.append)
+
+    assert hub.poll(timeout=0) == 0
+    os.write(pairs[0][1], b"IN 11111111\n")
+    os.write(pairs[2][1], b"IN 33333333\n")
+    assert hub.poll(timeout=1) == 2
+    assert sorted(inserted) == ["11111111", "33333333"]
+
+    os.close(pairs[2][1])
+    hub.poll(timeout=1)
+    assert len(hub) == 2
+    assert pairs[2][0].status == CardReaderStatus.NO_CARD
+    hub.stop()
+    for reader, device in pairs:
+        reader.close()
+        if device != pairs[2][1]:
+            os.close(device)
@@ -1,4 +1,4 @@
-from app.atm.hardware.cashbin import TestCashBin, CashBinState
+from app.atm.hardware.cashbin import TestCashBin, CassetteCashBin, CashBinState
 
 
 def test_cashbin_get_available_money_ok():
@@ -69,3 +69,41 @@ def test_cashbin_pop_money_fail_not_enough_money():
 
 
 
+
+
+def test_cassette_cashbin_pop_money_ok():
+    """The notes of the plan are taken from the cassettes"""
+    cashbin = CassetteCashBin({50: 10, 20: 10})
+    assert cashbin.get_available_money() == 700
+    assert cashbin.can_dispense(60)
+    assert cashbin.pop_money(amount=60)
+    assert cashbin.last_dispensed == {20: 3}
+    assert cashbin.cassettes == {50: 10, 20: 7}
+    assert cashbin.get_available_money() == 640
+
+
+def test_cassette_cashbin_pop_money_fail_undispensable():
+    """An amount the notes cannot make is refused, though there is enough money"""
+    cashbin = CassetteCashBin({50: 10, 20: 1})
+    assert not cashbin.can_dispense(30)
+    assert cashbin.pop_money(amount=30) == False
+    assert cashbin.get_available_money() == 520
+
+
+def test_cassette_cashbin_push_money_ok():
+    """Recognized notes go to the cassettes, other money to the deposit box"""
+    cashbin = CassetteCashBin({50: 1})
+    assert not cashbin.can_dispense(70)
+    cashbin.open()
+    cashbin.set_counting_money(amount=20, notes={20: 1})
+    cashbin.close()
+    cashbin.push_money()
+    assert cashbin.cassettes == {50: 1, 20: 1}
+    assert cashbin.can_dispense(70)
+
+    cashbin.open()
+    cashbin.set_counting_money(amount=30)
+    cashbin.close()
+    cashbin.push_money()
+    assert cashbin.deposited == 30
+    assert cashbin.get_available_money() == 70
@@ -1,6 +1,16 @@
+import os
+import sys
+import threading
+import time
+
 import pytest
 
-from app.atm.controller import ATMStatus
+from app.atm.controller import ATMController, ATMStatus
+from app.atm.hardware.cardreader import TestCardReader, PipeCardReader, CardReaderHub
+from app.atm.hardware.cashbin import TestCashBin, CassetteCashBin
+from app.atm.hardware.printer import TestPrinter
+from app.bank.adopter import TestBankAdopter
+from app.bank.bank import Bank
 from app.errors.exceptions import *
 
 test_data = {
@@ -170,6 +180,29 @@ def test_controller_get_balance_ok(controller):
             assert controller.status == ATMStatus.ATM_NO_CARD
 
 
+class DictBankAdopter(TestBankAdopter):
+    """Returns plain account dicts without acc_num, like a Bank API with less fields"""
+    def account_list(self, token: str):
+        res, accounts = super().account_list(token)
+        return [res, [{"balance": account.balance} for account in accounts]]
+
+
+def test_controller_get_balance_ok_account_dict():
+    """Account dicts which are not converted to Account (e.g. without acc_num) still have a balance"""
+    adopter = DictBankAdopter()
+    adopter.set_bank_data(test_data)
+    controller = ATMController(bank=Bank(adopter=adopter), reader=TestCardReader(), cashbin=TestCashBin(),
+                               printer=TestPrinter())
+    controller.insert_card("12345678")
+    controller.read_card_number()
+    controller.validate_pin_number("1234")
+    controller.get_accounts()
+    controller.select_account(0)
+    assert controller.get_balance() == 100
+    assert controller.printer.paper < 1000     # the receipt was printed
+    assert controller.status == ATMStatus.ATM_NO_CARD
+
+
 def test_controller_deposit_ok(controller):
     """Check the balance before/after deposit"""
     controller.bank.adopter.set_bank_data(test_data)
@@ -289,4 +322,300 @@ def test_controller_withdraw_fail_not_enough_money_in_cashbin(controller):
             account = controller.select_account(0)
             before_withdraw = account["balance"]
             with pytest.raises(NotEnoughMoneyInCashBinException):
-                account = controller.withdraw(amount)
\ No newline at end of file
+                account = controller.withdraw(amount)
+
+
+class SlowCardReader(TestCardReader):
+    def eject(self):
+        time.sleep(0.05)
+        super().eject()
+
+
+class SlowCashBin(TestCashBin):
+    def pop_money(self, amount: int) -> bool:
+        time.sleep(0.05)
+        return super().pop_money(amount)
+
+
+class SlowPrinter(TestPrinter):
+    def print_receipt(self, data: str):
+        time.sleep(0.05)
+        super().print_receipt(data)
+
+
+def make_parallel_controller(printer: TestPrinter) -> ATMController:
+    adopter = TestBankAdopter()
+    adopter.set_bank_data({"12345678": {"pin": "1234", "accounts": [
+        {"acc_num": "11112222", "balance": 100, "available": True}]}})
+    return ATMController(bank=Bank(adopter=adopter), reader=SlowCardReader(), cashbin=SlowCashBin(),
+                         printer=printer, parallel_devices=True)
+
+
+def select_first_account(ctrl: ATMController):
+    ctrl.insert_card("12345678")
+    ctrl.read_card_number()
+    ctrl.validate_pin_number("1234")
+    ctrl.get_accounts()
+    return ctrl.select_account(0)
+
+
+def test_controller_withdraw_ok_parallel_devices():
+    """Dispense, print and eject at the same time: as slow as the slowest device"""
+    ctrl = make_parallel_controller(SlowPrinter())
+    select_first_account(ctrl)
+
+    start = time.perf_counter()
+    account = ctrl.withdraw(30)
+    elapsed = time.perf_counter() - start
+    assert account["balance"] == 70
+    assert ctrl.cash_bin.available_money == 970
+    assert ctrl.cash_bin.state == "OPENED"
+    assert ctrl.card_reader.status == "NO_CARD"
+    assert ctrl.status == ATMStatus.ATM_NO_CARD
+    assert elapsed < 0.12
+    ctrl.close()
+
+
+def test_controller_deposit_ok_parallel_devices():
+    """Push money, print and eject at the same time"""
+    ctrl = make_parallel_controller(SlowPrinter())
+    select_first_account(ctrl)
+    ctrl.open_door()
+    ctrl.cash_bin.set_counting_money(20)
+    ctrl.close_door()
+
+    account = ctrl.deposit(ctrl.count_money())
+    assert account["balance"] == 120
+    assert ctrl.cash_bin.available_money == 1020
+    assert ctrl.status == ATMStatus.ATM_NO_CARD
+    ctrl.close()
+
+
+def test_controller_withdraw_fail_parallel_devices_errors_aggregated():
+    """Failures of devices are raised together after all devices finished and ATM was reset"""
+    ctrl = make_parallel_controller(SlowPrinter(paper=1))
+    select_first_account(ctrl)
+
+    with pytest.raises(DeviceActionsFailedException) as e:
+        ctrl.withdraw(30)
+    assert [type(err) for err in e.value.errors] == [NotEnoughPaperInPrinterException]
+    assert ctrl.cash_bin.available_money == 970
+    assert ctrl.card_reader.status == "NO_CARD"
+    assert ctrl.status == ATMStatus.ATM_NO_CARD
+    ctrl.close()
+
+
+def test_controller_close_ok_device_threads_stopped():
+    """close() stops the threads of parallel_devices"""
+    before = set(threading.enumerate())
+    ctrl = make_parallel_controller(TestPrinter())
+    select_first_account(ctrl)
+    ctrl.withdraw(30)
+    started = [t for t in threading.enumerate() if t not in before and t.name.startswith("atm-devices")]
+    assert started
+
+    ctrl.close()
+    for thread in started:
+        thread.join(timeout=1)
+    assert not any(thread.is_alive() for thread in started)
+
+
+def test_controller_withdraw_fail_undispensable_amount(controller):
+    """The bank is not charged if the notes in the cash bin cannot make the amount"""
+    controller.bank.adopter.set_bank_data(test_data)
+    controller.cash_bin = CassetteCashBin({50: 10, 20: 10})
+
+    controller.insert_card("12345678")
+    controller.read_card_number()
+    controller.validate_pin_number("1234")
+    controller.get_accounts()
+    controller.select_account(0)
+    with pytest.raises(UndispensableAmountException):
+        controller.withdraw(30)
+    assert controller.bank.adopter.bank_data["12345678"]["accounts"][0]["balance"] == 100
+    assert controller.cash_bin.get_available_money() == 700
+    assert controller.status == ATMStatus.ATM_NO_CARD
+
+
+def test_controller_withdraw_ok_cassettes():
+    """Withdraw from a cash bin with cassettes takes the planned notes"""
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(test_data)
+    ctrl = ATMController(bank=Bank(adopter=adopter), reader=TestCardReader(),
+                         cashbin=CassetteCashBin({50: 10, 20: 10}), printer=TestPrinter())
+
+    ctrl.insert_card("12345678")
+    ctrl.read_card_number()
+    ctrl.validate_pin_number("1234")
+    ctrl.get_accounts()
+    ctrl.select_account(0)
+    assert ctrl.withdraw(90)["balance"] == 10
+    assert ctrl.cash_bin.last_dispensed == {50: 1, 20: 2}
+
+def test_controller_shared_bank_ok_interleaved_customers():
+    """Many controllers share one Bank, and their customers don't affect each other"""
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(test_data)
+    bank = Bank(adopter=adopter)
+    first = ATMController(bank=bank, reader=TestCardReader(), cashbin=TestCashBin(), printer=TestPrinter())
+    second = ATMController(bank=bank, reader=TestCardReader(), cashbin=TestCashBin(), printer=TestPrinter())
+
+    first.insert_card("12345678")
+    second.insert_card("13572468")
+    first.read_card_number()
+    second.read_card_number()
+    first.validate_pin_number("1234")
+    second.validate_pin_number("8888")
+    first.get_accounts()
+    second.get_accounts()
+    first.select_account(0)
+    second.select_account(1)
+
+    assert second.get_balance() == 50
+    assert first.session.card_number == "12345678"
+    assert first.withdraw(30)["balance"] == 70
+    assert first.status == second.status == ATMStatus.ATM_NO_CARD
+
+
+def test_controller_get_accounts_ok_prefetch():
+    """With prefetch, get_accounts returns the accounts fetched after PIN validation"""
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(test_data)
+    bank = Bank(adopter=adopter, prefetch=True)
+    ctrl = ATMController(bank=bank, reader=TestCardReader(), cashbin=TestCashBin(), printer=TestPrinter())
+
+    ctrl.insert_card("13572468")
+    ctrl.read_card_number()
+    ctrl.validate_pin_number("8888")
+    accounts = ctrl.get_accounts()
+    bank.close()
+    assert accounts == test_data["13572468"]["accounts"]
+    assert ctrl.status == ATMStatus.ATM_ACCOUNTS_READY
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="selectors on pipes need POSIX")
+def test_controller_card_events_ok_hub():
+    """Events of the card reader device drive the controller from the hub thread"""
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(test_data)
+    reader, device = PipeCardReader.open_pipe()
+    ctrl = ATMController(bank=Bank(adopter=adopter), reader=reader, cashbin=TestCashBin(), printer=TestPrinter())
+    hub = CardReaderHub()
+    hub.attach(ctrl)
+    hub.start()
+    try:
+        os.write(device, b"IN 12345678\n")
+        deadline = time.monotonic() + 5
+        while ctrl.status != ATMStatus.ATM_CARD_IN and time.monotonic() < deadline:
+            time.sleep(0.001)
+        assert ctrl.read_card_number() == "12345678"
+
+        os.write(device, b"OUT\n")
+        while ctrl.status != ATMStatus.ATM_NO_CARD and time.monotonic() < deadline:
+            time.sleep(0.001)
+        assert ctrl.status == ATMStatus.ATM_NO_CARD
+        assert ctrl.session.card_number == ""
+    finally:
+        hub.stop()
+        reader.close()
+        os.close(device)
+
+
+class BlockingUpdateBankAdopter(TestBankAdopter):
+    """tx_update_account() waits until released, like a slow Bank API"""
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def tx_update_account(self, token: str, acc_idx: int, amount: int):
+        self.started.set()
+        self.release.wait(5)
+        return super().tx_update_account(token, acc_idx, amount)
+
+
+def test_controller_card_reader_hub_ok_card_removed_during_withdraw():
+    """A card removed while the bank is charged is handled after the withdrawal, not in the middle of it"""
+    adopter = BlockingUpdateBankAdopter()
+    adopter.set_bank_data(test_data)
+    reader, device = PipeCardReader.open_pipe()
+    cash_bin = TestCashBin()
+    ctrl = ATMController(bank=Bank(adopter=adopter), reader=reader, cashbin=cash_bin, printer=TestPrinter())
+    hub = CardReaderHub()
+    hub.attach(ctrl)
+    hub.start()
+    result = []
+    try:
+        os.write(device, b"IN 12345678\n")
+        deadline = time.monotonic() + 5
+        while ctrl.status != ATMStatus.ATM_CARD_IN and time.monotonic() < deadline:
+            time.sleep(0.001)
+        ctrl.read_card_number()
+        ctrl.validate_pin_number("1234")
+        ctrl.get_accounts()
+        ctrl.select_account(0)
+        customer = threading.Thread(target=lambda: result.append(ctrl.withdraw(30)))
+        customer.start()
+        assert adopter.started.wait(5)
+        os.write(device, b"OUT\n")
+        time.sleep(0.05)    # the hub thread waits for the withdrawal
+        adopter.release.set()
+        customer.join(5)
+    finally:
+        hub.stop()
+        reader.close()
+        os.close(device)
+    assert result and result[0].balance == 70
+    assert cash_bin.available_money == 970
+    assert ctrl.status == ATMStatus.ATM_NO_CARD
+
+
+def test_controller_send_diagnosis_ok_metrics(controller):
+    """Diagnosis data has the latency of every state transition and bank/hardware call"""
+    controller.bank.adopter.set_bank_data(test_data)
+    controller.insert_card("12345678")
+    controller.read_card_number()
+    controller.validate_pin_number("1234")
+    controller.get_accounts()
+    controller.select_account(0)
+    controller.withdraw(30)
+
+    diagnosis = controller.send_diagnosis()
+    latency = diagnosis["latency_us"]
+    for name in ("state.NO_CARD->CARD_IN", "state.CARD_IN->REGISTERED_CARD",
+                 "state.REGISTERED_CARD->VALID_PIN", "state.VALID_PIN->ACCOUNTS_READY",
+                 "state.ACCOUNTS_READY->ACCOUNT_SELECTED", "state.ACCOUNT_SELECTED->NO_CARD",
+                 "card_reader.read", "bank.is_registered", "bank.validate", "bank.account_list",
+                 "bank.update_account", "cash_bin.pop_money", "cash_bin.open", "printer.print_receipt",
+                 "card_reader.eject"):
+        assert latency[name]["count"] == 1
+    assert diagnosis["status"] == "NO_CARD"
+    assert diagnosis["counters"] == {}
+
+
+def test_controller_need_maintenance_ok_refuses_cards(controller):
+    """A faulty ATM ejects the card and refuses customers until it is booted again"""
+    controller.bank.adopter.set_bank_data(test_data)
+    controller.insert_card("12345678")
+    controller.read_card_number()
+
+    controller.need_maintenance()
+    assert controller.status == ATMStatus.ATM_NEED_MAINTENANCE
+    assert controller.card_reader.read() == ""
+    with pytest.raises(InvalidATMStatusException):
+        controller.insert_card("12345678")
+
+    controller.boot()
+    assert controller.status == ATMStatus.ATM_NO_CARD
+    controller.insert_card("12345678")
+    controller.read_card_number()
+    assert controller.status == ATMStatus.ATM_REGISTERED_CARD
+    latency = controller.send_diagnosis()["latency_us"]
+    assert latency["state.NEED_MAINTENANCE->INIT"]["count"] == 1
+    assert latency["state.INIT->NO_CARD"]["count"] == 1
+
+
+def test_controller_boot_fail_not_in_maintenance(controller):
+    with pytest.raises(InvalidATMStatusException):
+        controller.boot()
+    assert controller.status == ATMStatus.ATM_NO_CARD
@@ -0,0 +1,46 @@
+import time
+
+from app.atm.dispense import plan_dispense
+
+
+def test_plan_dispense_ok_fewest_notes():
+    """The amount is paid out with the fewest notes"""
+    cassettes = {100: 50, 50: 50, 20: 100, 10: 100}
+    assert plan_dispense(130, cassettes) == {100: 1, 20: 1, 10: 1}
+    assert plan_dispense(0, cassettes) == {}
+
+
+def test_plan_dispense_ok_greedy_dead_end():
+    """Greedy (50 first) cannot make 60, the planner finds 3 x 20"""
+    assert plan_dispense(60, {50: 10, 20: 10}) == {20: 3}
+
+
+def test_plan_dispense_ok_limited_notes():
+    """Empty cassettes are worked around"""
+    assert plan_dispense(1000, {100: 2, 50: 100, 20: 100}) == {100: 2, 50: 16}
+    assert plan_dispense(100, {100: 0, 50: 5}) == {50: 2}
+
+
+def test_plan_dispense_ok_balances_cassettes():
+    """Among plans with the same number of notes, no cassette is drained faster than needed"""
+    # 70 = 50 + 20 or 40 + 30, both 2 notes, the 50 cassette is almost empty
+    cassettes = {50: 2, 20: 100, 40: 100, 30: 100}
+    assert plan_dispense(70, cassettes) == {40: 1, 30: 1}
+
+
+def test_plan_dispense_fail_impossible():
+    """None if the notes cannot make the amount"""
+    cassettes = {100: 5, 50: 1, 20: 3}
+    assert plan_dispense(5, cassettes) is None          # not a multiple of the notes
+    assert plan_dispense(1000, cassettes) is None       # more than in the cassettes
+    assert plan_dispense(110, {100: 1, 20: 3}) is None  # 100 + 10 or 5 x 20+10
+    assert plan_dispense(10, {}) is None
+
+
+def test_plan_dispense_fail_impossible_large_cassettes_fast():
+    """An amount which cannot be made is refused without searching all combinations"""
+    start = time.perf_counter()
+    assert plan_dispense(59930, {200: 200, 100: 200, 50: 200, 20: 1}) is None
+    assert plan_dispense(99930, {100: 1000, 50: 1000, 20: 1}) is None
+    assert plan_dispense(99990, {100: 5000, 50: 5000, 20: 5000}) == {100: 999, 50: 1, 20: 2}
+    assert time.perf_counter() - start < 0.1
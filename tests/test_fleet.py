@@ -0,0 +1,35 @@
+from app.sim.fleet import FLOWS, make_bank_data, run_fleet
+
+
+def test_fleet_make_bank_data_ok_seeded():
+    """Same seed makes same test data"""
+    assert make_bank_data(50, seed=3) == make_bank_data(50, seed=3)
+    assert make_bank_data(50, seed=3) != make_bank_data(50, seed=4)
+    assert len(make_bank_data(50, seed=3)) == 50
+
+
+def test_fleet_run_ok_all_flows():
+    """All sessions finish without unexpected errors"""
+    report = run_fleet(terminals=20, sessions=500, seed=1, n_cards=100)
+    assert report.sessions == 500
+    assert sum(report.flows.values()) == 500
+    assert set(report.flows) == set(FLOWS)
+    assert report.errors == {}
+    assert report.sessions_per_sec > 0
+    assert len(report.latencies["insert_card"]) == 500
+    assert set(report.step_percentiles()["read_card_number"]) == {50, 95, 99}
+
+
+def test_fleet_run_ok_flow_weights():
+    """Only weighted flows are started"""
+    report = run_fleet(terminals=5, sessions=50, seed=1, n_cards=10, flow_weights={"balance": 1})
+    assert report.flows == {"balance": 50}
+    assert len(report.latencies["get_balance"]) == 50
+
+
+def test_fleet_run_ok_deterministic():
+    """Same seed runs same flows"""
+    first = run_fleet(terminals=10, sessions=200, seed=9, n_cards=50)
+    second = run_fleet(terminals=10, sessions=200, seed=9, n_cards=50)
+    assert first.flows == second.flows
+    assert {k: len(v) for k, v in first.latencies.items()} == {k: len(v) for k, v in second.latencies.items()}
@@ -0,0 +1,134 @@
+import copy
+import os
+import threading
+
+import pytest
+
+from app.bank.adopter import TestBankAdopter
+from app.bank.journal import Journal, JournaledBankAdopter, RECORD_SIZE, read_journal
+from app.bank.ledger import LedgerBankAdopter
+from app.errors.exceptions import JournalFailedException
+
+test_data = {
+    "12345678": {
+        "pin": "1234",
+        "accounts": [
+            {"acc_num": "11112222", "balance": 100, "available": True},
+            {"acc_num": "33334444", "balance": 0,   "available": True},
+        ]
+    },
+    "00000001": {
+        "pin": "8888",
+        "accounts": [
+            {"acc_num": "11113333", "balance": 10, "available": True},
+        ]
+    },
+}
+
+
+def make_adopter(adopter_class=TestBankAdopter):
+    adopter = adopter_class()
+    adopter.set_bank_data(copy.deepcopy(test_data))
+    return adopter
+
+
+def test_journal_ok_replay_rebuilds_balances(tmp_path):
+    """Balances are rebuilt from the snapshot and the journal after restart"""
+    path = str(tmp_path / "bank.journal")
+    adopter = JournaledBankAdopter.open(make_adopter(), path)
+    adopter.tx_update_account("87654321", 0, -30)
+    adopter.tx_update_account("87654321", 1, 5)
+    adopter.tx_update_account("10000000", 0, 7)
+    assert adopter.tx_update_account("87654321", 5, 1) == [False, None]   # not journaled
+    adopter.close()
+    assert list(read_journal(path)) == [("12345678", 0, -30), ("12345678", 1, 5), ("00000001", 0, 7)]
+
+    # restart on another ledger engine
+    restarted = JournaledBankAdopter.open(make_adopter(LedgerBankAdopter), path)
+    assert [acc["balance"] for acc in restarted.account_list("87654321")[1]] == [70, 5]
+    assert restarted.account_list("10000000")[1][0]["balance"] == 17
+    restarted.close()
+
+
+def test_journal_ok_torn_record_ignored(tmp_path):
+    """A record broken by a crash is cut off, and new records follow the valid ones"""
+    path = str(tmp_path / "bank.journal")
+    journal = Journal(path)
+    journal.commit("12345678", 0, 1)
+    journal.commit("12345678", 0, 2)
+    journal.close()
+    with open(path, "ab") as f:
+        f.write(b"\x01\x02\x03")
+    journal = Journal(path)
+    journal.commit("12345678", 0, 3)
+    journal.close()
+    assert [amount for _, _, amount in read_journal(path)] == [1, 2, 3]
+    assert (tmp_path / "bank.journal").stat().st_size == 3 * RECORD_SIZE
+
+
+def test_journal_ok_group_commit(tmp_path):
+    """Transactions of many terminals share fsyncs"""
+    path = str(tmp_path / "bank.journal")
+    adopter = JournaledBankAdopter(make_adopter(), Journal(path, group_size=64, group_interval=0.01))
+
+    def work():
+        for _ in range(50):
+            res, _ = adopter.tx_update_account("87654321", 0, 1)
+            assert res == True
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    adopter.close()
+    assert adopter.account_list("87654321")[1][0]["balance"] == 500
+    assert len(list(read_journal(path))) == 400
+    assert adopter.journal.fsyncs < 400
+
+
+def test_journal_ok_batch_journaled(tmp_path):
+    """Applied items of a batch are journaled, rejected batches are not"""
+    path = str(tmp_path / "bank.journal")
+    adopter = JournaledBankAdopter.open(make_adopter(), path)
+    assert adopter.tx_update_accounts_batch([("87654321", 0, 1), ("87654321", 9, 1)])[0] == False
+    adopter.tx_update_accounts_batch([("87654321", 0, 2), ("87654321", 9, 1), ("10000000", 0, 3)], atomic=False)
+    adopter.close()
+    assert list(read_journal(path)) == [("12345678", 0, 2), ("00000001", 0, 3)]
+
+
+def test_journal_fail_disk_error(tmp_path, monkeypatch):
+    """A failing fsync raises in the waiting callers instead of blocking them, and the update is rolled back"""
+    def fail(fd):
+        raise OSError(5, "Input/output error")
+
+    monkeypatch.setattr(os, "fsync", fail)
+    adopter = JournaledBankAdopter.open(make_adopter(), str(tmp_path / "bank.journal"))
+    result = []
+    thread = threading.Thread(target=lambda: result.append(pytest.raises(JournalFailedException,
+                                                                         adopter.tx_update_account,
+                                                                         "87654321", 0, -30)))
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert result
+    assert adopter.account_list("87654321")[1][0]["balance"] == 100
+    with pytest.raises(JournalFailedException):
+        adopter.tx_update_accounts_batch([("87654321", 0, 5), ("10000000", 0, 3)])
+    assert adopter.account_list("87654321")[1][0]["balance"] == 100
+    assert adopter.account_list("10000000")[1][0]["balance"] == 10
+    adopter.close()
+
+
+def test_journal_fail_update_after_close(tmp_path):
+    """An update of a closed journal raises and leaves the balances unchanged"""
+    path = str(tmp_path / "bank.journal")
+    adopter = JournaledBankAdopter.open(make_adopter(), path)
+    adopter.close()
+    with pytest.raises(ValueError):
+        adopter.tx_update_account("87654321", 0, -30)
+    with pytest.raises(ValueError):
+        adopter.tx_update_accounts_batch([("87654321", 0, 5), ("10000000", 0, 3)])
+    assert adopter.account_list("87654321")[1][0]["balance"] == 100
+    assert adopter.account_list("10000000")[1][0]["balance"] == 10
+    assert list(read_journal(path)) == []
@@ -0,0 +1,136 @@
+import copy
+
+import pytest
+
+from app.atm.controller import ATMController
+from app.atm.hardware.cardreader import TestCardReader
+from app.atm.hardware.cashbin import TestCashBin
+from app.atm.hardware.printer import TestPrinter
+from app.bank.bank import Bank
+from app.bank.ledger import ColumnarLedger, LedgerBankAdopter
+from app.sim.fleet import make_bank_data
+
+test_data = {
+    "12345678": {
+        "pin": "1234",
+        "accounts": [
+            {"acc_num": "11112222", "balance": 100, "available": True},
+            {"acc_num": "33334444", "balance": 0,   "available": True},
+        ]
+    },
+    "00000001": {
+        "pin": "0012",
+        "accounts": [
+            {"acc_num": "00000003", "balance": 10, "available": False},
+        ]
+    },
+    "00000000": {
+        "pin": "0000",
+        "accounts": []
+    },
+}
+
+
+def make_adopter() -> LedgerBankAdopter:
+    adopter = LedgerBankAdopter()
+    adopter.set_bank_data(copy.deepcopy(test_data))
+    return adopter
+
+
+def test_ledger_is_registered_ok():
+    """Registered cards are found by the hash index, including leading zeros"""
+    adopter = make_adopter()
+    assert adopter.is_registered("12345678") == True
+    assert adopter.is_registered("00000001") == True
+    assert adopter.is_registered("00000002") == False
+    assert adopter.is_registered("1") == False
+
+
+def test_ledger_validate_ok():
+    """Check entered-PIN == PIN of user's"""
+    adopter = make_adopter()
+    assert adopter.validate("00000001", "0012") == [True, "10000000"]
+    assert adopter.validate("00000001", "12") == [False, ""]
+    assert adopter.validate("12345678", "0000") == [False, ""]
+
+
+def test_ledger_account_list_ok_same_as_test_data():
+    """Accounts are restored in the format of TestBankAdopter"""
+    adopter = make_adopter()
+    for card_number, record in test_data.items():
+        res, accounts = adopter.account_list(card_number[::-1])
+        assert res == True
+        assert accounts == record["accounts"]
+    assert adopter.account_list("99999999") == [False, []]
+
+
+def test_ledger_tx_update_account_ok():
+    """Check the change of balance in the account after update_account"""
+    adopter = make_adopter()
+    res, account = adopter.tx_update_account("87654321", 1, 25)
+    assert res == True
+    assert account == {"acc_num": "33334444", "balance": 25, "available": True}
+    assert adopter.account_list("87654321")[1][1]["balance"] == 25
+    assert adopter.tx_update_account("87654321", 2, 25) == [False, None]
+
+
+def test_ledger_ok_index_grows_with_dataset():
+    """All cards are found after the index was rebuilt many times"""
+    data = make_bank_data(5000, seed=1)
+    adopter = LedgerBankAdopter(ColumnarLedger(capacity=4))
+    adopter.load(data.items())
+    assert len(adopter.ledger) == 5000
+    for card_number, record in data.items():
+        assert adopter.account_list(card_number[::-1]) == [True, record["accounts"]]
+    # about 30 bytes per card and 13 bytes per account
+    assert adopter.ledger.nbytes() < 5000 * 40 + len(adopter.ledger.acc_nums) * 13
+
+
+def test_ledger_add_card_fail_overflow():
+    """A value which does not fit its column adds nothing, no orphan account rows are left"""
+    adopter = make_adopter()
+    ledger = adopter.ledger
+    sizes = [len(column) for column in (ledger.cards, ledger.first, ledger.counts, ledger.acc_nums, ledger.balances)]
+    with pytest.raises(OverflowError):
+        ledger.add_card(23456789, 1234, [(11112222, 0, True), (1 << 32, 0, True)])
+    with pytest.raises(OverflowError):
+        ledger.add_card(23456789, 1 << 16, [(11112222, 0, True)])
+    assert [len(column) for column in (ledger.cards, ledger.first, ledger.counts,
+                                       ledger.acc_nums, ledger.balances)] == sizes
+    assert adopter.is_registered("23456789") == False
+    ledger.add_card(23456789, 1234, [(11112222, 5, True)])
+    assert adopter.account_list("98765432") == [True, [{"acc_num": "11112222", "balance": 5, "available": True}]]
+
+
+def test_ledger_load_ok_available_by_default():
+    """Accounts without "available" are available, like in TestBankAdopter"""
+    adopter = LedgerBankAdopter()
+    adopter.load([("12345678", {"pin": "1234", "accounts": [{"acc_num": "11112222", "balance": 1}]})])
+    assert adopter.account_list("87654321")[1][0]["available"] == True
+
+
+def test_ledger_tx_update_accounts_batch_ok_same_as_tx_update_account():
+    """The batch finds the same accounts as tx_update_account(), also after collisions in the index"""
+    data = make_bank_data(5000, seed=2)
+    adopter, expected = LedgerBankAdopter(ColumnarLedger(capacity=4)), LedgerBankAdopter()
+    adopter.load(data.items())
+    expected.load(data.items())
+    items = [(card_number[::-1], acc_idx, acc_idx + 1) for card_number in list(data)[::7] for acc_idx in range(3)]
+    items += [("99999999", 0, 1), ("x2345678", 0, 1)]
+    committed, results = adopter.tx_update_accounts_batch(items, atomic=False)
+    assert committed == True
+    for item, result in zip(items, results):
+        assert result == expected.tx_update_account(*item)
+    assert adopter.ledger.balances == expected.ledger.balances
+
+
+def test_ledger_ok_controller_flow():
+    """ATMController works on top of the ledger"""
+    ctrl = ATMController(bank=Bank(adopter=make_adopter()), reader=TestCardReader(),
+                         cashbin=TestCashBin(), printer=TestPrinter())
+    ctrl.insert_card("12345678")
+    ctrl.read_card_number()
+    ctrl.validate_pin_number("1234")
+    ctrl.get_accounts()
+    ctrl.select_account(0)
+    assert ctrl.withdraw(30)["balance"] == 70
@@ -0,0 +1,57 @@
+import logging
+import queue
+
+from app.common.config import conf, Config
+from app.utils import logger as log
+
+
+def test_logger_queue_mode_ok_written_by_writer_thread(tmp_path):
+    """In queue mode, records are written to the file by the background writer"""
+    log_file = tmp_path / "controller.log"
+    log.configure(Config(LOG_QUEUE=True, LOG_FILE=str(log_file), LOG_FLUSH_RECORDS=1000))
+    try:
+        accounts = [{"acc_num": "11112222", "balance": 100}]
+        log.logger.info("INSERTED_CARD:%s", "12345678")
+        log.logger.info("ACCOUNTS_DATA: %s", accounts)
+        accounts[0]["balance"] = 0      # changed after logging
+        log.logger.debug("NOT_WRITTEN")
+        log.shutdown()
+    finally:
+        log.configure(conf())
+    lines = log_file.read_text().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("[INFO]\t")
+    assert lines[0].endswith("    INSERTED_CARD:12345678")
+    assert lines[1].endswith("ACCOUNTS_DATA: [{'acc_num': '11112222', 'balance': 100}]")
+
+
+def test_logger_deferred_handler_ok_formatting_deferred():
+    """Immutable arguments are formatted later, mutable ones right now"""
+    handler = log.DeferredQueueHandler(queue.Queue())
+    record = logging.LogRecord("controller", logging.INFO, __file__, 0, "CARD:%s", ("12345678",), None)
+    assert handler.prepare(record).args == ("12345678",)
+    record = logging.LogRecord("controller", logging.INFO, __file__, 0, "DATA: %s", ([1, 2],), None)
+    prepared = handler.prepare(record)
+    assert prepared.args is None
+    assert prepared.msg == "DATA: [1, 2]"
+
+
+def test_logger_deferred_handler_ok_drop_if_full():
+    """A full queue drops records instead of blocking the caller"""
+    handler = log.DeferredQueueHandler(queue.Queue(maxsize=1))
+    for _ in range(3):
+        handler.handle(logging.LogRecord("controller", logging.INFO, __file__, 0, "RESET", None, None))
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 2
+
+
+def test_logger_batching_file_handler_ok_flush_per_batch(tmp_path):
+    """The file is flushed once per flush_records records"""
+    log_file = tmp_path / "batch.log"
+    handler = log.BatchingFileHandler(str(log_file), flush_records=3, flush_interval=60)
+    for i in range(2):
+        handler.handle(logging.LogRecord("controller", logging.INFO, __file__, 0, "LINE %s", (i,), None))
+    assert log_file.read_text() == ""
+    handler.handle(logging.LogRecord("controller", logging.INFO, __file__, 0, "LINE %s", (2,), None))
+    assert log_file.read_text() == "LINE 0\nLINE 1\nLINE 2\n"
+    handler.close()
@@ -0,0 +1,68 @@
+import random
+
+from app.utils.metrics import Histogram, Metrics, bucket_index, bucket_value, merge_metrics
+
+
+def test_histogram_bucket_ok_precision():
+    """Values below 32 are exact, others are within 1/16 of their bucket bound"""
+    for value in list(range(100)) + [random.Random(0).randrange(10 ** 9) for _ in range(1000)]:
+        index = bucket_index(value)
+        assert bucket_value(index) >= value
+        assert index == 0 or bucket_value(index - 1) < value
+        if value < 32:
+            assert bucket_value(index) == value
+        else:
+            assert bucket_value(index) - value < value / 16
+
+
+def test_histogram_percentile_ok():
+    """Percentiles are close to the exact ones"""
+    rng = random.Random(1)
+    values = sorted(rng.randrange(1, 100000) for _ in range(10000))
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value)
+    for p in (50, 90, 99):
+        exact = values[int(len(values) * p / 100) - 1]
+        assert abs(histogram.percentile(p) - exact) <= exact / 16
+    assert histogram.percentile(100) == histogram.max == values[-1]
+    assert histogram.min == values[0]
+    assert histogram.count == len(values)
+
+
+def test_histogram_merge_ok():
+    """Merged histogram is the same as recording all values in one"""
+    first, second, both = Histogram(), Histogram(), Histogram()
+    for value in range(0, 5000, 7):
+        first.record(value)
+        both.record(value)
+    for value in range(3, 900000, 911):
+        second.record(value)
+        both.record(value)
+    first.merge(Histogram.from_dict(second.to_dict()))
+    assert first.to_dict() == both.to_dict()
+
+
+def test_metrics_timed_ok():
+    """Latency and failures of calls are recorded"""
+    now = [0]
+    metrics = Metrics(clock=lambda: now[0])
+
+    def call(fail: bool):
+        now[0] += 2500000   # 2.5 ms
+        if fail:
+            raise ValueError()
+        return "ok"
+
+    assert metrics.timed("bank.validate", call, False) == "ok"
+    try:
+        metrics.timed("bank.validate", call, fail=True)
+    except ValueError:
+        pass
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"] == {"bank.validate.errors": 1}
+    assert snapshot["latency_us"]["bank.validate"]["count"] == 2
+    assert snapshot["latency_us"]["bank.validate"]["max"] == 2500
+
+    merged = merge_metrics([metrics, metrics])
+    assert merged.snapshot()["latency_us"]["bank.validate"]["count"] == 4
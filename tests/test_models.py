@@ -0,0 +1,109 @@
+import copy
+import json
+
+import pytest
+
+from app.bank.adopter import TestBankAdopter
+from app.bank.bank import Bank
+from app.bank.models import Account, CardRecord
+from app.bank.server import BankServer
+
+account_data = {"acc_num": "11112222", "balance": 100, "available": True}
+
+
+def test_account_ok_slots():
+    """Account has no __dict__, so no new attribute can be added"""
+    account = Account("11112222", 100)
+    assert not hasattr(account, "__dict__")
+    with pytest.raises(AttributeError):
+        account.owner = "someone"
+
+
+def test_account_ok_dict_view():
+    """Existing callers can use Account like the old dict"""
+    account = Account.from_dict(account_data)
+    assert account["balance"] == account.balance == 100
+    assert "balance" in account and "owner" not in account
+    assert account.get("owner", 0) == 0
+    account["balance"] += 10
+    assert account.balance == 110
+    with pytest.raises(KeyError):
+        account["owner"]
+
+
+def test_account_ok_same_as_dict():
+    """Comparison, repr() and JSON are the same as the old dict"""
+    account = Account.from_dict(account_data)
+    assert account == account_data
+    assert account_data == account
+    assert [account] == [account_data]
+    assert repr(account) == repr(account_data)
+    assert str(account) == str(account_data)
+    assert account.to_dict() == account_data
+    assert account != Account("11112222", 0)
+
+
+def test_account_ok_copy():
+    """Copied account is independent of the original"""
+    account = Account.from_dict(account_data)
+    copied = copy.copy(account)
+    copied.balance = 0
+    assert account.balance == 100
+
+
+def test_account_coerce_ok():
+    """Only an account dict is converted"""
+    account = Account("11112222", 100)
+    assert Account.coerce(account) is account
+    assert isinstance(Account.coerce(account_data), Account)
+    assert Account.coerce({"acc_num": "11112222"}) == {"acc_num": "11112222"}
+
+
+def test_card_record_ok():
+    """CardRecord is converted from/to dict and can be used like the old dict"""
+    data = {"pin": "1234", "accounts": [account_data]}
+    record = CardRecord.from_dict(data)
+    assert record.pin == record["pin"] == "1234"
+    assert isinstance(record.accounts[0], Account)
+    assert record == data
+    assert record.to_dict() == data
+    assert CardRecord.coerce(record) is record
+
+
+def test_adopter_set_bank_data_ok_converted():
+    """Dict records are converted, and the given data is not changed by transactions"""
+    data = {"12345678": {"pin": "1234", "accounts": [dict(account_data)]}}
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(data)
+    assert isinstance(adopter.bank_data["12345678"], CardRecord)
+    res, account = adopter.tx_update_account("87654321", 0, 10)
+    assert res and isinstance(account, Account)
+    assert account.balance == 110
+    assert data["12345678"]["accounts"][0]["balance"] == 100
+
+
+def test_bank_account_list_ok_from_dicts():
+    """Accounts given as dicts by an adopter (e.g. decoded JSON) become Account"""
+    class DictBankAdopter(TestBankAdopter):
+        def account_list(self, token: str):
+            res, accounts = super().account_list(token)
+            return [res, [account.to_dict() for account in accounts]]
+
+    adopter = DictBankAdopter()
+    adopter.set_bank_data({"12345678": {"pin": "1234", "accounts": [dict(account_data)]}})
+    bank = Bank(adopter=adopter)
+    bank.validate(entered_pin="1234", card_number="12345678")
+    res, accounts = bank.account_list()
+    assert res and isinstance(accounts[0], Account)
+
+
+def test_server_dispatch_ok_account_as_json():
+    """Accounts are sent as JSON objects"""
+    server = BankServer()
+    try:
+        server.adopter.set_bank_data({"12345678": {"pin": "1234", "accounts": [dict(account_data)]}})
+        line = json.dumps({"id": 1, "method": "account_list", "params": ["87654321"]}).encode()
+        response = json.loads(server.dispatch(line))
+        assert response["result"] == [True, [account_data]]
+    finally:
+        server.server_close()
@@ -0,0 +1,183 @@
+import copy
+import threading
+
+import pytest
+
+from app.atm.controller import ATMController
+from app.atm.hardware.cardreader import TestCardReader
+from app.atm.hardware.cashbin import TestCashBin
+from app.atm.hardware.printer import TestPrinter
+from app.bank.adopter import TestBankAdopter
+from app.bank.bank import Bank
+from app.bank.bloom import RefreshingCardFilter
+from app.bank.net_adopter import NetBankAdopter
+from app.bank.server import BankServer
+from app.sim.workload import Workload
+from app.errors.exceptions import BankConnectionException
+
+test_data = {
+    "12345678": {
+        "pin": "1234",
+        "accounts": [
+            {"acc_num": "11112222", "balance": 100, "available": True},
+            {"acc_num": "33334444", "balance": 0,   "available": True},
+        ]
+    },
+}
+
+
+@pytest.fixture()
+def server():
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(copy.deepcopy(test_data))
+    server = BankServer(adopter)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture()
+def net_adopter(server):
+    adopter = NetBankAdopter(*server.address, pool_size=2)
+    yield adopter
+    adopter.close()
+
+
+def test_net_adopter_ok_all_apis(net_adopter):
+    """Bank APIs work through the server like TestBankAdopter"""
+    assert net_adopter.is_registered("12345678") == True
+    assert net_adopter.is_registered("11112222") == False
+    res, token = net_adopter.validate("12345678", "1234")
+    assert res == True
+    assert token == "87654321"
+    res, accounts = net_adopter.account_list(token)
+    assert res == True
+    assert accounts[0]["balance"] == 100
+    res, account = net_adopter.tx_update_account(token, 0, 10)
+    assert res == True
+    assert account["balance"] == 110
+
+
+def test_net_adopter_ok_keep_alive(net_adopter):
+    """Calls reuse the same connection, only one handshake"""
+    for _ in range(20):
+        assert net_adopter.is_registered("12345678") == True
+    assert net_adopter.pool.connects == 1
+
+
+def test_net_adopter_ok_pipeline(net_adopter):
+    """Pipelined calls come back in order"""
+    results = net_adopter.pipeline([
+        ("is_registered", ["12345678"]),
+        ("validate", ["12345678", "1234"]),
+        ("account_list", ["87654321"]),
+    ])
+    assert results[0] == True
+    assert results[1] == [True, "87654321"]
+    assert results[2][1][1]["acc_num"] == "33334444"
+    assert net_adopter.pool.connects == 1
+
+
+def test_net_adopter_ok_bounded_pool(net_adopter):
+    """Many threads share at most pool_size connections"""
+    def work():
+        for _ in range(20):
+            net_adopter.is_registered("12345678")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert 1 <= net_adopter.pool.connects <= 2
+
+
+def test_net_adopter_fail_unknown_method(net_adopter):
+    """Server errors are raised, the connection is kept"""
+    with pytest.raises(BankConnectionException):
+        net_adopter.pipeline([("set_bank_data", [{}])])
+    assert net_adopter.is_registered("12345678") == True
+    assert net_adopter.pool.connects == 1
+
+
+def test_net_adopter_fail_error_in_pipeline(net_adopter):
+    """An error in the middle of a pipeline does not leave the other responses on the connection"""
+    with pytest.raises(BankConnectionException):
+        net_adopter.pipeline([("bogus", []), ("is_registered", ["12345678"]), ("is_registered", ["87654321"])])
+    assert net_adopter.is_registered("12345678") == True
+    assert net_adopter.pipeline([("is_registered", ["99999999"]), ("is_registered", ["12345678"])]) == [False, True]
+    assert net_adopter.pool.connects == 1
+
+
+def test_net_adopter_ok_card_filter(net_adopter):
+    """RefreshingCardFilter can be built from the cards of the bank server"""
+    card_filter = RefreshingCardFilter(net_adopter.card_numbers, capacity=100)
+    assert list(net_adopter.card_numbers()) == ["12345678"]
+    assert "12345678" in card_filter
+    assert "99999999" not in card_filter
+
+
+def test_net_adopter_ok_load_workload(server, net_adopter):
+    """Workload cards are streamed to the bank server in chunks"""
+    workload = Workload(250, seed=1)
+    net_adopter.load(workload.records(), chunk_size=100)
+    assert len(server.adopter.bank_data) == 251
+    op = next(op for op in workload.operations() if op.kind == "balance")
+    assert net_adopter.validate(op.card_number, op.pin)[0] == True
+
+
+def test_net_adopter_fail_no_server():
+    """Connection failures are raised as BankConnectionException"""
+    server = BankServer()
+    host, port = server.address
+    server.server_close()
+    adopter = NetBankAdopter(host, port, timeout=1.0)
+    with pytest.raises(BankConnectionException):
+        adopter.is_registered("12345678")
+
+
+def restart(server: BankServer) -> BankServer:
+    """Stop the server, cutting its connections, and serve the same adopter on the same port again"""
+    server.stop()
+    restarted = BankServer(server.adopter, *server.address)
+    restarted.start()
+    return restarted
+
+
+def test_net_adopter_ok_retry_after_server_restart(server, net_adopter):
+    """A read on a kept-alive connection closed by a restart is sent again, a balance update is not"""
+    assert net_adopter.is_registered("12345678") == True
+    server = restart(server)
+    try:
+        assert net_adopter.is_registered("12345678") == True
+        assert net_adopter.pool.connects == 2
+
+        server = restart(server)
+        with pytest.raises(BankConnectionException):
+            net_adopter.tx_update_account("87654321", 0, 5)
+        assert net_adopter.account_list("87654321")[1][0]["balance"] == 100
+    finally:
+        server.stop()
+
+
+def test_net_adopter_ok_controller_flow(net_adopter):
+    """ATMController works on top of the pooled adopter"""
+    ctrl = ATMController(bank=Bank(adopter=net_adopter), reader=TestCardReader(),
+                         cashbin=TestCashBin(), printer=TestPrinter())
+    ctrl.insert_card("12345678")
+    ctrl.read_card_number()
+    ctrl.validate_pin_number("1234")
+    ctrl.get_accounts()
+    ctrl.select_account(0)
+    account = ctrl.withdraw(30)
+    assert account["balance"] == 70
+    assert net_adopter.pool.connects == 1
+
+
+def test_net_adopter_ok_batch_one_round_trip(net_adopter):
+    """Batched calls are served by the adopter behind the server"""
+    assert net_adopter.is_registered_batch(["12345678", "00000000"]) == [True, False]
+    committed, results = net_adopter.tx_update_accounts_batch([("87654321", 0, 1), ("87654321", 1, 2)])
+    assert committed == True
+    assert [acc["balance"] for _, acc in results] == [101, 2]
+    assert net_adopter.pool.connects == 1
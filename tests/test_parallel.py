@@ -0,0 +1,51 @@
+import pytest
+
+from app.sim.fleet import run_fleet
+from app.sim.parallel import run_parallel_fleet, split
+from app.sim.workload import Workload
+
+
+def test_parallel_split_ok():
+    """Parts follow the weights and add up to the total"""
+    assert split(10, [1, 1, 1]) == [4, 3, 3]
+    assert split(100, [3, 1]) == [75, 25]
+    assert sum(split(997, [0.5, 0.3, 0.1, 0.1])) == 997
+
+
+def test_parallel_workload_partitions_ok_disjoint():
+    """Partitions split the cards without overlap, and their weights add up to the whole"""
+    whole = Workload(1000, seed=4)
+    parts = [Workload(1000, seed=4, partition=i, partitions=3) for i in range(3)]
+    cards = [set(card for card, _ in part.records()) for part in parts]
+    assert sum(len(c) for c in cards) == 1000
+    assert set.union(*cards) == set(card for card, _ in whole.records())
+    assert sum(part.weight() for part in parts) == pytest.approx(whole.weight())
+    for i, part in enumerate(parts):
+        assert all(op.rank % 3 == i for op in part.operations(200) if op.rank >= 0)
+
+
+def test_parallel_fleet_ok_merged():
+    """Reports of the workers are merged, money is conserved"""
+    report = run_parallel_fleet(workers=2, terminals=10, sessions=400, seed=1, n_cards=200)
+    assert report.workers == 2
+    assert report.terminals == 10
+    assert report.sessions == 400
+    assert sum(report.flows.values()) == 400
+    assert report.errors == {}
+    assert len(report.latencies["insert_card"]) == 400
+    assert report.cash_end - report.cash_start == report.balance_end - report.balance_start
+    assert report.wall >= report.elapsed > 0
+
+
+def test_parallel_fleet_ok_one_worker_same_as_fleet():
+    """One worker runs the same sessions as run_fleet"""
+    parallel = run_parallel_fleet(workers=1, terminals=5, sessions=100, seed=3, n_cards=50)
+    single = run_fleet(terminals=5, sessions=100, seed=3, n_cards=50)
+    assert parallel.flows == single.flows
+    assert parallel.balance_end == single.balance_end
+
+
+def test_parallel_fleet_fail_too_many_workers():
+    """Every worker needs a terminal and a card"""
+    with pytest.raises(ValueError):
+        run_parallel_fleet(workers=4, terminals=2, sessions=10)
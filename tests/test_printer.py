@@ -1,6 +1,6 @@
 import pytest
 
-from app.atm.hardware.printer import TestPrinter
+from app.atm.hardware.printer import TestPrinter, SpoolingPrinter
 from app.errors.exceptions import NotEnoughPaperInPrinterException
 
 
@@ -31,3 +31,28 @@ def test_printer_print_receipt_fail_not_enough_paper():
     after_print = printer.get_available_paper()
     assert before_print == after_print
 
+
+
+def test_spooling_printer_ok():
+    """Receipts are printed in the background, and the caller's buffer can be reused"""
+    printer = TestPrinter(paper=100)
+    spool = SpoolingPrinter(printer)
+    buffer = bytearray(b"RECEIPT 1\n")
+    spool.print_receipt(memoryview(buffer))
+    buffer[:] = b"RECEIPT 2\n"
+    spool.print_receipt(buffer)
+    spool.join()
+    assert printer.get_available_paper() == 80
+    assert spool.errors == []
+    spool.close()
+
+
+def test_spooling_printer_fail_not_enough_paper():
+    """Queued receipts reserve paper, so running out of paper is reported at once"""
+    printer = TestPrinter(paper=15)
+    spool = SpoolingPrinter(printer)
+    spool.print_receipt(b"0123456789")
+    with pytest.raises(NotEnoughPaperInPrinterException):
+        spool.print_receipt(b"0123456789")
+    spool.close()
+    assert printer.get_available_paper() == 5
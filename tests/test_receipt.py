@@ -0,0 +1,33 @@
+from app.atm.receipt import WIDTH, ReceiptRenderer, ReceiptTemplate
+from app.bank.models import Account
+
+
+def test_receipt_template_ok_slots():
+    """Values are aligned in their fixed-width slots"""
+    template = ReceiptTemplate("A{left:<5}|{right:>5}B\n")
+    assert bytes(template.render(left="ab", right=12)) == b"Aab   |   12B\n"
+    assert bytes(template.render(left="abcde", right="")) == b"Aabcde|     B\n"
+
+
+def test_receipt_template_ok_overflow():
+    """Too long values are not truncated but masked"""
+    template = ReceiptTemplate("{amount:>3}\n")
+    assert bytes(template.render(amount=12345)) == b"***\n"
+
+
+def test_receipt_template_ok_reused_buffer():
+    """The same buffer is rendered again, without leftovers of the previous receipt"""
+    template = ReceiptTemplate("{amount:>6}\n")
+    first = template.render(amount=123456)
+    assert bytes(template.render(amount=7)) == b"     7\n"
+    assert first.obj is template.render(amount=8).obj
+
+
+def test_receipt_renderer_ok():
+    """Every line of the receipts has the same width"""
+    renderer = ReceiptRenderer()
+    account = Account("11112222", 70)
+    withdraw = bytes(renderer.withdraw(account, 30)).decode()
+    assert "WITHDRAW" in withdraw and "11112222" in withdraw and withdraw.count(" 70\n") == 1
+    for receipt in (withdraw, bytes(renderer.deposit(account, 30)).decode(), bytes(renderer.balance(account)).decode()):
+        assert all(len(line) == WIDTH for line in receipt.splitlines())
@@ -0,0 +1,151 @@
+import io
+import logging
+
+import pytest
+
+from app.atm.controller import ATMController
+from app.atm.hardware.cardreader import TestCardReader
+from app.atm.hardware.cashbin import TestCashBin
+from app.atm.hardware.printer import TestPrinter
+from app.bank.adopter import TestBankAdopter
+from app.bank.bank import Bank
+from app.errors.exceptions import *
+from app.sim.replay import REPLAY_PIN, WRONG_PIN, parse_log, replay
+from app.utils.logger import LOG_DATE_FORMAT, LOG_FORMAT, logger
+
+test_data = {
+    "12345678": {
+        "pin": "1234",
+        "accounts": [
+            {"acc_num": "11112222", "balance": 100, "available": True},
+            {"acc_num": "33334444", "balance": 0, "available": True},
+        ]
+    },
+    "00000000": {"pin": "0000", "accounts": []},
+}
+
+LOG = """\
+[INFO]\t2026-10-18 07:54:24.900    INSERTED_CARD:12345678
+[INFO]\t2026-10-18 07:54:24.901    REGISTERED_CARD:12345678
+[INFO]\t2026-10-18 07:54:24.902    PIN_IS_INCORRECT
+[INFO]\t2026-10-18 07:54:24.902    EJECTED_CARD
+[INFO]\t2026-10-18 07:54:24.903    RESET
+
+[INFO]\t2026-10-18 07:54:25.000    INSERTED_CARD:12345678
+[INFO]\t2026-10-18 07:54:25.001    REGISTERED_CARD:12345678
+[INFO]\t2026-10-18 07:54:25.002    PIN_IS_CORRECT
+[INFO]\t2026-10-18 07:54:25.003    ACCOUNTS_DATA: [{'acc_num': '11112222', 'balance': 100, 'available': True}]
+[INFO]\t2026-10-18 07:54:25.004    ACCOUNT_SELECTED: 0
+[INFO]\t2026-10-18 07:54:25.005    BANK_WITHDRAW_START:30
+[INFO]\t2026-10-18 07:54:25.006    BANK_WITHDRAW_OK
+[INFO]\t2026-10-18 07:54:25.007    POP_MONEY
+[INFO]\t2026-10-18 07:54:25.008    EJECTED_CARD
+[INFO]\t2026-10-18 07:54:25.010    RESET
+
+"""
+
+
+@pytest.fixture
+def recorded_log():
+    """Lines which the controller logs while the fixture is active"""
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+    logger.addHandler(handler)
+    yield stream
+    logger.removeHandler(handler)
+
+
+def run_sessions(ctrl: ATMController):
+    """A few sessions of one customer with various outcomes"""
+    flows = [
+        ("1234", "balance", None),
+        ("1234", "withdraw", 30),
+        ("1234", "withdraw", 500),          # more than the balance
+        ("1234", "withdraw", -1),           # invalid amount
+        ("1234", "deposit", 20),
+        ("9999", None, None),               # wrong PIN
+    ]
+    for pin, action, amount in flows:
+        ctrl.insert_card("12345678")
+        ctrl.read_card_number()
+        try:
+            ctrl.validate_pin_number(pin)
+            ctrl.get_accounts()
+            ctrl.select_account(0)
+            if action == "balance":
+                ctrl.get_balance()
+            elif action == "deposit":
+                ctrl.cash_bin.set_counting_money(amount)
+                ctrl.deposit(amount)
+            else:
+                ctrl.withdraw(amount)
+        except (IncorrectPinNumberException, NotEnoughMoneyInAccountException):
+            pass
+        except InvalidAmountValueException:
+            ctrl.reset()
+    ctrl.insert_card("00000000")
+    ctrl.read_card_number()
+    ctrl.validate_pin_number("0000")
+    with pytest.raises(NoAccountException):
+        ctrl.get_accounts()
+    ctrl.insert_card("87654321")
+    with pytest.raises(UnregisteredCardNumberException):
+        ctrl.read_card_number()
+
+
+def test_replay_parse_log_ok():
+    """Sessions and their steps are rebuilt from the tokens"""
+    sessions = list(parse_log(io.StringIO(LOG)))
+    assert len(sessions) == 2
+    assert [(s.action, s.args, s.expected) for s in sessions[0].steps] == [
+        ("insert_card", ("12345678",), "INSERTED_CARD"),
+        ("read_card_number", (), "REGISTERED_CARD"),
+        ("validate_pin_number", (WRONG_PIN,), "PIN_IS_INCORRECT"),
+    ]
+    assert sessions[1].steps[2].args == (REPLAY_PIN,)
+    assert sessions[1].steps[-1].action == "withdraw"
+    assert sessions[1].steps[-1].args == (30,)
+    assert sessions[1].steps[-1].expected == "BANK_WITHDRAW_OK"
+    assert sessions[1].ended - sessions[1].started == pytest.approx(0.010)
+
+
+def test_replay_parse_log_ok_old_format_skipped():
+    """A withdraw logged without its amount cannot be replayed"""
+    sessions = list(parse_log(io.StringIO(LOG.replace("BANK_WITHDRAW_START:30", "BANK_WITHDRAW_START"))))
+    assert sessions[0].replayable
+    assert not sessions[1].replayable
+    report = replay(sessions)
+    assert report.skipped == 1
+    assert report.replayed == 1
+
+
+def test_replay_ok_recorded_log(recorded_log):
+    """Sessions recorded from a controller replay without divergence"""
+    adopter = TestBankAdopter()
+    adopter.set_bank_data(test_data)
+    ctrl = ATMController(bank=Bank(adopter=adopter), reader=TestCardReader(),
+                         cashbin=TestCashBin(), printer=TestPrinter())
+    run_sessions(ctrl)
+
+    recorded_log.seek(0)
+    report = replay(parse_log(recorded_log))
+    assert report.sessions == 8
+    assert report.replayed == 8
+    assert report.diverged == 0, report.summary()
+    assert report.steps > 30
+    assert report.sessions_per_sec > 0
+    assert not logger.disabled
+
+
+def test_replay_ok_divergence_reported():
+    """A step whose outcome differs from the log is reported"""
+    # the withdraw is logged twice, but the second one sees a balance of 70 in the replay
+    log = LOG + LOG.split("\n\n")[1] + "\n"
+    report = replay(parse_log(io.StringIO(log)))
+    assert report.replayed == 3
+    assert report.diverged == 1
+    divergence = report.divergences[0]
+    assert (divergence.session, divergence.step, divergence.action) == (2, 3, "get_accounts")
+    assert "'balance': 100" in divergence.expected
+    assert "'balance': 70" in divergence.actual
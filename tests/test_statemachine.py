@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+from app.atm.statemachine import STATE_MACHINE, TRANSITIONS, ATMEvent, ATMStatus, StateMachine, Transition
+from app.errors.exceptions import InvalidATMStatusException
+
+S = ATMStatus
+E = ATMEvent
+
+
+def test_statemachine_guards_ok_at_least_status():
+    """An event is allowed in its status and in every later status of a session"""
+    assert not STATE_MACHINE.allowed(S.ATM_NO_CARD, E.CARD_REGISTERED)
+    assert STATE_MACHINE.allowed(S.ATM_CARD_IN, E.CARD_REGISTERED)
+    assert STATE_MACHINE.allowed(S.ATM_ACCOUNT_SELECTED, E.CARD_REGISTERED)
+    assert not STATE_MACHINE.allowed(S.ATM_ACCOUNTS_READY, E.TRANSACTION)
+    assert STATE_MACHINE.allowed(S.ATM_ACCOUNT_SELECTED, E.TRANSACTION)
+    assert not STATE_MACHINE.allowed(S.ATM_NEED_MAINTENANCE, E.CARD_INSERTED)
+    assert not STATE_MACHINE.allowed(S.ATM_INIT, E.CARD_INSERTED)
+    assert STATE_MACHINE.allowed(S.ATM_VALID_PIN, E.FAULT)
+
+
+def test_statemachine_next_status_ok_session():
+    status = S.ATM_NEED_MAINTENANCE
+    for event, expected in ((E.REPAIRED, S.ATM_INIT), (E.BOOTED, S.ATM_NO_CARD),
+                            (E.CARD_INSERTED, S.ATM_CARD_IN), (E.CARD_INVALID, S.ATM_CARD_IN),
+                            (E.CARD_REGISTERED, S.ATM_REGISTERED_CARD), (E.PIN_INVALID, S.ATM_REGISTERED_CARD),
+                            (E.PIN_CORRECT, S.ATM_VALID_PIN), (E.ACCOUNTS_READY, S.ATM_ACCOUNTS_READY),
+                            (E.ACCOUNT_SELECTED, S.ATM_ACCOUNT_SELECTED), (E.TRANSACTION, S.ATM_ACCOUNT_SELECTED),
+                            (E.RESET, S.ATM_NO_CARD), (E.FAULT, S.ATM_NEED_MAINTENANCE)):
+        status = STATE_MACHINE.next_status(status, event)
+        assert status == expected
+
+
+def test_statemachine_next_status_fail_rejected():
+    with pytest.raises(InvalidATMStatusException):
+        STATE_MACHINE.next_status(S.ATM_NO_CARD, E.REPAIRED)
+
+
+def test_statemachine_step_ok_vector():
+    vector = STATE_MACHINE.vector(4)
+    rejected = vector.step([E.CARD_INSERTED, E.CARD_REGISTERED, E.NONE, E.FAULT])
+    assert rejected == b"\x00\x01\x00\x00"
+    assert vector.status_list() == [S.ATM_CARD_IN, S.ATM_NO_CARD, S.ATM_NO_CARD, S.ATM_NEED_MAINTENANCE]
+    assert vector.count(S.ATM_NO_CARD) == 2
+    assert vector[3] == S.ATM_NEED_MAINTENANCE
+
+    rejected = vector.step(bytes([E.CARD_REGISTERED, 200, E.RESET, E.REPAIRED]))
+    assert list(rejected) == [0, 1, 0, 0]
+    assert vector.status_list() == [S.ATM_REGISTERED_CARD, S.ATM_NO_CARD, S.ATM_NO_CARD, S.ATM_INIT]
+
+
+def test_statemachine_step_ok_same_as_next_status():
+    """A batched step gives the statuses of one next_status() per session"""
+    rng = random.Random(7)
+    n = 5000
+    vector = STATE_MACHINE.vector(n)
+    statuses = [S.ATM_NO_CARD] * n
+    for _ in range(20):
+        events = bytes(rng.choice(range(E.REPAIRED + 1)) for _ in range(n))
+        rejected = vector.step(events)
+        for i, event in enumerate(events):
+            if STATE_MACHINE.allowed(statuses[i], event):
+                statuses[i] = STATE_MACHINE.next_status(statuses[i], event)
+                assert rejected[i] == 0
+            else:
+                assert rejected[i] == 1
+        assert vector.status_list() == statuses
+
+
+def test_statemachine_step_fail_length():
+    with pytest.raises(ValueError):
+        STATE_MACHINE.vector(3).step(b"\x00")
+
+
+def test_statemachine_custom_transitions_ok():
+    """A machine can be built from another table, e.g. without maintenance"""
+    machine = StateMachine([t for t in TRANSITIONS if t.event != E.FAULT]
+                           + [Transition(E.FAULT, S.ATM_NO_CARD, S.ATM_NO_CARD, None)])
+    assert machine.allowed(S.ATM_NO_CARD, E.FAULT)
+    assert not machine.allowed(S.ATM_CARD_IN, E.FAULT)
+    assert machine.next_status(S.ATM_NO_CARD, E.FAULT) == S.ATM_NO_CARD
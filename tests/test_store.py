@@ -0,0 +1,138 @@
+import copy
+
+import pytest
+
+from app.atm.controller import ATMController
+from app.atm.hardware.cardreader import TestCardReader
+from app.atm.hardware.cashbin import TestCashBin
+from app.atm.hardware.printer import TestPrinter
+from app.bank.bank import Bank
+from app.bank.store import MmapBankAdopter, build_store
+from app.sim.fleet import make_bank_data
+
+test_data = {
+    "12345678": {
+        "pin": "1234",
+        "accounts": [
+            {"acc_num": "11112222", "balance": 100, "available": True},
+            {"acc_num": "33334444", "balance": 0,   "available": True},
+        ]
+    },
+    "00000001": {
+        "pin": "0012",
+        "accounts": [
+            {"acc_num": "00000003", "balance": -10, "available": False},
+        ]
+    },
+    "00000000": {
+        "pin": "0000",
+        "accounts": []
+    },
+}
+
+
+@pytest.fixture()
+def store_path(tmp_path):
+    path = str(tmp_path / "bank.store")
+    build_store(path, copy.deepcopy(test_data).items())
+    return path
+
+
+@pytest.fixture()
+def store(store_path):
+    adopter = MmapBankAdopter(store_path)
+    yield adopter
+    adopter.close()
+
+
+def test_store_is_registered_ok(store):
+    """Registered cards are found by the on-disk index, including leading zeros"""
+    assert len(store) == 3
+    assert all(store.is_registered(card_number) for card_number in test_data)
+    assert store.is_registered("87654321") == False
+    assert store.is_registered("1234") == False
+    assert store.is_registered_batch(["00000001", "99999999"]) == [True, False]
+
+
+def test_store_validate_ok(store):
+    """PIN with leading zeros is checked, token is the reversed card number"""
+    assert store.validate("00000001", "0012") == [True, "10000000"]
+    assert store.validate("00000001", "12") == [False, ""]
+    assert store.validate("12345678", "0000") == [False, ""]
+
+
+def test_store_account_list_ok(store):
+    """Accounts are the same as the source data"""
+    for card_number, record in test_data.items():
+        assert store.account_list(card_number[::-1]) == [True, record["accounts"]]
+    assert store.account_list("00000009") == [False, []]
+
+
+def test_store_tx_update_account_ok_persisted(store_path):
+    """Updated balances are in the file after flush"""
+    adopter = MmapBankAdopter(store_path)
+    assert adopter.tx_update_account("87654321", 1, 25) == [True, {"acc_num": "33334444", "balance": 25,
+                                                                  "available": True}]
+    assert adopter.tx_update_account("87654321", 2, 25) == [False, None]
+    committed, results = adopter.tx_update_accounts_batch([("87654321", 0, -5), ("00000009", 0, 5)])
+    assert committed == False
+    adopter.flush()
+    adopter.close()
+
+    reopened = MmapBankAdopter(store_path)
+    assert reopened.account_list("87654321")[1][0]["balance"] == 100
+    assert reopened.account_list("87654321")[1][1]["balance"] == 25
+    reopened.close()
+
+
+def test_store_open_fail_not_a_store(tmp_path):
+    """Other files are rejected"""
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"x" * 64)
+    with pytest.raises(ValueError):
+        MmapBankAdopter(str(path))
+
+
+def test_build_store_fail_duplicated_card(tmp_path):
+    """Duplicated card numbers are rejected"""
+    records = [("12345678", test_data["12345678"]), ("12345678", test_data["12345678"])]
+    with pytest.raises(ValueError):
+        build_store(str(tmp_path / "bank.store"), records)
+
+
+def test_build_store_ok_available_by_default(tmp_path):
+    """Accounts without "available" are available, like in TestBankAdopter"""
+    path = str(tmp_path / "bank.store")
+    build_store(path, [("12345678", {"pin": "1234", "accounts": [{"acc_num": "11112222", "balance": 1}]})])
+    adopter = MmapBankAdopter(path)
+    assert adopter.account_list("87654321")[1][0]["available"] == True
+    adopter.close()
+
+
+def test_store_ok_large_dataset(tmp_path):
+    """All cards of a generated dataset are found"""
+    data = make_bank_data(5000, seed=3)
+    path = str(tmp_path / "bank.store")
+    build_store(path, iter(data.items()), n_cards=len(data))
+    adopter = MmapBankAdopter(path)
+    for card_number, record in data.items():
+        assert adopter.validate(card_number, record["pin"])[0]
+        assert adopter.account_list(card_number[::-1])[1] == record["accounts"]
+    adopter.close()
+
+
+def test_store_controller_ok(store):
+    """ATMController works on top of MmapBankAdopter"""
+    ctrl = ATMController(bank=Bank(adopter=store),
+                         reader=TestCardReader(), cashbin=TestCashBin(), printer=TestPrinter())
+    ctrl.insert_card("12345678")
+    ctrl.read_card_number()
+    ctrl.validate_pin_number("1234")
+    ctrl.get_accounts()
+    ctrl.select_account(0)
+    assert ctrl.withdraw(30)["balance"] == 70
+
+
+def test_store_card_numbers_ok(store):
+    """All registered card numbers can be listed for a local filter"""
+    assert sorted(store.card_numbers()) == sorted(test_data)
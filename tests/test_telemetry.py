@@ -0,0 +1,148 @@
+import logging
+import os
+import random
+import time
+
+from app.utils.telemetry import (FileSink, TelemetryLogHandler, TelemetrySinkInterface, TelemetrySpool,
+                                 Uploader, read_segment)
+
+
+class RefusingSink(TelemetrySinkInterface):
+    def send(self, name: str, payload: bytes) -> bool:
+        return False
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_spool_ok_segments(tmp_path):
+    """Events are written in compressed segments, by size or on flush"""
+    spool = TelemetrySpool(str(tmp_path), segment_events=10, segment_interval=60)
+    for i in range(25):
+        spool.emit("event", {"i": i})
+    assert wait_for(lambda: len(spool.segments()) == 2)
+    spool.close()
+    segments = spool.segments()
+    assert len(segments) == 3
+    events = [event for name in segments for event in read_segment(os.path.join(str(tmp_path), name))]
+    assert [event["data"]["i"] for event in events] == list(range(25))
+    assert all(event["kind"] == "event" for event in events)
+
+
+def test_spool_ok_interval(tmp_path):
+    """A segment is written when the oldest event waited long enough"""
+    spool = TelemetrySpool(str(tmp_path), segment_events=100, segment_interval=0.01)
+    spool.emit("event", 1)
+    assert wait_for(lambda: len(spool.segments()) == 1)
+    spool.close()
+
+
+def test_spool_ok_drop_oldest_segments(tmp_path):
+    """The spool never grows over max_bytes, the oldest segments are dropped"""
+    rng = random.Random(0)
+    spool = TelemetrySpool(str(tmp_path), segment_events=50, segment_interval=60, max_bytes=4096)
+    for i in range(20):
+        for _ in range(50):
+            spool.emit("noise", rng.getrandbits(256))     # hardly compressible
+        spool.flush()
+    spool.close()
+    assert spool.size() <= 4096
+    assert spool.dropped_segments > 0
+    assert spool.segments()[-1].endswith("19.jsonl.gz")
+
+
+def test_spool_ok_drop_oldest_events(tmp_path):
+    """The queue is bounded, the oldest events are dropped"""
+    spool = TelemetrySpool(str(tmp_path), segment_events=1000, segment_interval=60, max_pending=5)
+    for i in range(8):
+        spool.emit("event", i)
+    spool.close()
+    events = read_segment(os.path.join(str(tmp_path), spool.segments()[0]))
+    assert [event["data"] for event in events] == [3, 4, 5, 6, 7]
+    assert spool.dropped_events == 3
+
+
+def test_spool_fail_unwritable_directory(tmp_path):
+    """A failed write is counted and logged, the writer keeps running and writes again later"""
+    directory = str(tmp_path / "spool")
+    spool = TelemetrySpool(directory, segment_events=1, segment_interval=60, retry_interval=0.01)
+    os.rename(directory, str(tmp_path / "away"))     # unwritable even for root
+    spool.emit("event", 1)
+    assert wait_for(lambda: spool.lost_events == 1)
+
+    os.rename(str(tmp_path / "away"), directory)
+    spool.emit("event", 2)
+    assert wait_for(lambda: len(spool.segments()) == 1)
+    spool.close()
+    assert [event["data"] for event in read_segment(os.path.join(directory, spool.segments()[0]))] == [2]
+    assert not [name for name in os.listdir(directory) if name.startswith("seg-") and name.endswith(".tmp")]
+
+
+def test_uploader_drain_ok(tmp_path):
+    """Segments are moved to the sink oldest first, only while the ATM is idle"""
+    spool = TelemetrySpool(str(tmp_path / "spool"), segment_events=1000, segment_interval=60)
+    for i in range(3):
+        spool.emit("event", i)
+        spool.flush()
+    idle = [False]
+    uploader = Uploader(spool, FileSink(str(tmp_path / "sink")), idle=lambda: idle[0])
+    assert uploader.drain() == 0
+
+    idle[0] = True
+    assert uploader.drain() == 3
+    assert spool.segments() == []
+    uploaded = sorted(os.listdir(str(tmp_path / "sink")))
+    assert [read_segment(str(tmp_path / "sink" / name))[0]["data"] for name in uploaded] == [0, 1, 2]
+    spool.close()
+
+
+def test_uploader_drain_ok_names_not_reused_after_restart(tmp_path):
+    """After all segments were uploaded and the spool restarts, new segments get new names"""
+    sink = FileSink(str(tmp_path / "sink"))
+    for restart in range(2):
+        spool = TelemetrySpool(str(tmp_path / "spool"), segment_events=1000, segment_interval=60)
+        spool.emit("event", restart)
+        spool.close()
+        assert Uploader(spool, sink).drain() == 1
+    uploaded = sorted(os.listdir(str(tmp_path / "sink")))
+    assert [read_segment(str(tmp_path / "sink" / name))[0]["data"] for name in uploaded] == [0, 1]
+
+
+def test_uploader_drain_fail_sink_refused(tmp_path):
+    """Segments refused by the sink stay in the spool"""
+    spool = TelemetrySpool(str(tmp_path), segment_events=1000, segment_interval=60)
+    spool.emit("event", 1)
+    spool.flush()
+    assert Uploader(spool, RefusingSink()).drain() == 0
+    assert len(spool.segments()) == 1
+    spool.close()
+
+
+def test_controller_send_diagnosis_ok_telemetry(controller, tmp_path):
+    """Diagnosis data goes to the spool"""
+    spool = TelemetrySpool(str(tmp_path), segment_events=1000, segment_interval=60)
+    controller.telemetry = spool
+    diagnosis = controller.send_diagnosis()
+    spool.close()
+    events = read_segment(os.path.join(str(tmp_path), spool.segments()[0]))
+    assert events[0]["kind"] == "diagnosis"
+    assert events[0]["data"] == diagnosis
+
+
+def test_log_handler_ok(tmp_path):
+    """Log records become "log" events"""
+    spool = TelemetrySpool(str(tmp_path), segment_events=1000, segment_interval=60)
+    log = logging.getLogger("test_telemetry")
+    log.propagate = False
+    handler = TelemetryLogHandler(spool)
+    log.addHandler(handler)
+    log.warning("NOT_ENOUGH_MONEY_IN_CASH_BIN:%s > %s", 30, 10)
+    log.removeHandler(handler)
+    spool.close()
+    events = read_segment(os.path.join(str(tmp_path), spool.segments()[0]))
+    assert events == [{"ts": events[0]["ts"], "kind": "log",
+                       "data": {"level": "WARNING", "msg": "NOT_ENOUGH_MONEY_IN_CASH_BIN:30 > 10"}}]
@@ -0,0 +1,97 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.bank.ledger import LedgerBankAdopter
+from app.bank.vectorized import BalanceStats, VectorLedger
+from app.sim.workload import Workload
+
+test_data = {
+    "12345678": {
+        "pin": "1234",
+        "accounts": [
+            {"acc_num": "11112222", "balance": 100, "available": True},
+            {"acc_num": "33334444", "balance": 0,   "available": True},
+        ]
+    },
+    "13572468": {
+        "pin": "8888",
+        "accounts": [
+            {"acc_num": "11113333", "balance": 10, "available": True},
+            {"acc_num": "22224444", "balance": 50, "available": False},
+        ]
+    },
+}
+
+
+@pytest.fixture
+def vector():
+    adopter = LedgerBankAdopter()
+    adopter.set_bank_data(test_data)
+    return VectorLedger(adopter.ledger)
+
+
+def balances(vector: VectorLedger) -> list:
+    return vector.ledger.balances.tolist()
+
+
+def test_vectorized_find_ok(vector):
+    assert vector.find([13572468, 12345678, 99999999]).tolist() == [1, 0, -1]
+    assert vector.account_rows([12345678, 13572468, 13572468, 99999999], [1, 0, 2, 0]).tolist() == [1, 2, -1, -1]
+
+
+def test_vectorized_apply_ok_overdraft_mask(vector):
+    """The items of an account which would end below zero are rejected together"""
+    ok = vector.apply([12345678, 12345678, 12345678, 13572468, 99999999],
+                      [0, 0, 1, 0, 0],
+                      [-80, -30, 5, -10, 10])
+    assert ok.tolist() == [False, False, True, True, False]
+    assert balances(vector) == [100, 5, 0, 50]
+
+    ok = vector.apply([12345678, 12345678], [0, 0], [-120, 30])
+    assert ok.tolist() == [True, True]
+    assert balances(vector) == [10, 5, 0, 50]
+
+
+def test_vectorized_apply_ok_allow_overdraft(vector):
+    assert vector.apply([12345678], [1], [-20], allow_overdraft=True).all()
+    assert vector.stats().overdrawn == 1
+
+
+def test_vectorized_apply_fail_atomic(vector):
+    ok = vector.apply([12345678, 13572468], [0, 0], [10, -20], atomic=True)
+    assert not ok.any()
+    assert balances(vector) == [100, 0, 10, 50]
+
+
+def test_vectorized_charge_and_interest_ok(vector):
+    """Fees and interest only for available accounts"""
+    charged = vector.charge(10)
+    assert charged.tolist() == [True, False, True, False]
+    assert balances(vector) == [90, 0, 0, 50]
+    assert vector.post_interest(1000) == 9
+    assert balances(vector) == [99, 0, 0, 50]
+
+
+def test_vectorized_totals_ok(vector):
+    assert vector.card_totals().tolist() == [100, 60]
+    assert vector.stats() == BalanceStats(accounts=4, total=160, mean=40.0, min=0, max=100, overdrawn=0)
+    assert vector.distribution([0, 10, 100, 1000]).tolist() == [1, 2, 1]
+
+
+def test_vectorized_apply_ok_same_as_tx_update_account():
+    """Without withdrawals, a batch gives the balances of one tx_update_account() per item"""
+    workload = Workload(2000, seed=3)
+    adopter, expected = LedgerBankAdopter(), LedgerBankAdopter()
+    workload.load(adopter)
+    workload.load(expected)
+    ops = list(workload.operations(5000))
+    cards = [int(op.card_number) for op in ops]
+    vector = VectorLedger(adopter.ledger)
+
+    ok = vector.apply(cards, [op.acc_idx for op in ops], [op.amount for op in ops])
+    for op, applied in zip(ops, ok):
+        assert expected.tx_update_account(op.card_number[::-1], op.acc_idx, op.amount)[0] == applied
+    assert adopter.ledger.balances == expected.ledger.balances
+    # the views are released, so the ledger can still grow
+    adopter.ledger.add_card(99999999, 0, [(1, 0, True)])
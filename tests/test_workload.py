@@ -0,0 +1,68 @@
+from collections import Counter
+
+import pytest
+
+from app.bank.adopter import TestBankAdopter
+from app.bank.ledger import LedgerBankAdopter
+from app.sim.workload import OPERATIONS, Workload, popularity
+
+
+def test_workload_records_ok_seeded():
+    """Same seed makes same cards, other seed other cards"""
+    assert list(Workload(100, seed=3).records()) == list(Workload(100, seed=3).records())
+    assert list(Workload(100, seed=3).records()) != list(Workload(100, seed=4).records())
+
+
+def test_workload_records_ok_unique_cards():
+    """Every rank has its own card, accounts are within the limits"""
+    workload = Workload(20000, seed=1, max_accounts=2)
+    records = dict(workload.records())
+    assert len(records) == 20000
+    for record in list(records.values())[:1000]:
+        assert len(record["pin"]) == 4
+        assert 1 <= len(record["accounts"]) <= 2
+        assert all(0 <= acc["balance"] < 1000 for acc in record["accounts"])
+
+
+def test_workload_operations_ok_seeded():
+    """Same seed runs same operations"""
+    first = list(Workload(1000, seed=9).operations(500))
+    assert first == list(Workload(1000, seed=9).operations(500))
+    assert first != list(Workload(1000, seed=10).operations(500))
+
+
+def test_workload_operations_ok_zipf():
+    """Popular cards get most of the operations, zipf=0 is uniform"""
+    skewed = list(Workload(10000, seed=1).operations(5000))
+    uniform = list(Workload(10000, seed=1, zipf=0).operations(5000))
+    assert popularity(skewed, 100) > 0.5
+    assert popularity(uniform, 100) < 0.05
+
+
+def test_workload_operations_ok_mix():
+    """Only the weighted kinds are generated, roughly in their proportion"""
+    ops = list(Workload(1000, seed=2, mix={"balance": 3, "withdraw": 1}).operations(4000))
+    kinds = Counter(op.kind for op in ops)
+    assert set(kinds) == {"balance", "withdraw"}
+    assert 2.5 < kinds["balance"] / kinds["withdraw"] < 3.5
+    with pytest.raises(ValueError):
+        Workload(1000, mix={"transfer": 1})
+
+
+@pytest.mark.parametrize("adopter", [TestBankAdopter(), LedgerBankAdopter()])
+def test_workload_load_ok_operations_match_bank(adopter):
+    """Loaded cards answer the operations as their kind says"""
+    workload = Workload(2000, seed=5)
+    workload.load(adopter)
+    ops = list(workload.operations(2000))
+    assert {op.kind for op in ops} == set(OPERATIONS)
+    for op in ops:
+        if op.kind == "unregistered":
+            assert not adopter.is_registered(op.card_number)
+            continue
+        assert adopter.is_registered(op.card_number)
+        res, token = adopter.validate(op.card_number, op.pin)
+        assert res == (op.kind != "wrong_pin")
+        if res:
+            res, accounts = adopter.account_list(token)
+            assert op.acc_idx < len(accounts)